@@ -56,8 +56,7 @@ class CtaNaivePortfolio(Portfolio):
         print('******** self.target_position is %s' % self.target_position)
 
     def __push_target_position_event(self):
-        e = Event(type_=EVENT_TARGET_POSITION)
-        e.dict_ = self.target_position
+        e = Event(type_=EVENT_TARGET_POSITION, dict_=dict(self.target_position))   # copy: self.target_position keeps changing
         self.event_engine.put(e)
         print('🌈 🌈 🌈  push target_position_event 🌈 🌈 🌈  %s' % e)
 
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import websockets
+from .APIKeyAuth import generate_nonce, generate_signature
+from .utils import json_loads, backoff_delay, NS_PER_SECOND
+from qsUtils import generate_logger, now_ns
+
+try:   # websockets >= 13: new asyncio client, the only one behind websockets.connect since 14
+    from websockets.asyncio.client import connect as ws_connect
+    HEADERS_ARG = 'additional_headers'
+except ImportError:   # legacy client
+    ws_connect = websockets.connect
+    HEADERS_ARG = 'extra_headers'
+
+
+class bitmexAsyncWS(object):
+    """bitMEX WebSocket on an asyncio event loop
+
+    same message handling as bitmexWS (welcome info, subscription, table -> onData),
+    but reading and pinging are tasks of the running loop instead of threads.
+    A frame whose handling raises is logged and skipped. When the socket closes, the receive task
+    reconnects with the jittered backoff of bitmexWS and replays the subscriptions; on_disconnect() /
+    on_reconnect() frame the gap (see set_reconnect).
+    """
+
+    def __init__(self, apiKey=None, apiSecret=None, isTestNet=True, loglevel='debug', logfile=None):
+
+        self.logger = generate_logger('bitmexAsyncWS', loglevel, logfile)
+
+        self.apiKey = apiKey
+        self.apiSecret = apiSecret
+        self.shouldAuth = apiKey is not None and apiSecret is not None
+
+        self.isTestNet = isTestNet
+        self.ws_url = 'wss://testnet.bitmex.com/realtime' if self.isTestNet else 'wss://www.bitmex.com/realtime'
+
+        self.ws = None
+        self.recv_task = None
+        self.ping_task = None
+        self.connected = False
+        self.active = False         # between connect() and exit(): reconnect when the socket closes
+        self.subscriptions = []     # topics replayed on reconnect
+        self.last_recv = None       # now_ns() of the last frame
+        self.reconnect = True
+        self.backoff_min = 1.0      # seconds, first reconnect delay; doubles per failed attempt, up to backoff_max
+        self.backoff_max = 60.0
+        self.reconnects = 0         # successful reconnects
+        self.__welcome = None    # asyncio.Event, set on the welcome info
+
+    def set_reconnect(self, enabled=True, backoff_min=1.0, backoff_max=60.0, stale_timeout=None):
+        """reconnect when the socket closes; call before connect() (stale_timeout: accepted for the
+        settings shared with bitmexWS, unused)
+        """
+        assert 0 < backoff_min <= backoff_max, 'need 0 < backoff_min <= backoff_max'
+        self.reconnect = enabled
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+    async def connect(self, timeout=10):
+        """connect, wait for the welcome info and start pinging
+
+        raises asyncio.TimeoutError (the socket closed) if the welcome info did not come within timeout seconds
+        """
+        self.__welcome = asyncio.Event()
+        self.ws = await self.__open()
+        self.active = True
+        self.recv_task = asyncio.ensure_future(self.__recv_forever())
+        try:
+            await asyncio.wait_for(self.__welcome.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.error('no welcome info within %ss, closing' % timeout)
+            self.active = False
+            self.recv_task.cancel()
+            await self.ws.close()
+            raise
+        self.ping_task = asyncio.ensure_future(self.__send_ping_forever())
+
+    async def __open(self):
+        return await ws_connect(self.ws_url, ping_interval=None, **{HEADERS_ARG: self.__get_auth()})
+
+    async def __recv_forever(self):
+        while True:
+            try:
+                async for message in self.ws:
+                    self.last_recv = now_ns()
+                    try:
+                        self.__on_message(message)
+                    except Exception:
+                        self.logger.exception('frame skipped, handling it failed: %.200s' % message)
+            except websockets.ConnectionClosed as e:
+                self.logger.warning('websocket closed: %s' % e)
+            self.connected = False
+            if not self.active or not self.reconnect:
+                return
+            await self.__reconnect()
+
+    async def __reconnect(self):
+        """connect again with jittered exponential backoff, replay the subscriptions"""
+        gap_start = self.last_recv
+        self.on_disconnect(gap_start)
+        attempt = 0
+        while self.active:
+            delay = backoff_delay(attempt, self.backoff_min, self.backoff_max)
+            self.logger.warning('reconnecting in %.1fs (attempt %d)' % (delay, attempt + 1))
+            await asyncio.sleep(delay)
+            try:
+                self.ws = await self.__open()
+                break
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                self.logger.warning('reconnect failed: %s' % e)
+                attempt += 1
+        if not self.active:
+            return
+        for topic in self.subscriptions:
+            await self.__send_command('subscribe', [topic])
+        self.reconnects += 1
+        gap_end = now_ns()
+        self.logger.warning('reconnected after %.1fs, resubscribed %d topics'
+                            % ((gap_end - gap_start) / NS_PER_SECOND if gap_start else 0, len(self.subscriptions)))
+        self.on_reconnect(gap_start, gap_end)
+
+    def on_disconnect(self, gap_start):
+        """the socket closed (nothing received after gap_start); expected to be overwritten"""
+        pass
+
+    def on_reconnect(self, gap_start, gap_end):
+        """connected again and resubscribed, data between gap_start and gap_end is lost; expected to be overwritten"""
+        pass
+
+    async def __send_ping_forever(self):
+        while self.active:
+            if self.connected:
+                self.logger.debug('>>> send ping')
+                try:
+                    await self.ws.send('ping')
+                except websockets.ConnectionClosed:
+                    pass   # the receive task reconnects
+            await asyncio.sleep(5)
+
+    async def exit(self):
+        self.active = False
+        self.connected = False
+        self.logger.info('Exiting ...')
+        for task in (self.ping_task, self.recv_task):
+            if task is not None:
+                task.cancel()
+        if self.ws:
+            await self.ws.close()
+        self.logger.info('Exit bitmexAsyncWS (intended)')
+
+    def __get_auth(self):
+        """return auth headers"""
+        if self.shouldAuth is False:
+            return []
+        nonce = generate_nonce()
+        return [
+            ('api-nonce', str(nonce)),
+            ('api-signature', generate_signature(self.apiSecret, 'GET', '/realtime', nonce, '')),
+            ('api-key', self.apiKey),
+        ]
+
+    async def __send_command(self, command, args=None):
+        """send a row command"""
+        if args is None:
+            args = []
+        await self.ws.send(json.dumps({'op': command, 'args': args}))
+
+    def __on_message(self, message):
+        """Handler for parsing WS messages"""
+
+        if message == 'pong':
+            return
+
+        msg = json_loads(message)
+
+        # 1. table (most frequent)
+        if 'table' in msg:
+            self.onData(msg)
+
+        # 2. Welcome info
+        elif 'info' in msg:
+            if msg['info'] == 'Welcome to the BitMEX Realtime API.':
+                self.connected = True
+                self.__welcome.set()
+                self.logger.info('Successful connected to BitMEX WebSocket API')
+
+        # 3. subscription
+        elif 'subscribe' in msg:
+            if msg['success']:
+                self.logger.info('Subscribe to %s' % msg['subscribe'])
+            else:
+                self.logger.warning('Subscription not success: %s' % msg)
+        elif 'unsubscribe' in msg:
+            self.logger.info('Unsubscribe from %s: %s' % (msg['unsubscribe'], msg.get('success')))
+        else:
+            self.logger.warning('Unclassified msg; %s' % msg)
+
+    def onData(self, msg):
+        """expected to be overwritten"""
+        pass
+
+    async def subscribe_topic(self, topic):
+        # {"op": "subscribe", "args": [<SubscriptionTopic>]}
+        if topic not in self.subscriptions:
+            self.subscriptions.append(topic)
+        await self.__send_command('subscribe', [topic])
+
+    async def resubscribe_topic(self, topic):
+        """unsubscribe and subscribe topic again: BitMEX sends a fresh partial (eg. resync an L2 book)"""
+        await self.__send_command('unsubscribe', [topic])
+        await self.__send_command('subscribe', [topic])
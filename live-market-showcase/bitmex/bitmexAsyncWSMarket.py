@@ -0,0 +1,92 @@
+from .bitmexAsyncWS import bitmexAsyncWS
+from .bitmexWSMarket import (quote_to_orderbook, trade_to_tick, trades_to_tick_batches, rows_to_depth_updates,
+                             instrument_to_open_interest)
+from qsDataStructure import FeedGap
+from qsUtils import generate_logger, now_ns
+
+
+class bitmexAsyncWSMarket(bitmexAsyncWS):
+    """bitmexAsyncWS subscribing market data
+
+    Instead of market_data_q, every Tick / Orderbook is handed to the DataHandler callbacks
+    on the loop which reads the socket: no thread hand-off between socket and strategy.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logger = generate_logger('bitmexAsyncWS_Market')
+        self.symbols = {}
+        self.on_tick = None         # callable(Tick)
+        self.on_orderbook = None    # callable(Orderbook)
+        self.on_tick_batch = None   # callable(TickBatch), if set a trade frame is handed over as TickBatch
+        self.on_depth = None        # callable(DepthUpdate)
+        self.on_open_interest = None   # callable(OpenInterest)
+        self.on_feed_gap = None        # callable(FeedGap), per symbol when the socket closes / is back
+        self.tick_pool = None        # MarketDataPool(Tick) or None
+        self.orderbook_pool = None   # MarketDataPool(Orderbook) or None
+
+    def add_market_data_handler(self, on_tick, on_orderbook):
+        self.on_tick = on_tick
+        self.on_orderbook = on_orderbook
+
+    def add_tick_batch_handler(self, on_tick_batch):
+        self.on_tick_batch = on_tick_batch
+
+    def add_depth_handler(self, on_depth):
+        self.on_depth = on_depth
+
+    def add_open_interest_handler(self, on_open_interest):
+        self.on_open_interest = on_open_interest
+
+    def add_feed_gap_handler(self, on_feed_gap):
+        self.on_feed_gap = on_feed_gap
+
+    def on_disconnect(self, gap_start):
+        if self.on_feed_gap is not None:
+            for symbol in self.symbols:
+                self.on_feed_gap(FeedGap(symbol=symbol, start=gap_start, receive_time=now_ns()))
+
+    def on_reconnect(self, gap_start, gap_end):
+        if self.on_feed_gap is not None:
+            for symbol in self.symbols:
+                self.on_feed_gap(FeedGap(symbol=symbol, start=gap_start, end=gap_end, receive_time=now_ns()))
+
+    def add_pools(self, tick_pool, orderbook_pool):
+        """take Tick / Orderbook from pools, released by the DataHandler"""
+        self.tick_pool = tick_pool
+        self.orderbook_pool = orderbook_pool
+
+    async def subscribe(self, symbol, trade=True, orderbook=False, depth=None, instrument=False):
+        """depth: None, 'orderBookL2' or 'orderBookL2_25'; instrument: open interest"""
+        self.symbols[symbol] = dict(trade=trade, orderbook=orderbook, depth=depth, instrument=instrument)
+        if trade:
+            await self.subscribe_topic('trade:%s' % symbol)
+        if orderbook:
+            await self.subscribe_topic('quote:%s' % symbol)
+        if depth:
+            await self.subscribe_topic('%s:%s' % (depth, symbol))
+        if instrument:
+            await self.subscribe_topic('instrument:%s' % symbol)
+
+    def onData(self, msg):
+        tb = msg.get('table')
+        receive_time = now_ns()
+        if tb == 'trade' and self.on_tick_batch is not None:
+            for batch in trades_to_tick_batches(msg['data'], receive_time):
+                self.on_tick_batch(batch)
+        elif tb == 'trade':
+            on_tick = self.on_tick
+            for trade in msg['data']:
+                on_tick(trade_to_tick(trade, self.tick_pool, receive_time))
+        elif tb in ('orderBookL2', 'orderBookL2_25') and self.on_depth is not None:
+            for update in rows_to_depth_updates(msg['action'], msg['data'], receive_time):
+                self.on_depth(update)
+        elif tb == 'instrument' and self.on_open_interest is not None:
+            for row in msg['data']:
+                oi = instrument_to_open_interest(row, receive_time)
+                if oi is not None:
+                    self.on_open_interest(oi)
+        elif tb == 'quote':
+            on_orderbook = self.on_orderbook
+            for quote in msg['data']:
+                on_orderbook(quote_to_orderbook(quote, self.orderbook_pool, receive_time))
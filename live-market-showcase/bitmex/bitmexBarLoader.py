@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import time
+from .utils import VALID_BAR_TYPE, NS_PER_SECOND, iso_to_epoch_ns, epoch_ns_to_iso, bar_width_ns, bucket_td_ts
+from qsDataStructure import Bar
+from qsUtils import generate_logger
+
+
+# row: [start, open, high, low, close, volume, amount, ticks, buy_volume, sell_volume], start in epoch ns,
+#      None for what the source does not give (eg. buy / sell volume of trade/bucketed)
+START, OPEN, HIGH, LOW, CLOSE, VOLUME, AMOUNT, TICKS, BUY_VOLUME, SELL_VOLUME = range(10)
+
+
+def source_of(bar_type):
+    """widest trade/bucketed binSize dividing bar_type ('7m' -> '1m', '4h' -> '1h'), None: build from trades"""
+    width = bar_width_ns(bar_type)
+    for bin_size in sorted(VALID_BAR_TYPE, key=bar_width_ns, reverse=True):
+        if width % bar_width_ns(bin_size) == 0:
+            return bin_size
+    return None
+
+
+def sources_of(bar_types):
+    """{bar_type: source} for the bar_types of one symbol: source_of(), and for the ones built from trades
+    a single trade source, the gcd of their widths ('15s', '20s' -> '5s'), so the trades are fetched once
+    """
+    sources = {bar_type: source_of(bar_type) for bar_type in bar_types}
+    widths = [bar_width_ns(bar_type) for bar_type, source in sources.items() if source is None]
+    if widths:
+        trade_source = '%ds' % (math.gcd(*widths) // NS_PER_SECOND)
+        for bar_type, source in sources.items():
+            if source is None:
+                sources[bar_type] = trade_source
+    return sources
+
+
+def aggregate(rows, width):
+    """rows sorted by start -> rows of `width` ns (a multiple of the width of rows)"""
+    out = []
+    for row in rows:
+        start = row[START] - row[START] % width
+        if out and out[-1][START] == start:
+            agg = out[-1]
+            if row[HIGH] > agg[HIGH]:
+                agg[HIGH] = row[HIGH]
+            if row[LOW] < agg[LOW]:
+                agg[LOW] = row[LOW]
+            agg[CLOSE] = row[CLOSE]
+            for k in (VOLUME, AMOUNT, TICKS, BUY_VOLUME, SELL_VOLUME):
+                agg[k] = None if agg[k] is None or row[k] is None else agg[k] + row[k]
+        else:
+            out.append([start] + list(row[1:]))
+    return out
+
+
+class bitmexBarLoader(object):
+    """historical bars for the warm-up of strategies
+
+    a bar_type is aggregated from its source: the widest trade/bucketed binSize dividing it
+    (bitmexREST.query_history_bars), or the trades (query_history_ticks) for bar_types below 1m.
+    The trades of a symbol are fetched once, bucketed by the gcd of the widths built from them (see sources_of).
+    Every (symbol, source) is fetched once for the longest lookback that needs it, in parallel,
+    and cached as json in cache_dir: only the bins after the cached ones are queried next time.
+
+    A failed page is retried by bitmexREST._page_query (see bitmexREST.set_retry); once the retries are
+    used up, load() raises IOError.
+    """
+
+    def __init__(self, rest, cache_dir=None, workers=4, loglevel='debug', logfile=None):
+        self.rest = rest              # bitmexREST
+        self.cache_dir = cache_dir    # None: no cache
+        self.workers = workers
+        self.logger = generate_logger('bitmexBarLoader', loglevel, logfile)
+
+    def load(self, lookback, end=None):
+        """lookback: {(symbol, bar_type): n} -> {(symbol, bar_type): [Bar, ...]}, the last n closed bars, oldest first
+
+        end: epoch ns, now by default; bars closed at `end` only
+        """
+        if end is None:
+            end = time.time_ns()
+        bar_types = {}   # {symbol: [bar_type, ...]}
+        for symbol, bar_type in lookback:
+            bar_types.setdefault(symbol, []).append(bar_type)
+        sources = {(symbol, bar_type): source for symbol, bt in bar_types.items()
+                   for bar_type, source in sources_of(bt).items()}
+        starts = {}   # {(symbol, source): earliest start needed}
+        for (symbol, bar_type), n in lookback.items():
+            width = bar_width_ns(bar_type)
+            start = end - end % width - n * width
+            key = (symbol, sources[(symbol, bar_type)])
+            starts[key] = min(start, starts.get(key, start))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {key: pool.submit(self.fetch, key[0], key[1], start, end) for key, start in starts.items()}
+            rows = {key: future.result() for key, future in futures.items()}
+
+        result = {}
+        for (symbol, bar_type), n in lookback.items():
+            width = bar_width_ns(bar_type)
+            source_rows = rows[(symbol, sources[(symbol, bar_type)])]
+            start = end - end % width - n * width
+            bars = [self.__to_bar(symbol, bar_type, width, row) for row in aggregate(source_rows, width)
+                    if row[START] >= start and row[START] + width <= end]
+            result[(symbol, bar_type)] = bars[-n:] if n else []
+            self.logger.info('warm-up %s %s: %d bars' % (symbol, bar_type, len(result[(symbol, bar_type)])))
+        return result
+
+    def fetch(self, symbol, source, start, end):
+        """rows of source (binSize, or bar_type built from trades) with start in [start, end), closed at end"""
+        width = bar_width_ns(source)
+        cached_from, cached_to, cached = self.__read_cache(symbol, source)
+        if cached_from is not None and cached_from <= start <= cached_to:
+            query_start = cached_to
+        else:
+            cached_from, cached = start, []
+            query_start = start
+        if query_start + width <= end:
+            new = self.__query(symbol, source, query_start, end)
+            new = [row for row in new if row[START] + width <= end]
+            if cached:
+                new = [row for row in new if row[START] > cached[-1][START]]
+            cached.extend(new)
+            self.__write_cache(symbol, source, cached_from, end - end % width, cached)
+        return [row for row in cached if start <= row[START] < end]
+
+    def __query(self, symbol, source, start, end):
+        width = bar_width_ns(source)
+        if source in VALID_BAR_TYPE:
+            # timestamp of a trade/bucketed row is the end of its bin
+            data = self.rest.query_history_bars(symbol, epoch_ns_to_iso(start + width), epoch_ns_to_iso(end), source)
+            rows = []
+            for d in data:
+                if d.get('close') is None:
+                    continue
+                volume, vwap = d.get('volume'), d.get('vwap')
+                rows.append([iso_to_epoch_ns(d['timestamp']) - width, d['open'], d['high'], d['low'], d['close'],
+                             volume, vwap * volume if vwap is not None and volume is not None else None,
+                             d.get('trades'), None, None])
+            return rows
+        # below 1m: bucket the trades
+        data = self.rest.query_history_ticks(symbol, epoch_ns_to_iso(start), epoch_ns_to_iso(end))
+        rows = []
+        for d in data:
+            price, size = d['price'], d['size']
+            rows.append([iso_to_epoch_ns(d['timestamp']), price, price, price, price, size, price * size, 1,
+                         size if d.get('side') == 'Buy' else 0, size if d.get('side') == 'Sell' else 0])
+        return aggregate(rows, width)
+
+    @staticmethod
+    def __to_bar(symbol, bar_type, width, row):
+        td, ts = bucket_td_ts(row[START], bar_type)
+        bar = Bar(symbol=symbol, bar_type=bar_type, td=td, ts=ts, open=row[OPEN], high=row[HIGH], low=row[LOW],
+                  close=row[CLOSE], timestamp=row[START] + width, start=row[START],
+                  volume=row[VOLUME], amount=row[AMOUNT], ticks=row[TICKS],
+                  buy_volume=row[BUY_VOLUME], sell_volume=row[SELL_VOLUME])
+        bar.vwap = bar.amount / bar.volume if bar.volume and bar.amount is not None else None
+        return bar
+
+    def __cache_file(self, symbol, source):
+        return os.path.join(self.cache_dir, '%s_%s.json' % (symbol, source))
+
+    def __read_cache(self, symbol, source):
+        """(from, to, rows): rows with start in [from, to) were queried"""
+        if self.cache_dir is None:
+            return None, None, []
+        try:
+            with open(self.__cache_file(symbol, source)) as f:
+                cache = json.load(f)
+            return cache['from'], cache['to'], cache['rows']
+        except (IOError, ValueError, KeyError):
+            return None, None, []
+
+    def __write_cache(self, symbol, source, from_, to, rows):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.__cache_file(symbol, source)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'symbol': symbol, 'source': source, 'from': from_, 'to': to, 'rows': rows}, f)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,244 @@
+from bisect import bisect_left, bisect_right
+from .bitmexInstruments import instruments
+from .bitmexTimestamp import to_epoch_ns
+
+
+# id -> price of orderBookL2 rows: price = (100000000 * index - id) * tick
+# only needed when an update / delete carries an id not seen in partial / insert
+L2_ID_SCHEME = {
+    'XBTUSD': (88, 0.01),   # (instrument index, price tick of the id scheme)
+}
+
+
+def l2_id_to_price(symbol, id_):
+    """price of an orderBookL2 row id, None if the id scheme of symbol is unknown"""
+    scheme = L2_ID_SCHEME.get(symbol)
+    if scheme is None:
+        return None
+    index, tick = scheme
+    return round((100000000 * index - id_) * tick, 8)
+
+
+DEFAULT_TICK = 1e-8   # price grid of a symbol missing from bitmexInstruments
+
+
+class fenwickTree(object):
+    """sparse Fenwick tree (binary indexed tree) over the integers [1, 2 ** bits]
+
+    add(i, delta) / prefix(i) (sum of [1, i]) visit at most `bits` nodes, kept in a dict
+    """
+
+    def __init__(self, bits=48):
+        self.size = 1 << bits
+        self.tree = {}
+
+    def add(self, i, delta):
+        tree = self.tree
+        size = self.size
+        while i <= size:
+            tree[i] = tree.get(i, 0) + delta
+            i += i & -i
+
+    def prefix(self, i):
+        tree = self.tree
+        total = 0
+        while i > 0:
+            total += tree.get(i, 0)
+            i &= i - 1
+        return total
+
+
+class bookSide(object):
+    """price levels of one side, kept sorted best first in parallel lists
+
+    lookup / best level by bisect: O(log n); a new or removed level shifts the lists (memmove)
+    cumulative depth: O(log U) prefix sum of a Fenwick tree over the price grid (price / tick), best first;
+    built on the first cumulative query, then maintained by set() / remove()
+    """
+
+    OFFSET = 1 << 47   # grid index of key 0, keys are negative for bids
+
+    def __init__(self, descending, tick=DEFAULT_TICK):
+        self.descending = descending   # bids: True
+        self.tick = tick               # price grid of the Fenwick tree
+        self.keys = []                 # price (asks) or -price (bids), ascending: best first
+        self.prices = []
+        self.sizes = []
+        self.__fenwick = None          # fenwickTree of sizes by grid index of key, None until cumulative()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.keys = []
+        self.prices = []
+        self.sizes = []
+        self.__fenwick = None
+
+    def __grid(self, key):
+        return round(key / self.tick) + self.OFFSET
+
+    def __tree(self):
+        if self.__fenwick is None:
+            self.__fenwick = fenwickTree()
+            for key, size in zip(self.keys, self.sizes):
+                self.__fenwick.add(self.__grid(key), size)
+        return self.__fenwick
+
+    def __key(self, price):
+        return -price if self.descending else price
+
+    def __index(self, price):
+        """index of price, or -1"""
+        key = self.__key(price)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def set(self, price, size):
+        key = self.__key(price)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            delta = size - self.sizes[i]
+            self.sizes[i] = size
+        else:
+            delta = size
+            self.keys.insert(i, key)
+            self.prices.insert(i, price)
+            self.sizes.insert(i, size)
+        if self.__fenwick is not None and delta:
+            self.__fenwick.add(self.__grid(key), delta)
+
+    def remove(self, price):
+        i = self.__index(price)
+        if i >= 0:
+            if self.__fenwick is not None:
+                self.__fenwick.add(self.__grid(self.keys[i]), -self.sizes[i])
+            del self.keys[i]
+            del self.prices[i]
+            del self.sizes[i]
+
+    def best(self, n=1):
+        """[(price, size), ...] of the best n levels"""
+        return list(zip(self.prices[:n], self.sizes[:n]))
+
+    def depth_at(self, price):
+        """size at price, 0 if no level"""
+        i = self.__index(price)
+        return self.sizes[i] if i >= 0 else 0
+
+    def cumulative(self, n=None):
+        """total size of the best n levels (all levels if n is None)"""
+        if n is None or n > len(self.keys):
+            n = len(self.keys)
+        return self.__prefix(n)
+
+    def cumulative_to(self, price):
+        """total size of the levels at price or better"""
+        return self.__prefix(bisect_right(self.keys, self.__key(price)))
+
+    def __prefix(self, n):
+        """total size of the best n levels, 0 < n <= len"""
+        if n <= 0:
+            return 0
+        return self.__tree().prefix(self.__grid(self.keys[n - 1]))
+
+
+class bitmexOrderBookL2(object):
+    """full depth book of one symbol maintained from orderBookL2 / orderBookL2_25 messages
+
+    apply(action, rows) applies partial / insert / update / delete incrementally:
+    rows of insert carry id, side, size, price; update carries id, side, size; delete carries id, side.
+    The price of an id is remembered from partial / insert (see L2_ID_SCHEME for unseen ids).
+    Messages before the first partial are dropped. An update / delete of an id whose price is unknown
+    means the book has drifted: it is reset (ready False, out_of_sync counted) until the next partial.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        tick = instruments[symbol].tickSize if symbol in instruments else DEFAULT_TICK
+        self.bids = bookSide(descending=True, tick=tick)
+        self.asks = bookSide(descending=False, tick=tick)
+        self.ready = False          # got the partial
+        self.timestamp = None       # timestamp (epoch ns) of the last row applied (if rows carry one)
+        self.updates = 0            # messages applied
+        self.out_of_sync = 0        # resets on an unknown id
+        self.__price_of = {}        # {id: price}
+
+    def reset(self):
+        """feed gap: drop the book, messages are ignored until the next partial"""
+        self.bids.clear()
+        self.asks.clear()
+        self.__price_of = {}
+        self.ready = False
+
+    def __side(self, side):
+        return self.bids if side == 'Buy' else self.asks
+
+    def apply(self, action, rows):
+        if action == 'partial':
+            self.bids.clear()
+            self.asks.clear()
+            self.__price_of = {}
+            self.ready = True
+            action = 'insert'
+        elif not self.ready:
+            return
+        price_of = self.__price_of
+        if action == 'insert':
+            for row in rows:
+                price_of[row['id']] = row['price']
+                self.__side(row['side']).set(row['price'], row['size'])
+        elif action == 'update':
+            for row in rows:
+                price = price_of.get(row['id'])
+                if price is None:
+                    price = self.__unseen_price(row)
+                    if price is None:
+                        return
+                    price_of[row['id']] = price
+                self.__side(row['side']).set(price, row['size'])
+        elif action == 'delete':
+            for row in rows:
+                price = price_of.pop(row['id'], None)
+                if price is None:
+                    price = self.__unseen_price(row)
+                    if price is None:
+                        return
+                self.__side(row['side']).remove(price)
+        if rows and 'timestamp' in rows[-1]:
+            self.timestamp = to_epoch_ns(rows[-1]['timestamp'])
+        self.updates += 1
+
+    def __unseen_price(self, row):
+        """price of an id not seen in partial / insert: the row's, else L2_ID_SCHEME; None resets the book"""
+        price = row.get('price')
+        if price is None:
+            price = l2_id_to_price(self.symbol, row['id'])
+        if price is None:
+            self.reset()
+            self.out_of_sync += 1
+        return price
+
+    def best_bid(self):
+        """(price, size) or None"""
+        return (self.bids.prices[0], self.bids.sizes[0]) if self.bids.keys else None
+
+    def best_ask(self):
+        """(price, size) or None"""
+        return (self.asks.prices[0], self.asks.sizes[0]) if self.asks.keys else None
+
+    def levels(self, n=10):
+        """(bids, asks) of the best n levels, each [(price, size), ...] best first"""
+        return self.bids.best(n), self.asks.best(n)
+
+    def depth_at(self, side, price):
+        """size at price on side 'Buy' / 'Sell'"""
+        return self.__side(side).depth_at(price)
+
+    def cumulative_depth(self, side, n=None, price=None):
+        """total size on side 'Buy' / 'Sell' of the best n levels, or of the levels at price or better"""
+        if price is not None:
+            return self.__side(side).cumulative_to(price)
+        return self.__side(side).cumulative(n)
@@ -20,15 +20,29 @@ class bitmexREST(object):
         
         self.base_url = 'https://testnet.bitmex.com/api/v1/' if self.isTestNet else 'https://www.bitmex.com/api/v1/'
         self.clientOrderID = 0
+
+        # _page_query: a failed page (connection error, timeout, 429, 5xx) is retried max_retries times
+        self.max_retries = 5
+        self.backoff = 1.0          # seconds before the first retry, doubled per retry up to max_backoff
+        self.max_backoff = 30.0
+        self.timeout = 10.0         # seconds per page request
+
+    def set_retry(self, max_retries=5, backoff=1.0, max_backoff=30.0, timeout=10.0):
+        """bounded retries of the pages of _page_query (query_history_*)"""
+        assert max_retries >= 0, 'max_retries must be >= 0. max_retries is %s' % max_retries
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
         
-    def _send_http_request(self, verb, path, postdict=None, query=None):
-        """send HTTP request"""
+    def _send_http_request(self, verb, path, postdict=None, query=None, timeout=None):
+        """send HTTP request (timeout: seconds, None waits forever)"""
         url = self.base_url + path
         if self.apiKey is not None and self.apiSecret is not None:
             auth = APIKeyAuthWithExpires(self.apiKey, self.apiSecret)
         else:
             auth = None
-        return requests.request(verb, url, json=postdict, params=query, auth=auth)
+        return requests.request(verb, url, json=postdict, params=query, auth=auth, timeout=timeout)
     
     def place_order(self, symbol, side, qty, limit_price, text=''):
         """place order"""
@@ -160,25 +174,46 @@ class bitmexREST(object):
     def _page_query(self, verb, endpoint, params, count=500):
         """通用功能：分页查询
         bitmex限制查询每次最多500条，利用params中的 start & count 来分页查询
+        a failed page is retried with exponential backoff (Retry-After of a 429 honored), see set_retry();
+        raises IOError once the retries are used up, or at once on a 4xx other than 429
         """
         # print('Calling _page_query....')
         result = []
         params['count'] = count
         params['start'] = 0
         while True:
-            res = self._send_http_request(verb, endpoint, params)
-            if res.ok:
-                data = res.json()
-                result.extend(data)
-                if len(data) < count:
-                    break
-                else:
-                    params['start'] += count
-                    # print('new page...')
+            data = self.__query_page(verb, endpoint, params)
+            result.extend(data)
+            if len(data) < count:
+                break
             else:
-                self.logger.warning('_page_query() res.ok is not True\nstatus_code:%d\n%s' % (res.status_code, res.content))
+                params['start'] += count
+                # print('new page...')
         return result
 
+    def __query_page(self, verb, endpoint, params):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = self._send_http_request(verb, endpoint, params, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = repr(e)
+            else:
+                if res.ok:
+                    return res.json()
+                error = 'status_code %d: %s' % (res.status_code, res.content[:200])
+                if res.status_code != 429 and res.status_code < 500:
+                    break   # bad request, retrying does not help
+                retry_after = res.headers.get('Retry-After')
+                if retry_after is not None and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            if attempt == self.max_retries:
+                break
+            self.logger.warning('_page_query() %s %s failed (%s), retry in %.1fs' % (verb, endpoint, error, delay))
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+        raise IOError('%s %s %s failed: %s' % (verb, endpoint, params, error))
+
 
 def test_orders():
     """下单接口测试"""
@@ -0,0 +1,205 @@
+"""
+Raw websocket tape
+
+directory: bitmex-YYYYmmdd-HHMMSS-NNNN.tape.gz, one gzip file per rotation, in recording order
+line:      receive time (epoch ns, qsUtils.now_ns()) TAB raw frame as received (pongs excluded)
+
+Frames of a multiplexed socket are recorded as they travel: [0, stream id, name, payload].
+"""
+
+import collections
+import glob
+import gzip
+import os
+import threading
+import time
+import zlib
+from .bitmexWSMarket import bitmexWSMarket
+from .utils import json_loads
+from qsUtils import generate_logger
+
+
+TAPE_SUFFIX = '.tape.gz'
+
+
+class bitmexTapeRecorder(object):
+    """append-only tape of the raw frames of bitmexWS sockets (see bitmexWS.add_tape_recorder)
+
+    the socket thread only appends (receive time, frame) to a deque, never waits on the disk: past `maxsize`
+    pending frames the newest ones are dropped and counted. A background writer compresses them into the
+    current file, flushed every `flush_interval` seconds, and starts a new file past `rotate_bytes`
+    (uncompressed) or `rotate_seconds`.
+    """
+
+    def __init__(self, directory, rotate_bytes=64 << 20, rotate_seconds=3600, flush_interval=0.5, maxsize=1 << 20,
+                 compresslevel=6, loglevel='info', logfile=None):
+        self.logger = generate_logger('bitmexTape', loglevel, logfile)
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.compresslevel = compresslevel
+        self.recorded = 0                      # frames written
+        self.dropped = 0                       # frames dropped, writer behind by more than maxsize
+        self.files = []                        # paths written, oldest first
+        self.__pending = collections.deque()   # (receive ns, frame)
+        self.__file = None
+        self.__file_bytes = 0                  # uncompressed bytes in the current file
+        self.__file_opened = 0                 # time.monotonic() of the current file
+        self.__seq = 0
+        self.__run_thread = None
+        self.__active = False
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.__active = True
+        self.__run_thread = threading.Thread(target=self.__run, name='bitmexTapeRecorder')
+        self.__run_thread.start()
+
+    def close(self):
+        """write what is pending, close the current file (nothing to do if open() was not called)"""
+        if self.__run_thread is None:
+            return
+        self.__active = False
+        self.__run_thread.join()
+        self.__run_thread = None
+        self.__drain()
+        self.__close_file()
+        if self.dropped:
+            self.logger.warning('%d frames dropped (writer behind by more than %d)' % (self.dropped, self.maxsize))
+
+    # ---- recording side (called on the socket threads) ----
+
+    def record(self, receive_time, message):
+        if len(self.__pending) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.__pending.append((receive_time, message))
+
+    # ---- writer thread ----
+
+    def __run(self):
+        while self.__active:
+            if self.__drain():
+                self.__file.flush()   # a crash loses at most flush_interval of frames
+            time.sleep(self.flush_interval)
+
+    def __drain(self):
+        pending = self.__pending
+        n = 0
+        while pending:
+            if self.__file is None or self.__file_bytes >= self.rotate_bytes \
+                    or time.monotonic() - self.__file_opened >= self.rotate_seconds:
+                self.__rotate()
+            receive_time, message = pending.popleft()
+            if isinstance(message, bytes):
+                message = message.decode('utf-8')
+            line = ('%d\t%s\n' % (receive_time, message)).encode('utf-8')
+            self.__file.write(line)
+            self.__file_bytes += len(line)
+            n += 1
+        self.recorded += n
+        return n
+
+    def __rotate(self):
+        self.__close_file()
+        self.__seq += 1
+        path = os.path.join(self.directory, 'bitmex-%s-%04d%s' % (time.strftime('%Y%m%d-%H%M%S', time.gmtime()),
+                                                                  self.__seq, TAPE_SUFFIX))
+        self.__file = gzip.open(path, 'ab', compresslevel=self.compresslevel)
+        self.__file_bytes = 0
+        self.__file_opened = time.monotonic()
+        self.files.append(path)
+        self.logger.info('Recording websocket frames to %s' % path)
+
+    def __close_file(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+def tape_files(path):
+    """a tape file, or the tape files of a directory in recording order"""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*' + TAPE_SUFFIX)))
+    return [path]
+
+
+def read_tape(path):
+    """yield (receive ns, raw frame str) of a tape file / directory
+
+    a file cut short (recorder killed before close()) is read up to its last complete line
+    """
+    for file in tape_files(path):
+        with gzip.open(file, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    receive_time, message = line.split('\t', 1)
+                    yield int(receive_time), message[:-1]
+            except (EOFError, zlib.error, OSError):
+                pass
+
+
+class _directQueue(object):
+    """market_data_q stand-in: put() hands every record straight to data_handler.process()"""
+
+    def __init__(self, data_handler):
+        self.put = data_handler.process
+
+
+class bitmexTapeReplayer(object):
+    """play a tape back, at recorded pace x speed or as fast as possible (speed=None)
+
+    every table frame goes through consumer.onData(), with consumer.last_recv set to the recorded receive
+    time: the market data is rebuilt by the live code path of bitmexWSMarket and stamped as it was live.
+    Multiplexed frames are unwrapped; frames of tables the consumer has no handler for (eg. a trading
+    stream on the same tape) are ignored.
+    With event_engine (not started), what a frame queued is dispatched on this thread before the next frame,
+    as eventReplayer does: strategies see the DataHandler as it was at that frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def replay(self, consumer=None, market_data_q=None, data_handler=None, event_engine=None, speed=None,
+               tick_batch=False, on_ready=None):
+        """target, first given of:
+            consumer        a bitmexWSMarket (with its market_data_q)
+            market_data_q   a queue, fed by an unconnected bitmexWSMarket
+            data_handler    process() called directly, on this thread
+        on_ready(): called once every symbol of data_handler got its first tick (eg. strategy on_init)
+        """
+        if consumer is None:
+            consumer = bitmexWSMarket(loglevel='info')
+            consumer.add_market_data_q(market_data_q if market_data_q is not None else _directQueue(data_handler))
+            consumer.set_tick_batch(tick_batch)
+        ready = on_ready is None or data_handler is None
+        t0_recorded = None
+        t0_wall = time.monotonic()
+        n = 0
+        for receive_time, message in read_tape(self.path):
+            msg = json_loads(message)
+            if isinstance(msg, list):   # multiplexed: [0, stream id, name, payload]
+                if msg[0] != 0:
+                    continue
+                msg = msg[3]
+            if 'table' not in msg:
+                continue
+            if t0_recorded is None:
+                t0_recorded = receive_time
+            if speed:
+                delay = (receive_time - t0_recorded) / 1e9 / speed - (time.monotonic() - t0_wall)
+                if delay > 0:
+                    time.sleep(delay)
+            consumer.last_recv = receive_time
+            consumer.onData(msg)
+            if not ready and all(data_handler.get_current_tick(s) is not None for s in data_handler.symbols):
+                ready = True
+                on_ready()
+            if event_engine is not None:
+                event_engine.run_pending()
+            n += 1
+        return n
@@ -0,0 +1,49 @@
+import datetime
+
+
+NS_PER_SECOND = 1000000000
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_MINUTE_CACHE_SIZE = 4096
+_minute_cache = {}   # {'2019-01-07T14:19': epoch ns of the minute}
+
+
+def _minute_ns(prefix):
+    """'2019-01-07T14:19' -> epoch nanoseconds, cached"""
+    t = _minute_cache.get(prefix)
+    if t is None:
+        days = datetime.date(int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10])).toordinal() - _EPOCH_ORDINAL
+        t = (days * 86400 + int(prefix[11:13]) * 3600 + int(prefix[14:16]) * 60) * NS_PER_SECOND
+        if len(_minute_cache) >= _MINUTE_CACHE_SIZE:
+            _minute_cache.clear()
+        _minute_cache[prefix] = t
+    return t
+
+
+def iso_to_epoch_ns(x):
+    """'2018-09-29T06:17:34.271Z' -> epoch nanoseconds (UTC)
+
+    fixed offsets of the BitMEX format: the 'YYYY-MM-DDTHH:MM' prefix is parsed once per minute (cached),
+    then only seconds and milliseconds. Other fraction lengths ('...:34Z', '...:34.271123Z') are accepted.
+    """
+    t = _minute_cache.get(x[:16])
+    if t is None:
+        t = _minute_ns(x[:16])
+    if len(x) == 24:
+        return t + int(x[17:19]) * NS_PER_SECOND + int(x[20:23]) * 1000000
+    frac = x[20:-1]
+    return t + int(x[17:19]) * NS_PER_SECOND + (int(frac[:9].ljust(9, '0')) if frac else 0)
+
+
+def to_epoch_ns(x):
+    """epoch nanoseconds of an ISO string, an int passes through (None too)"""
+    return iso_to_epoch_ns(x) if isinstance(x, str) else x
+
+
+def epoch_ns_to_iso(t):
+    """epoch nanoseconds -> '2018-09-29T06:17:34.271Z' (UTC, milliseconds)"""
+    days, ns = divmod(t, 86400 * NS_PER_SECOND)
+    d = datetime.date.fromordinal(days + _EPOCH_ORDINAL)
+    sec, ns = divmod(ns, NS_PER_SECOND)
+    h, rem = divmod(sec, 3600)
+    m, s = divmod(rem, 60)
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%03dZ' % (d.year, d.month, d.day, h, m, s, ns // 1000000)
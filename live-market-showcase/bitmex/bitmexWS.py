@@ -4,15 +4,28 @@ import json
 import time
 import logging
 from .APIKeyAuth import generate_nonce, generate_signature
-from qsUtils import generate_logger
+from .utils import json_loads, iso_to_epoch_ns, backoff_delay, NS_PER_SECOND
+from qsUtils import generate_logger, now_ns
 import sys
-import datetime
 
 
 class bitmexWS(object):
-    """bitMEX WebSocket"""
+    """bitMEX WebSocket
+
+    a 'table' frame goes to the handler registered for its table (add_table_handler), else to onData().
+    Frames are decoded with orjson / ujson when installed (bitmex.utils.json_loads), nothing is printed
+    unless verbose.
+
+    The connection is supervised (see set_reconnect()): when the socket closes, or nothing (not even a pong)
+    was received for stale_timeout seconds, it reconnects with jittered exponential backoff and replays
+    every subscribe_topic(); BitMEX answers with fresh 'partial' snapshots. Subclasses get
+    on_disconnect(gap_start) and on_reconnect(gap_start, gap_end), times in epoch ns (qsUtils.now_ns()).
+
+    With add_connection_manager(bitmexWSMultiplexed) before connect(), no socket is opened: the frames travel
+    as a stream of the shared multiplexed socket, which pings and reconnects for all its streams.
+    """
     
-    def __init__(self, apiKey=None, apiSecret=None, isTestNet=True, loglevel='debug', logfile=None):
+    def __init__(self, apiKey=None, apiSecret=None, isTestNet=True, loglevel='debug', logfile=None, verbose=False):
         
         self.logger = generate_logger('bitmexWS', loglevel, logfile)
         
@@ -26,30 +39,176 @@ class bitmexWS(object):
         self.ws = None
         self.wst = None
         self.ping_td = None
-        self.connected = False
+        self.ping_timer = None
+        self.timer_service = None
+        self.connected = False      # welcome info received on the current socket
+        self.active = False         # between connect() and exit(): reconnect when the socket drops
+        self.subscriptions = []     # topics replayed on reconnect
+        self.last_recv = None       # now_ns() of the last frame (pong included)
+        self.reconnect = True
+        self.backoff_min = 1.0      # seconds, first reconnect delay; doubles per failed attempt, up to backoff_max
+        self.backoff_max = 60.0
+        self.stale_timeout = 15.0   # seconds without any frame (pings every 5s) -> drop and reconnect
+        self.reconnects = 0         # successful reconnects
+        self.__reconnecting = False
+        self.__reconnect_lock = threading.Lock()
+        self.mux = None             # bitmexWSMultiplexed carrying this connection as a stream, see add_connection_manager()
+        self.stream_id = None       # id of the stream on mux
+        self.verbose = verbose      # print every frame and its exchange -> local delay (debugging)
+        self.table_handlers = {}    # {table: callable(msg)}, eg. {'trade': on_trade_msg}
+        self.recorder = None        # bitmexTapeRecorder of the raw frames, see add_tape_recorder()
+
+    def add_table_handler(self, table, handler):
+        """route the frames of table ('trade', 'quote', 'order', ...) to handler(msg)"""
+        self.table_handlers[table] = handler
+
+    def add_connection_manager(self, mux):
+        """share the socket of mux (bitmexWSMultiplexed) instead of opening one; call before connect()"""
+        self.mux = mux
+
+    def add_tape_recorder(self, recorder):
+        """record every raw frame received (pongs excluded) with its receive time, see bitmex.bitmexTape"""
+        self.recorder = recorder
+
+    def add_timer_service(self, timer_service):
+        """ping with a periodic timer of timer_service instead of a ping thread"""
+        self.timer_service = timer_service
+
+    def set_reconnect(self, enabled=True, backoff_min=1.0, backoff_max=60.0, stale_timeout=15.0):
+        """reconnect when the socket drops or goes stale; call before connect()"""
+        assert 0 < backoff_min <= backoff_max, 'need 0 < backoff_min <= backoff_max'
+        assert stale_timeout > 5, 'stale_timeout must exceed the 5s ping period. stale_timeout is %s' % stale_timeout
+        self.reconnect = enabled
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.stale_timeout = stale_timeout
         
     def connect(self):
+        self.active = True
+        if self.mux is not None:
+            self.mux.open_stream(self)
+            self.__wait_for_connected()   # welcome info of the stream
+            return
         self.__connect()
         self.__wait_for_connected()
-        self.__start_ping_thread()
+        self.last_recv = now_ns()
+        if self.timer_service is not None:
+            self.ping_timer = self.timer_service.schedule(5, self.__send_ping, period=5)
+        else:
+            self.__start_ping_thread()
         
-    def __wait_for_connected(self):
+    def __wait_for_connected(self, timeout=None):
+        """True once the welcome info arrived, False after timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
         while not self.connected:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
             time.sleep(0.1)
+        return True
             
     def __start_ping_thread(self):
         self.ping_td = threading.Thread(target=self.__send_ping_forever)
         self.ping_td.start()
             
     def __send_ping_forever(self):
-        while self.connected:
+        while self.active:
+            self.__ping()
+            time.sleep(5)
+
+    def __send_ping(self, event):
+        self.__ping()
+
+    def __ping(self):
+        """ping, and drop the connection if nothing came back for stale_timeout seconds"""
+        if not self.connected:
+            return
+        try:
             self.logger.debug('>>> send ping')
             self.ws.send('ping')
-            time.sleep(5)
+        except Exception as e:
+            self.logger.warning('ping failed: %s' % e)
+        silent = (now_ns() - self.last_recv) / NS_PER_SECOND
+        if silent > self.stale_timeout:
+            self.logger.warning('stale feed: nothing received for %.1fs, reconnecting' % silent)
+            self.__start_reconnect()
+
+    def __start_reconnect(self):
+        with self.__reconnect_lock:
+            if not self.active or not self.reconnect or self.__reconnecting:
+                return
+            self.__reconnecting = True
+        self.connected = False
+        gap_start = self.last_recv
+        self.on_disconnect(gap_start)
+        threading.Thread(target=self.__reconnect, args=(self.ws, gap_start), daemon=True).start()
+
+    def __reconnect(self, old_ws, gap_start):
+        """close old_ws, connect again with jittered exponential backoff, replay the subscriptions"""
+        try:
+            old_ws.close()
+        except Exception as e:
+            self.logger.debug('closing dropped socket: %s' % e)
+        attempt = 0
+        while self.active:
+            delay = backoff_delay(attempt, self.backoff_min, self.backoff_max)
+            self.logger.warning('reconnecting in %.1fs (attempt %d)' % (delay, attempt + 1))
+            time.sleep(delay)
+            if not self.active:
+                break
+            self.__connect()
+            if self.__wait_for_connected(timeout=self.stale_timeout):
+                break
+            self.logger.warning('no welcome info in %.1fs' % self.stale_timeout)
+            try:
+                self.ws.close()
+            except Exception as e:
+                self.logger.debug('closing failed socket: %s' % e)
+            attempt += 1
+        if not self.active:
+            self.__reconnecting = False
+            return
+        self.last_recv = now_ns()
+        self._resubscribe()
+        self.reconnects += 1
+        self.__reconnecting = False
+        gap_end = now_ns()
+        self.logger.warning('reconnected after %.1fs, resubscribed %d topics'
+                            % ((gap_end - gap_start) / NS_PER_SECOND, len(self.subscriptions)))
+        self.on_reconnect(gap_start, gap_end)
+
+    def _resubscribe(self):
+        for topic in self.subscriptions:
+            self.__send_command('subscribe', [topic])
+
+    def _stream_down(self, gap_start):
+        """called by mux when its socket dropped"""
+        self.connected = False
+        self.on_disconnect(gap_start)
+
+    def _stream_up(self, gap_start, gap_end):
+        """called by mux once the stream is open again"""
+        self._resubscribe()
+        self.reconnects += 1
+        self.on_reconnect(gap_start, gap_end)
+
+    def on_disconnect(self, gap_start):
+        """the connection dropped (nothing received after gap_start); expected to be overwritten"""
+        pass
+
+    def on_reconnect(self, gap_start, gap_end):
+        """connected again and resubscribed, partials follow; expected to be overwritten"""
+        pass
         
     def exit(self):
+        self.active = False
         self.connected = False
         self.logger.info('Exiting ...')
+        if self.mux is not None:
+            self.mux.close_stream(self)
+            self.logger.info('Exit bitmexWS stream (intended)')
+            return
+        if self.ping_timer:
+            self.timer_service.cancel(self.ping_timer)
         if self.ping_td:
             self.ping_td.join()
             self.logger.info('ping thread end.')
@@ -88,76 +247,110 @@ class bitmexWS(object):
         """send a row command"""
         if args is None:
             args = []
-        self.ws.send(json.dumps({'op': command, 'args': args}))
+        if self.mux is not None:
+            self.mux.send_stream(self, {'op': command, 'args': args})
+        else:
+            self.ws.send(json.dumps({'op': command, 'args': args}))
         
     def __on_message(self, ws, message):
         """Handler for parsing WS messages"""
         
-        print("========================== MESSAGE ==========================")
-        #print(message)
-        
+        self.last_recv = now_ns()
         if message == 'pong':
             return
+        if self.recorder is not None:
+            self.recorder.record(self.last_recv, message)
         
-        msg = json.loads(message)
-        
-        # 1. Welcome info
-        if 'info' in msg:
+        self._on_msg(json_loads(message))
+
+    def _on_msg(self, msg):
+        """decoded frame (of the stream, if multiplexed)"""
+
+        # 1. table (most frequent): registered handler, else onData()
+        table = msg.get('table')
+        if table is not None:
+            if self.verbose:
+                self.print_delay(msg)
+            handler = self.table_handlers.get(table)
+            if handler is not None:
+                handler(msg)
+            else:
+                self.onData(msg)
+
+        # 2. Welcome info
+        elif 'info' in msg:
             if msg['info'] == 'Welcome to the BitMEX Realtime API.':
                 self.connected = True
                 self.logger.info('Successful connected to BitMEX WebSocket API')
                 
-        # 2. subscription
+        # 3. subscription
         elif 'subscribe' in msg:
             if msg['success']:
                 self.logger.info('Subscribe to %s' % msg['subscribe'])
             else:
-                self.logger.warn('Subscription not success: %s' % msg)
-                
-        # 3. table
-        elif 'table' in msg:
-            self.onData(msg)
+                self.logger.warning('Subscription not success: %s' % msg)
+
+        elif 'unsubscribe' in msg:
+            self.logger.info('Unsubscribe from %s: %s' % (msg['unsubscribe'], msg.get('success')))
+
+        # 4. authentication (multiplexed stream)
+        elif 'request' in msg and 'success' in msg:
+            self.logger.info('%s: %s' % (msg['request'].get('op'), msg['success']))
+
+        elif 'error' in msg:
+            self.logger.error('Error msg: %s' % msg)
         else:
-            self.logger.warn('Unclassified msg; %s' % msg)
+            self.logger.warning('Unclassified msg; %s' % msg)
     
     def onData(self, msg):
-        print(' ✈️  ✈️  ✈️  ✈️  onData()  ✈️  ✈️  ✈️  ✈️ ')
-        # for i in range(5):
-        #     print(i)
-        #     time.sleep(1)
-
-        if 'data' in msg:
-            if isinstance(msg['data'], list):
-                if 'timestamp' in msg['data'][0]:
-                    # '2019-01-07T14:19:21.770Z'
-                    ts_exchange = datetime.datetime.strptime(msg['data'][0]['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                    ts_local = datetime.datetime.utcnow()
-                    ts_decay = ts_local - ts_exchange
-                    print('%s, %s, ------>  %s' % (ts_exchange, ts_local, ts_decay))
-                    print(msg)
-                    if ts_decay > datetime.timedelta(seconds=3):
-                        self.logger.warning('ts_decay > 3sec: %s' % ts_decay)
-                else:
-                    print('timestamp not in msg["data"][0]')
-                    print(msg)
-        #print('Calling bitmexWS.onData()')   # expected to be overwrite
-        #print('============================================')
-        #print(msg)
+        """frame of a table without handler; routes to the table handler when called directly (eg. replay)"""
+        handler = self.table_handlers.get(msg.get('table'))
+        if handler is not None:
+            handler(msg)
+
+    def print_delay(self, msg):
+        """print msg and the delay between its first exchange timestamp and now (debugging)"""
+        data = msg.get('data')
+        if data and 'timestamp' in data[0]:
+            delay = (now_ns() - iso_to_epoch_ns(data[0]['timestamp'])) / NS_PER_SECOND
+            print('%s ------>  %.3fs' % (data[0]['timestamp'], delay))
+            if delay > 3:
+                self.logger.warning('ts_decay > 3sec: %.3fs' % delay)
+        print(msg)
         
     def __on_error(self, ws, error):
         self.logger.warning('Calling ws.__on_error()')
         self.logger.error(error)
         
-    def __on_close(self, ws):
+    def __on_close(self, ws, *args):
         self.logger.debug('Calling ws.__on_close()')
-        del self.wst
+        if ws is not self.ws:   # a socket already replaced by a reconnect
+            return
+        self.connected = False
+        if self.active and not self.__reconnecting:
+            self.logger.warning('websocket closed unexpectedly %s' % (args,))
+            self.__start_reconnect()
         
     def __on_open(self, ws):
         self.logger.debug('Calling ws.__on_open()')
+        self._on_open()
+
+    def _on_open(self):
+        """socket open; connected waits for the welcome info"""
+        pass
             
     def subscribe_topic(self, topic):
         # {"op": "subscribe", "args": [<SubscriptionTopic>]}
-        self.__send_command('subscribe', [topic])
+        if topic not in self.subscriptions:
+            self.subscriptions.append(topic)
+        if self.connected:   # else sent on reconnect
+            self.__send_command('subscribe', [topic])
+
+    def resubscribe_topic(self, topic):
+        """unsubscribe and subscribe topic again: BitMEX sends a fresh partial (eg. resync an L2 book)"""
+        if self.connected:   # else resubscribed on reconnect
+            self.__send_command('unsubscribe', [topic])
+            self.__send_command('subscribe', [topic])
         
         
 if __name__ == '__main__':
@@ -175,38 +368,39 @@ if __name__ == '__main__':
     logfile = './jiaru2015@gmail-bitmexWS.log'
     
     what = 'quote'  # <<<<------- change this to see subscribed data structure
+    verbose = True
     
     if what == 'order':
         #### 订阅交易信息
-        bmws = bitmexWS(apiKey=apiKey, apiSecret=apiSecret)
+        bmws = bitmexWS(apiKey=apiKey, apiSecret=apiSecret, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('order')   # manual send orders and make fill events on website
     elif what == 'instrument':
         #### 订阅合约信息 无需Authentication
-        bmws = bitmexWS(apiKey=apiKey, apiSecret=apiSecret)
+        bmws = bitmexWS(apiKey=apiKey, apiSecret=apiSecret, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('instrument:XBTUSD')
     elif what == 'trade':
         #### 订阅行情 无需Authentication
-        bmws = bitmexWS(apiKey=None, apiSecret=None)
+        bmws = bitmexWS(apiKey=None, apiSecret=None, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('trade:XBTUSD')
     elif what == 'quote':
         #### （无需Authentication）  "quote",       // 最高层的委托列表（只有价格变动才推送？）
-        bmws = bitmexWS(apiKey=None, apiSecret=None)
+        bmws = bitmexWS(apiKey=None, apiSecret=None, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('quote:XBTUSD')
     elif what == 'depth-10':
         #### （无需Authentication）  "quote",       // 10层委托列表
-        bmws = bitmexWS(apiKey=None, apiSecret=None)
+        bmws = bitmexWS(apiKey=None, apiSecret=None, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('orderBook10:XBTUSD')
     elif what == 'depth-L2':
-        bmws = bitmexWS(apiKey=None, apiSecret=None)
+        bmws = bitmexWS(apiKey=None, apiSecret=None, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('orderBookL2:XBTUSD')
     elif what == 'depth-L2-25':
-        bmws = bitmexWS(apiKey=None, apiSecret=None)
+        bmws = bitmexWS(apiKey=None, apiSecret=None, verbose=verbose)
         bmws.connect()
         bmws.subscribe_topic('orderBookL2_25:XBTUSD')
     else:
@@ -1,8 +1,9 @@
 from .bitmexWS import bitmexWS
 from .bitmexREST import bitmexREST
-from qsUtils import generate_logger
+from .utils import iso_to_epoch_ns
+from qsUtils import generate_logger, now_ns
 import time
-from qsDataStructure import Tick, Orderbook
+from qsDataStructure import Tick, TickBatch, Orderbook, DepthUpdate, OpenInterest, FeedGap
 
 
 class bitmexWSMarket(bitmexWS):
@@ -20,16 +21,40 @@ class bitmexWSMarket(bitmexWS):
         super().__init__(*args, **kwargs)
         self.logger = generate_logger('bitmexWS_Market')
         self.symbols = {}   
+        self.tick_pool = None        # MarketDataPool(Tick) or None
+        self.orderbook_pool = None   # MarketDataPool(Orderbook) or None
+        self.tick_batch = False      # if True, one TickBatch per symbol of a trade frame instead of one Tick per trade
+        self.last_trade = {}         # {symbol: (ISO timestamp, {trdMatchID})} latest trades passed on, see __new_trades()
+        self.add_table_handler('quote', self.__process_quote_msg)
+        self.add_table_handler('trade', self.__process_trade_msg)
+        self.add_table_handler('orderBookL2', self.__process_depth_msg)
+        self.add_table_handler('orderBookL2_25', self.__process_depth_msg)
+        self.add_table_handler('instrument', self.__process_instrument_msg)
     
     def add_market_data_q(self, q):
         self.market_data_q = q
 
-    def subscribe(self, symbol, trade=True, orderbook=False):
-        self.symbols[symbol] = dict(trade=trade, orderbook=orderbook)  # 每订阅一个symbol, 都将其添加进self.symbols字典中
+    def add_pools(self, tick_pool, orderbook_pool):
+        """take Tick / Orderbook from pools, released by the DataHandler"""
+        self.tick_pool = tick_pool
+        self.orderbook_pool = orderbook_pool
+
+    def set_tick_batch(self, tick_batch):
+        self.tick_batch = tick_batch
+
+    def subscribe(self, symbol, trade=True, orderbook=False, depth=None, instrument=False):
+        """depth: None, 'orderBookL2' (full depth) or 'orderBookL2_25' (25 levels)
+        instrument: open interest from the 'instrument' topic
+        """
+        self.symbols[symbol] = dict(trade=trade, orderbook=orderbook, depth=depth, instrument=instrument)  # 每订阅一个symbol, 都将其添加进self.symbols字典中
         if trade:
             self.subscribe_topic('trade:%s' % symbol)  # 订阅成交明细
         if orderbook:
             self.subscribe_topic('quote:%s' % symbol)  # 订阅一档委托单簿
+        if depth:
+            self.subscribe_topic('%s:%s' % (depth, symbol))  # 订阅L2深度
+        if instrument:
+            self.subscribe_topic('instrument:%s' % symbol)  # 订阅合约信息 (持仓量)
         
     def wait_for_data(self, symbols=None, trade=None, orderbook=None):
         """等待第一个数据的到来
@@ -51,45 +76,143 @@ class bitmexWSMarket(bitmexWS):
             self.logger.debug('waiting for data ...')
             time.sleep(1)
         
-    def onData(self, msg):   # 不处理partial了
-        msg_handler_dict = {
-            'quote': self.__process_quote_msg,
-            'trade': self.__process_trade_msg,
-        }
-        tb = msg.get('table')
-        if tb in msg_handler_dict:
-            func = msg_handler_dict[tb]
-            func(msg)
-    
+    def on_disconnect(self, gap_start):
+        """FeedGap(end=None) per symbol: the DataHandler drops its books until the next partial"""
+        for symbol in self.symbols:
+            self.market_data_q.put(FeedGap(symbol=symbol, start=gap_start, receive_time=now_ns()))
+
+    def on_reconnect(self, gap_start, gap_end):
+        for symbol in self.symbols:
+            self.market_data_q.put(FeedGap(symbol=symbol, start=gap_start, end=gap_end, receive_time=now_ns()))
+
     def __process_quote_msg(self, msg):
         """处理quote订阅：
         组装 Orderbook()
         丢进 market_data_q
         """
-        quote_s = msg['data']
-        for quote in quote_s:
-            ob = Orderbook(symbol=quote['symbol'], 
-                           bid1=quote['bidPrice'], bid1vol=quote['bidSize'], 
-                           ask1=quote['askPrice'], ask1vol=quote['askSize'], 
-                           timestamp = quote['timestamp'])
-            self.market_data_q.put(ob)
+        receive_time = self.last_recv
+        for quote in msg['data']:
+            self.market_data_q.put(quote_to_orderbook(quote, self.orderbook_pool, receive_time))
     
     def __process_trade_msg(self, msg):
         """处理trade订阅：
         组装 Tick()
         丢进 market_data_q
         """
-        tick_s = msg['data']
-        for tick in tick_s:
-            tk = Tick(symbol=tick['symbol'],
-                      price=tick['price'],
-                      volume=tick['size'],
-                      direction=tick['side'],
-                      timestamp = tick['timestamp'])
-            self.market_data_q.put(tk)
-    
- 
-        
+        receive_time = self.last_recv
+        trades = msg['data']
+        if msg['action'] == 'partial':
+            trades = self.__new_trades(trades)
+        self.__remember_trades(trades)
+        if self.tick_batch:
+            for batch in trades_to_tick_batches(trades, receive_time):
+                self.market_data_q.put(batch)
+            return
+        for trade in trades:
+            self.market_data_q.put(trade_to_tick(trade, self.tick_pool, receive_time))
+
+    def __remember_trades(self, trades):
+        """keep the latest timestamp per symbol and the trdMatchIDs at it
+        (BitMEX timestamps have a fixed format: ISO strings compare in time order)
+        """
+        last_trade = self.last_trade
+        for trade in trades:
+            symbol, ts = trade['symbol'], trade['timestamp']
+            last = last_trade.get(symbol)
+            if last is None or ts > last[0]:
+                last_trade[symbol] = (ts, {trade.get('trdMatchID')})
+            elif ts == last[0]:
+                last[1].add(trade.get('trdMatchID'))
+
+    def __new_trades(self, trades):
+        """trades of a partial not passed on yet: the partial sent on resubscribe repeats recent trades
+        processed before the drop, only the ones missed during the gap are kept
+        """
+        last_trade = self.last_trade
+        new = []
+        for trade in trades:
+            last = last_trade.get(trade['symbol'])
+            if last is None or trade['timestamp'] > last[0] \
+                    or (trade['timestamp'] == last[0] and trade.get('trdMatchID') not in last[1]):
+                new.append(trade)
+        if len(new) < len(trades):
+            self.logger.info('trade partial: %d trades already processed dropped' % (len(trades) - len(new)))
+        return new
+
+    def __process_depth_msg(self, msg):
+        """处理orderBookL2订阅：
+        组装 DepthUpdate()  (one per symbol of the frame)
+        丢进 market_data_q
+        """
+        for update in rows_to_depth_updates(msg['action'], msg['data'], self.last_recv):
+            self.market_data_q.put(update)
+
+    def __process_instrument_msg(self, msg):
+        """处理instrument订阅：只取持仓量
+        组装 OpenInterest()
+        丢进 market_data_q
+        """
+        receive_time = self.last_recv
+        for row in msg['data']:
+            oi = instrument_to_open_interest(row, receive_time)
+            if oi is not None:
+                self.market_data_q.put(oi)
+
+
+# timestamp: exchange time in epoch ns (bitmex.bitmexTimestamp), receive_time: qsUtils.now_ns() of the frame
+# (bitmexWS.last_recv: the recorded one when a tape is replayed)
+
+
+def instrument_to_open_interest(row, receive_time=None):
+    """one row of an 'instrument' message -> OpenInterest(), None if the row does not update openInterest"""
+    if row.get('openInterest') is None:
+        return None
+    timestamp = row.get('timestamp')
+    return OpenInterest(symbol=row['symbol'], open_interest=row['openInterest'],
+                        timestamp=iso_to_epoch_ns(timestamp) if timestamp else None, receive_time=receive_time)
+
+
+def rows_to_depth_updates(action, rows, receive_time=None):
+    """action + rows of an orderBookL2 message -> [DepthUpdate(), ...], one per symbol (rows as received)"""
+    updates = {}
+    for row in rows:
+        update = updates.get(row['symbol'])
+        if update is None:
+            update = updates[row['symbol']] = DepthUpdate(symbol=row['symbol'], action=action, receive_time=receive_time)
+        update.rows.append(row)
+    return list(updates.values())
+
+
+def quote_to_orderbook(quote, pool=None, receive_time=None):
+    """one row of a 'quote' message -> Orderbook(), recycled from pool if given"""
+    make = Orderbook if pool is None else pool.acquire
+    return make(symbol=quote['symbol'],
+                bid1=quote['bidPrice'], bid1vol=quote['bidSize'],
+                ask1=quote['askPrice'], ask1vol=quote['askSize'],
+                timestamp=iso_to_epoch_ns(quote['timestamp']), receive_time=receive_time)
+
+
+def trade_to_tick(trade, pool=None, receive_time=None):
+    """one row of a 'trade' message -> Tick(), recycled from pool if given"""
+    make = Tick if pool is None else pool.acquire
+    return make(symbol=trade['symbol'],
+                price=trade['price'],
+                volume=trade['size'],
+                direction=trade['side'],
+                timestamp=iso_to_epoch_ns(trade['timestamp']), receive_time=receive_time)
+
+
+def trades_to_tick_batches(trades, receive_time=None):
+    """rows of a 'trade' message -> [TickBatch(), ...], one per symbol (a frame usually has one symbol)"""
+    batches = {}
+    for trade in trades:
+        batch = batches.get(trade['symbol'])
+        if batch is None:
+            batch = batches[trade['symbol']] = TickBatch(symbol=trade['symbol'], receive_time=receive_time)
+        batch.append(trade['price'], trade['size'], trade['side'], iso_to_epoch_ns(trade['timestamp']))
+    return list(batches.values())
+
+
 if __name__ == '__main__':
     
     print('------------------------ 加载全局设置 -----------------------------')
@@ -0,0 +1,107 @@
+from .bitmexWS import bitmexWS
+from .APIKeyAuth import generate_signature
+from qsUtils import generate_logger, now_ns
+import json
+import threading
+import time
+
+
+class bitmexWSMultiplexed(bitmexWS):
+    """one socket to BitMEX's multiplexed endpoint (/realtimemd) shared by many bitmexWS consumers
+
+    every consumer (bitmexWSMarket, bitmexWSTrading of any account, ...) is a stream of the socket:
+        [1, id, name]             open the stream
+        [0, id, name, payload]    message of the stream, both ways (payload: a frame of /realtime)
+        [2, id, name]             close the stream
+    A consumer with api keys authenticates its own stream (authKeyExpires), so public and private
+    topics of several accounts share one socket, one run thread and one ping.
+    The socket is opened with the first stream and closed with the last one; every registered stream is
+    opened whenever the socket (re)connects. When the socket drops, every stream gets on_disconnect(), is
+    reopened and resubscribed, then gets on_reconnect() (see bitmexWS.set_reconnect). A stream closed by the
+    server alone goes the same way after backoff_min seconds, the socket staying up.
+    """
+
+    def __init__(self, isTestNet=True, loglevel='debug', logfile=None):
+        super().__init__(apiKey=None, apiSecret=None, isTestNet=isTestNet, loglevel=loglevel, logfile=logfile)
+        self.logger = generate_logger('bitmexWS_Multiplexed', loglevel, logfile)
+        self.ws_url = self.ws_url + 'md'   # wss://www.bitmex.com/realtimemd
+        self.streams = {}                  # {stream id: bitmexWS}
+        self.__next_id = 0
+        self.__lock = threading.Lock()
+
+    def open_stream(self, consumer):
+        """open a stream for consumer (connecting the socket for the first one); its frames go to consumer._on_msg()
+
+        the socket is connected outside the lock: a stream registered meanwhile is opened by _on_open()
+        """
+        with self.__lock:
+            self.__next_id += 1
+            consumer.stream_id = '%s-%d' % (consumer.__class__.__name__, self.__next_id)
+            self.streams[consumer.stream_id] = consumer
+            connect = not self.active
+            if connect:
+                self.active = True
+            elif self.connected:
+                self.__open(consumer)
+        if connect:
+            self.connect()
+
+    def __open(self, consumer):
+        self.ws.send(json.dumps([1, consumer.stream_id, consumer.stream_id]))
+        if consumer.shouldAuth:
+            expires = int(time.time()) + 5
+            signature = generate_signature(consumer.apiSecret, 'GET', '/realtime', expires, '')
+            self.send_stream(consumer, {'op': 'authKeyExpires', 'args': [consumer.apiKey, expires, signature]})
+
+    def send_stream(self, consumer, payload):
+        self.ws.send(json.dumps([0, consumer.stream_id, consumer.stream_id, payload]))
+
+    def close_stream(self, consumer):
+        """close the stream of consumer, and the socket with the last stream"""
+        with self.__lock:
+            if self.streams.pop(consumer.stream_id, None) is None:
+                return
+            if self.connected:
+                self.ws.send(json.dumps([2, consumer.stream_id, consumer.stream_id]))
+            if not self.streams:
+                self.exit()
+
+    def _on_open(self):
+        """socket (re)connected: open every registered stream (the welcome info comes per stream)"""
+        with self.__lock:
+            self.connected = True
+            for consumer in self.streams.values():
+                self.__open(consumer)
+
+    def _on_msg(self, msg):
+        if not isinstance(msg, list):
+            super()._on_msg(msg)
+            return
+        kind, stream_id = msg[0], msg[1]
+        consumer = self.streams.get(stream_id)
+        if consumer is None:
+            self.logger.debug('frame of unknown stream %s' % stream_id)
+        elif kind == 0:
+            consumer.last_recv = self.last_recv
+            consumer._on_msg(msg[3])
+        elif kind == 2:
+            self.logger.warning('stream %s closed by the server, reopening in %.1fs' % (stream_id, self.backoff_min))
+            gap_start = consumer.last_recv
+            consumer._stream_down(gap_start)
+            threading.Timer(self.backoff_min, self.__reopen, args=(consumer, gap_start)).start()
+
+    def __reopen(self, consumer, gap_start):
+        """reopen and resubscribe a stream closed by the server (a socket reconnect reopens it otherwise)"""
+        with self.__lock:
+            if self.streams.get(consumer.stream_id) is not consumer or not self.connected:
+                return
+            self.__open(consumer)
+        consumer._stream_up(gap_start, now_ns())
+
+    def on_disconnect(self, gap_start):
+        for consumer in list(self.streams.values()):
+            consumer._stream_down(gap_start)
+
+    def on_reconnect(self, gap_start, gap_end):
+        for consumer in list(self.streams.values()):   # reopened by _on_open()
+            consumer._stream_up(gap_start, gap_end)
@@ -10,6 +10,9 @@ class bitmexWSTrading(bitmexWS):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.logger = generate_logger('bitmexWS_Trading')
+        self.add_table_handler('position', self._on_position_msg)
+        self.add_table_handler('order', self.__on_order_msg)
+        self.add_table_handler('execution', self.__on_execution_msg)
 
     def subscribe(self, symbols=('XBTUSD', 'ETHUSD')):
         self.symbols = symbols
@@ -25,14 +28,10 @@ class bitmexWSTrading(bitmexWS):
         self.subscribe_topic('position:%s' % s)
         self.subscribe_topic('execution:%s' % s)
         
-    def onData(self, msg):
-        if msg.get('table') == 'position':
-            self._on_position_msg(msg)
-        elif msg.get('table') == 'order':
-            self.__on_order_msg(msg)
-        elif msg.get('table') == 'execution':
-            self.__on_execution_msg(msg)
-    
+    def on_disconnect(self, gap_start):
+        """position updates are ignored until the partial following the resubscription"""
+        self._got_position_partial = False
+
     def _on_position_msg(self, msg):
         self.logger.info('Got position msg:')
         #print('========================position==================\n' + msg.__str__())
@@ -1,23 +1,91 @@
-def calculate_td_ts(x, bar_type):
-    """"2018-09-29T06:00:17.271Z -> 20180929, 617"""
-    # x = '2018-09-29T06:17:34.271Z'
-    # bar_type = '4h'
-    
-    td, sec = x.split('T')
-    td = int(td.replace('-', ''))
-    
-    n, what = int(bar_type[:-1]), bar_type[-1]    
-    h, m, s = sec[:8].split(':')
+import datetime
+import json
+import random
+import re
+
+try:
+    import orjson                    # optional, several times faster on websocket frames
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
+from .bitmexTimestamp import NS_PER_SECOND, _EPOCH_ORDINAL, iso_to_epoch_ns, to_epoch_ns, epoch_ns_to_iso   # re-exported
+
+
+BAR_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+THRESHOLD_BAR_KINDS = ('tick', 'vol', 'notional', 'imb')   # '500tick', '100000vol', '50000000notional', '50imb'
+_THRESHOLD_BAR_RE = re.compile(r'^(\d+)(%s)$' % '|'.join(THRESHOLD_BAR_KINDS))
+
+
+def backoff_delay(attempt, backoff_min, backoff_max):
+    """seconds before reconnect attempt `attempt` (0, 1, ...): exponential backoff with jitter, so that
+    clients dropped together do not reconnect in lockstep
+    """
+    delay = min(backoff_max, backoff_min * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+def bar_width_ns(bar_type):
+    """'15s' / '7m' / '4h' / '1d' -> bar width in nanoseconds"""
+    n, what = bar_type[:-1], bar_type[-1]
+    if what not in BAR_UNIT_SECONDS or not n.isdigit() or int(n) <= 0:
+        raise ValueError('bar_type pattern should be "\\d+[s|m|h|d]", got %s' % bar_type)
+    return int(n) * BAR_UNIT_SECONDS[what] * NS_PER_SECOND
+
+
+def threshold_bar(bar_type):
+    """'500tick' -> ('tick', 500): bar closing on a threshold instead of a clock, None for a time bar
+
+    tick: number of trades, vol: contracts, notional: price * contracts,
+    imb: |buy trades - sell trades| (tick imbalance)
+    """
+    m = _THRESHOLD_BAR_RE.match(bar_type)
+    if m is None or int(m.group(1)) <= 0:
+        return None
+    return m.group(2), int(m.group(1))
+
+
+def check_bar_pattern(bar_type):
+    """raise ValueError unless bar_type is a time bar ('15s', '4h') or a threshold bar ('500tick', '50imb')"""
+    if threshold_bar(bar_type) is None:
+        try:
+            bar_width_ns(bar_type)
+        except ValueError:
+            raise ValueError('bar_type pattern should be "\\d+[s|m|h|d]" or "\\d+(%s)", got %s'
+                             % ('|'.join(THRESHOLD_BAR_KINDS), bar_type))
+
+
+def bucket_start(t, width):
+    """start (epoch ns) of the bar of `width` ns containing epoch ns t; bars are aligned on the epoch (UTC midnight)"""
+    return t - t % width
+
+
+def bucket_td_ts(start, bar_type):
+    """bar start (epoch ns) -> (td, ts) labels: 20180929, and HH / HHMM / HHMMSS by bar unit (0 for days)"""
+    days, sec = divmod(start // NS_PER_SECOND, 86400)
+    d = datetime.date.fromordinal(days + _EPOCH_ORDINAL)
+    td = d.year * 10000 + d.month * 100 + d.day
+    h, rem = divmod(sec, 3600)
+    m, s = divmod(rem, 60)
+    what = bar_type[-1]
     if what == 'h':
-        ts = '%02d' % (int(h) // n * n)
+        ts = h
     elif what == 'm':
-        ts = h + '%02d' % (int(m) // n * n)
+        ts = h * 100 + m
     elif what == 's':
-        ts = h + m + '%02d' % (int(s) // n * n)
+        ts = h * 10000 + m * 100 + s
     else:
-        raise ValueError('bar_type pattern should be "\\d[h|m|s]"')
-        
-    return td, int(ts)
+        ts = 0
+    return td, ts
+
+
+def calculate_td_ts(x, bar_type):
+    """"2018-09-29T06:00:17.271Z (or epoch ns) -> 20180929, 617"""
+    return bucket_td_ts(bucket_start(to_epoch_ns(x), bar_width_ns(bar_type)), bar_type)
 
 
 VALID_BAR_TYPE = ('1m', '5m', '1h', '1d')
@@ -25,4 +93,4 @@ VALID_BAR_TYPE = ('1m', '5m', '1h', '1d')
 
 def check_bar_type(bar_type):
     if bar_type not in VALID_BAR_TYPE:
-        raise ValueError("bar_type must be one of %s" % VALID_BAR_TYPE)
\ No newline at end of file
+        raise ValueError("bar_type must be one of %s" % VALID_BAR_TYPE)
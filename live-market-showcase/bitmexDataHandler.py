@@ -1,13 +1,20 @@
-from qsDataStructure import Orderbook, Tick, Bar, Snapshot
+from qsDataStructure import Orderbook, Tick, TickBatch, DepthUpdate, OpenInterest, FeedGap, Bar, Snapshot, MarketDataPool
+from qsBarHistory import BarHistory
 from qsObject import DataHandler
 from event.eventEngine import Event
-from event.eventType import EVENT_ORDERBOOK, EVENT_TICK, EVENT_BAR_OPEN, EVENT_BAR_CLOSE
+from event.eventType import EVENT_ORDERBOOK, EVENT_TICK, EVENT_DEPTH, EVENT_SNAPSHOT, EVENT_GAP, EVENT_BAR_OPEN, EVENT_BAR_CLOSE
+from event.eventTypeRegistry import intern_event_type
 from bitmex.bitmexWSMarket import bitmexWSMarket
 from bitmex.bitmexREST import bitmexREST
-from bitmex.utils import calculate_td_ts
-from qsUtils import generate_logger, now
+from bitmex.bitmexOrderBookL2 import bitmexOrderBookL2
+from bitmex.bitmexBarLoader import bitmexBarLoader
+from bitmex.utils import bar_width_ns, bucket_td_ts, threshold_bar, check_bar_pattern
+from qsUtils import generate_logger, now_ns
+import asyncio
+import operator
 import queue
 import threading
+import time
 
 
 class bitmexDataHandler(DataHandler):
@@ -21,47 +28,219 @@ class bitmexDataHandler(DataHandler):
         self.symbols = None                       # subscribed symbols  ['XBTUSD', ...]
 
         self.market_data_q = queue.Queue()    # MarketData queue（with data）
+        self.tick_batch = False               # if True, every trade frame is queued as one TickBatch, see use_tick_batch()
+        self.depth_topic = None               # None, 'orderBookL2' or 'orderBookL2_25', see use_depth()
+        self.snapshot_interval = None         # seconds between snapshots, see use_snapshot()
+        self.snapshot_timer = None            # periodic Timer of timer_service taking the snapshots
+        self.timer_service = None             # if set, websocket pings through it instead of a ping thread
+        self.ws_manager = None                # bitmexWSMultiplexed shared with other websocket consumers, or None
+        self.journal = None                   # eventJournal recording the market data fed to processTick/processOrderbook
+        self.tape = None                      # bitmexTapeRecorder of the raw websocket frames, see add_tape_recorder()
+        self.indicators = None                # IndicatorRegistry updated with every closed bar, see add_indicator_registry()
+        self.bm_ws_market = None              # bitmexWSMarket / bitmexAsyncWSMarket feeding market_data_q, see start()
         self.td_run = None                    # __run() function thread
         self.active = False
 
         self.tick = {}            # {symbol: Tick}            # the latest last_price information
         self.orderbook = {}       # {symbol: Orderbook}       # latest orderbook information
-
-        self.registered_tick_events = {}         # {'XBTUSD': True}      # todo BITMEX_TICK_BATCH
-        self.registered_orderbook_events = {}    # {'XBTUSD': BITMEX_ORDERBOOK_TOP}   # todo: consts.py different orderbook types
+        self.depth = {}           # {symbol: bitmexOrderBookL2}  # L2 book, if use_depth()
+        self.volume = {}          # {symbol: cumulative trade volume since start}
+        self.amount = {}          # {symbol: cumulative trade price * volume since start}
+        self.open_interest = {}   # {symbol: open interest}   # if use_snapshot()
+        self.last_snapshot = {}   # {symbol: Snapshot}        # latest slice pushed as EVENT_SNAPSHOT
+
+        self.tick_pool = None        # MarketDataPool(Tick), see use_pool()
+        self.orderbook_pool = None   # MarketDataPool(Orderbook), see use_pool()
+
+        self.registered_tick_events = {}         # {'XBTUSD': (type_, type_id)}      # todo BITMEX_TICK_BATCH
+        self.registered_orderbook_events = {}    # {'XBTUSD': (type_, type_id)}   # todo: consts.py different orderbook types
+        self.registered_depth_events = {}        # {'XBTUSD': (type_, type_id)}
+        self.registered_snapshot_events = {}     # {'XBTUSD': (type_, type_id)}
+        self.registered_gap_events = {}          # {'XBTUSD': (type_, type_id)}
+        self.gaps = {}                           # {symbol: FeedGap}  the last feed gap (end None: resyncing)
 
         self.registered_bar_events = {}   # {'XBTUSD': ['1m', '30s'], ...}
+        self.bar_event_types = {}         # {'XBTUSD': {'1m': {EVENT_BAR_OPEN: (type_, type_id), EVENT_BAR_CLOSE: (type_, type_id)}}}
+        self.bar_width = {}               # {'1m': 60000000000, ...}  bar width in epoch nanoseconds
+        self.bar_source = {}              # {'XBTUSD': {'15s': None, '30s': '15s', '1m': '30s'}}  finer bar_type a bar is built from, None: ticks
+        self.bar_coarser = {}             # {'XBTUSD': {'15s': ['30s'], '30s': ['1m'], '1m': []}}  bar_types built from a bar_type
+        self.bar_roots = {}               # {'XBTUSD': ['15s']}  bar_types built from ticks
+        self.bar_threshold = {}           # {'500tick': ('tick', 500), ...}  bar_types closing on a threshold, see bitmex.utils.threshold_bar
+        self.threshold_bars = {}          # {'XBTUSD': ['500tick', '50imb']}  threshold bar_types of a symbol
+        self.bar_imbalance = {}           # {'XBTUSD': {'50imb': buy trades - sell trades of the current bar}}
         self.bar = {}                     # {'XBTUSD': {'1m': Bar, '30s': Bar}, ...}
         self.prev_bar = {}                # {'XBTUSD': {'1m': Bar, '30s': Bar}, ...}
+        self.bar_history = {}             # {'XBTUSD': {'1m': BarHistory, ...}}  closed bars, see get_prev_bars()
+        self.bar_history_size = 1024      # capacity of every BarHistory
+
+        self.__process = {TickBatch: self.processTickBatch, Tick: self.processTick, Orderbook: self.processOrderbook,
+                          DepthUpdate: self.processDepth, OpenInterest: self.processOpenInterest,
+                          FeedGap: self.processFeedGap}   # market_data_q record class -> process function
 
     def set_symbols(self, symbols):
         self.symbols = symbols
+
+    def set_bar_history_size(self, capacity):
+        """number of closed bars kept per (symbol, bar_type), call before register_bar_event()"""
+        self.bar_history_size = capacity
+
+    def use_pool(self, maxsize=4096):
+        """recycle Tick / Orderbook: the previous latest one is released when a new one arrives
+
+        call before start(). Handlers must copy() a Tick / Orderbook they keep beyond the next update.
+        """
+        self.tick_pool = MarketDataPool(Tick, maxsize)
+        self.orderbook_pool = MarketDataPool(Orderbook, maxsize)
         
+    def use_tick_batch(self):
+        """one TickBatch per websocket trade frame instead of one Tick per trade, call before start()
+
+        bars are updated over the whole batch in one pass and one tick event is pushed per batch
+        (get_current_tick() is the last trade of the frame); bar events are the same as per Tick.
+        """
+        self.tick_batch = True
+
+    def use_depth(self, topic='orderBookL2_25'):
+        """maintain a bitmexOrderBookL2 per symbol from `topic` ('orderBookL2' or 'orderBookL2_25'), call before start()"""
+        assert topic in ('orderBookL2', 'orderBookL2_25'), 'invalid depth topic: %s' % topic
+        self.depth_topic = topic
+
+    def use_snapshot(self, interval=0.5):
+        """every `interval` seconds, push one EVENT_SNAPSHOT per symbol registered by register_snapshot_event()
+
+        the slice is taken on the DataHandler thread between two market_data_q records, so it never reads a
+        Tick / Orderbook being updated and is not delayed by the event queue; in asyncio mode it is taken by a
+        periodic timer of timer_service (add_timer_service() before async_start()).
+        Open interest comes from the 'instrument' topic
+        """
+        assert interval > 0, 'interval must be > 0. interval is %s' % interval
+        self.snapshot_interval = interval
+
     def start(self):
         self.__construct_bm_ws_market()
         self.td_run = threading.Thread(target=self.__run)
         self.active = True
         self.td_run.start()
 
-    def get_init_data(self):
-        pass
+    def __start_snapshot_timer(self):
+        if self.snapshot_interval is not None and self.registered_snapshot_events:
+            assert self.timer_service is not None, 'use_snapshot() requires a timer_service'
+            self.snapshot_timer = self.timer_service.schedule(self.snapshot_interval, self.__on_snapshot_timer,
+                                                              period=self.snapshot_interval)
+
+    def get_init_data(self, lookback=None, cache_dir=None, workers=4, end=None):
+        """warm-up: load the last closed bars of every registered (symbol, bar_type) into bar_history / prev_bar
+
+        lookback: {(symbol, bar_type): n}, or n for every registered bar_type; call before start()
+        so that strategies are initialized on history before the first live tick. See bitmexBarLoader.
+        end: epoch ns, now by default
+        """
+        if not lookback:
+            return {}
+        if not isinstance(lookback, dict):
+            lookback = {(s, b): lookback for s, bar_types in self.registered_bar_events.items() for b in bar_types}
+        lookback = {k: n for k, n in lookback.items()   # time bars only, a threshold bar starts from live ticks
+                    if k[1] in self.registered_bar_events.get(k[0], ()) and k[1] in self.bar_width}
+        rest = bitmexREST(apiKey=None, apiSecret=None, isTestNet=self.account_settings.isTestNet,
+                          loglevel=self.g.loglevel, logfile=self.g.logfile)
+        loader = bitmexBarLoader(rest, cache_dir, workers, loglevel=self.g.loglevel, logfile=self.g.logfile)
+        try:
+            bars = loader.load(lookback, end)
+        except IOError as e:   # REST down or rate limited: start on live ticks only
+            self.logger.error('warm-up failed, starting without history bars: %s' % e)
+            return {}
+        for (symbol, bar_type), bar_list in bars.items():
+            history = self.bar_history[symbol][bar_type]
+            for bar in bar_list:
+                history.append(bar)
+                if self.indicators is not None:
+                    self.indicators.on_bar_close(symbol, bar_type, bar)
+            if bar_list:
+                self.prev_bar[symbol][bar_type] = bar_list[-1]
+        return bars
 
     def __run(self):  
+        interval = self.snapshot_interval if self.registered_snapshot_events else None
+        next_snapshot = None if interval is None else time.monotonic() + interval
+        last_data = time.monotonic()
         while self.active:
+            timeout = 10 if next_snapshot is None else min(10, max(0, next_snapshot - time.monotonic()))
             try:
-                data = self.market_data_q.get(timeout=10)
+                data = self.market_data_q.get(timeout=timeout)
             except queue.Empty:
-                self.logger.warning('no data in market_data_q for 10 seconds')
+                if time.monotonic() - last_data >= 10:
+                    self.logger.warning('no data in market_data_q for 10 seconds')
+                    last_data = time.monotonic()
             else:
-                if isinstance(data, Tick):
-                    self.processTick(data)
-                elif isinstance(data, Orderbook):
-                    self.processOrderbook(data)
-                else:
-                    self.logger.warning('Invalid data type from market_data_q: %s' % data.__class__)
+                last_data = time.monotonic()
+                self.process(data)
+            if next_snapshot is not None and time.monotonic() >= next_snapshot:
+                self.__take_snapshots()
+                next_snapshot += interval * (1 + (time.monotonic() - next_snapshot) // interval)   # skip missed slices
+
+    def process(self, data):
+        """a record of market_data_q -> its process function (also called directly by bitmexTapeReplayer)"""
+        func = self.__process.get(data.__class__)
+        if func is not None:
+            func(data)
+        else:
+            self.logger.warning('Invalid data type from market_data_q: %s' % data.__class__)
     
+    async def async_start(self):
+        """asyncio mode: socket -> processTick/processOrderbook -> event_engine on the running loop
+
+        no market_data_q and no __run thread, the websocket task calls the process functions directly
+        """
+        from bitmex.bitmexAsyncWSMarket import bitmexAsyncWSMarket   # requires `websockets`, only in asyncio mode
+        self.first_tick = {s: asyncio.Event() for s in self.symbols}
+        self.bm_ws_market = bitmexAsyncWSMarket(apiKey=None, apiSecret=None, isTestNet=self.account_settings.isTestNet,
+                                                loglevel=self.g.loglevel, logfile=self.g.logfile)
+        self.bm_ws_market.add_market_data_handler(self.__on_async_tick, self.processOrderbook)
+        if self.tick_batch:
+            self.bm_ws_market.add_tick_batch_handler(self.__on_async_tick_batch)
+        self.bm_ws_market.add_depth_handler(self.processDepth)
+        self.bm_ws_market.add_open_interest_handler(self.processOpenInterest)
+        self.bm_ws_market.add_feed_gap_handler(self.processFeedGap)
+        self.bm_ws_market.add_pools(self.tick_pool, self.orderbook_pool)
+        self.bm_ws_market.set_reconnect(**self.g.websocket.get('reconnect', {}))
+        await self.bm_ws_market.connect()
+        for s in self.symbols:
+            await self.bm_ws_market.subscribe(s, trade=True, orderbook=True, depth=self.depth_topic,
+                                              instrument=self.snapshot_interval is not None)
+        self.active = True
+        self.__start_snapshot_timer()
+
+    def __on_async_tick(self, tick):
+        self.processTick(tick)
+        first_tick = self.first_tick.get(tick.symbol)
+        if first_tick is not None and not first_tick.is_set():
+            first_tick.set()
+
+    def __on_async_tick_batch(self, batch):
+        self.processTickBatch(batch)
+        first_tick = self.first_tick.get(batch.symbol)
+        if first_tick is not None and not first_tick.is_set():
+            first_tick.set()
+
+    async def wait_for_first_tick(self, symbols=None):
+        """asyncio mode: wait until every symbol got its first tick"""
+        if symbols is None:
+            symbols = self.symbols
+        for s in symbols:
+            await self.first_tick[s].wait()
+
+    async def async_stop(self):
+        self.logger.info('Stopping DataHandler (asyncio) ...')
+        self.active = False
+        if self.snapshot_timer is not None:
+            self.timer_service.cancel(self.snapshot_timer)
+        await self.bm_ws_market.exit()
+        self.logger.info('DataHandler stopped')
+
     def stop(self):
         self.logger.info('Stopping DataHandler ...')
+        if self.snapshot_timer is not None:
+            self.timer_service.cancel(self.snapshot_timer)
         self.bm_ws_market.exit()
         if True:
             self.logger.info('Exiting Thread: _DataHandler.__run(), wait for less than 10 secs')
@@ -72,14 +251,45 @@ class bitmexDataHandler(DataHandler):
     def __construct_bm_ws_market(self):
         self.bm_ws_market = bitmexWSMarket(apiKey=None, apiSecret=None, isTestNet=self.account_settings.isTestNet,
                                            loglevel=self.g.loglevel, logfile=self.g.logfile)
+        self.bm_ws_market.set_reconnect(**self.g.websocket.get('reconnect', {}))
+        if self.ws_manager is not None:
+            self.bm_ws_market.add_connection_manager(self.ws_manager)
+        elif self.tape is not None:   # multiplexed: the shared socket records
+            self.bm_ws_market.add_tape_recorder(self.tape)
+        if self.timer_service is not None:
+            self.bm_ws_market.add_timer_service(self.timer_service)
         self.bm_ws_market.connect()
         self.bm_ws_market.add_market_data_q(self.market_data_q)
+        self.bm_ws_market.add_pools(self.tick_pool, self.orderbook_pool)
+        self.bm_ws_market.set_tick_batch(self.tick_batch)
         for s in self.symbols:
-            self.bm_ws_market.subscribe(s, trade=True, orderbook=True)
+            self.bm_ws_market.subscribe(s, trade=True, orderbook=True, depth=self.depth_topic,
+                                        instrument=self.snapshot_interval is not None)
         self.bm_ws_market.wait_for_data()
 
+    def add_connection_manager(self, ws_manager):
+        """carry the market data as a stream of ws_manager (bitmexWSMultiplexed) instead of an own socket"""
+        self.ws_manager = ws_manager
+
+    def add_indicator_registry(self, indicators):
+        """indicators.on_bar_close(symbol, bar_type, bar) is called on every warm-up bar; live bars reach the
+        indicators through EVENT_BAR_CLOSE, see IndicatorRegistry.attach()
+        """
+        self.indicators = indicators
+
+    def add_journal(self, journal):
+        self.journal = journal
+
+    def add_tape_recorder(self, tape):
+        """record the raw frames of the market data socket (bitmexTapeRecorder), replayable with bitmexTapeReplayer"""
+        self.tape = tape
+
     def processTick(self, tick):
         self.logger.debug('💛 💛 💛 Processing Tick... %s' % tick)
+        if self.journal is not None:
+            self.journal.record_tick(tick)
+        if tick.receive_time is None:   # not stamped by the feed (eg. journal replay)
+            tick.receive_time = now_ns()
 
         # order： bar_close_event, bar_open_event, tick_event
 
@@ -89,17 +299,69 @@ class bitmexDataHandler(DataHandler):
                 # self.__update_tick(tick)
                 self.__init_bar(tick.symbol, tick)
             else:
-                self.__bar(tick)
+                self.__bar(tick, tick.timestamp, self.get_current_tick(tick.symbol).price)
 
-        # 1. update tick(last_price)
+        # 1. update tick(last_price), cumulative volume
         self.__update_tick(tick)
+        self.volume[tick.symbol] = self.volume.get(tick.symbol, 0) + tick.volume
+        self.amount[tick.symbol] = self.amount.get(tick.symbol, 0) + tick.price * tick.volume
         
         # 2. if symbol subsribed tick event, push(global event queue)
         if self.registered_tick_events.get(tick.symbol):
             self.__push_tick_event(tick.symbol)
+
+    def processTickBatch(self, batch):
+        """the trades of one websocket frame: bars over the batch in one pass, then one tick event"""
+        self.logger.debug('💛 💛 💛 Processing TickBatch... %s trades of %s' % (len(batch), batch.symbol))
+        if self.journal is not None:
+            self.journal.record_tick_batch(batch)
+        symbol = batch.symbol
+        n = len(batch)
+        if n == 0:
+            return
+        if batch.receive_time is None:
+            batch.receive_time = now_ns()
+        receive_time = batch.receive_time
+        prices, volumes, directions, timestamps = batch.price, batch.volume, batch.direction, batch.timestamp
+        make = Tick if self.tick_pool is None else self.tick_pool.acquire
+
+        first = 0
+        if self.get_current_tick(symbol) is None:   # edge case: first trade of the symbol initializes the bars
+            tick = make(symbol=symbol, price=prices[0], volume=volumes[0], direction=directions[0], timestamp=timestamps[0],
+                        receive_time=receive_time)
+            if self.registered_bar_events.get(symbol):
+                self.__init_bar(symbol, tick)
+            self.__update_tick(tick)
+            first = 1
+
+        # 0. generate bar, a scratch Tick is reused for every trade
+        if self.registered_bar_events.get(symbol) and first < n:
+            row = Tick(symbol=symbol, receive_time=receive_time)
+            last_price = self.get_current_tick(symbol).price
+            bar = self.__bar
+            for i in range(first, n):
+                row.price = prices[i]
+                row.volume = volumes[i]
+                row.direction = directions[i]
+                row.timestamp = timestamps[i]
+                bar(row, row.timestamp, last_price)
+                last_price = row.price
+
+        # 1. update tick(last_price) with the last trade, cumulative volume
+        if first < n:
+            self.__update_tick(make(symbol=symbol, price=prices[-1], volume=volumes[-1], direction=directions[-1],
+                                    timestamp=timestamps[-1], receive_time=receive_time))
+        self.volume[symbol] = self.volume.get(symbol, 0) + sum(volumes)
+        self.amount[symbol] = self.amount.get(symbol, 0) + sum(map(operator.mul, prices, volumes))
+
+        # 2. if symbol subsribed tick event, push(global event queue)
+        if self.registered_tick_events.get(symbol):
+            self.__push_tick_event(symbol)
     
     def processOrderbook(self, ob):
         self.logger.debug('💜 💜 💜️ Processing Orderbook... %s' % ob)
+        if self.journal is not None:
+            self.journal.record_orderbook(ob)
         
         # 1. update Orderbook
         self.__update_orderbook(ob)
@@ -108,29 +370,84 @@ class bitmexDataHandler(DataHandler):
         if self.registered_orderbook_events.get(ob.symbol):
             self.__push_orderbook_event(ob.symbol)
 
+    def processOpenInterest(self, oi):
+        self.open_interest[oi.symbol] = oi.open_interest
+
+    def processFeedGap(self, gap):
+        """websocket down (gap.end None) / reconnected: drop the L2 book until its partial, push EVENT_GAP"""
+        if gap.end is None:
+            self.logger.warning('feed gap %s: resyncing' % gap.symbol)
+            book = self.depth.get(gap.symbol)
+            if book is not None:
+                book.reset()
+        else:
+            self.logger.warning('feed gap %s: reconnected after %.1fs' % (gap.symbol, (gap.end - gap.start) / 1e9))
+        self.gaps[gap.symbol] = gap
+        if self.registered_gap_events.get(gap.symbol):
+            type_, type_id = self.registered_gap_events[gap.symbol]
+            self.event_engine.put(Event(type_=type_, type_id=type_id,
+                                        dict_={'symbol': gap.symbol, 'start': gap.start, 'end': gap.end}))
+
+    def processDepth(self, update):
+        self.logger.debug('💜 💜 💜️ Processing DepthUpdate... %s %s %s rows' % (update.symbol, update.action, len(update.rows)))
+        book = self.depth.get(update.symbol)
+        if book is None:
+            book = self.depth[update.symbol] = bitmexOrderBookL2(update.symbol)
+        was_ready = book.ready
+        book.apply(update.action, update.rows)
+        if was_ready and not book.ready:
+            self.__resync_depth(update.symbol)
+        if book.ready and self.registered_depth_events.get(update.symbol):
+            type_, type_id = self.registered_depth_events[update.symbol]
+            self.event_engine.put(Event(type_=type_, type_id=type_id, dict_={'symbol': update.symbol}))
+
+    def __resync_depth(self, symbol):
+        """the L2 book met an id of unknown price: resubscribe its topic for a fresh partial"""
+        self.logger.warning('L2 book %s out of sync, resubscribing %s' % (symbol, self.depth_topic))
+        if self.bm_ws_market is None or self.depth_topic is None:   # eg. replay: the next partial resyncs
+            return
+        resubscribed = self.bm_ws_market.resubscribe_topic('%s:%s' % (self.depth_topic, symbol))
+        if asyncio.iscoroutine(resubscribed):
+            asyncio.ensure_future(resubscribed)
+
     def __update_tick(self, tick):
-        tick.receive_time = now()
+        old = self.tick.get(tick.symbol)
         self.tick[tick.symbol] = tick
+        if self.tick_pool is not None and old is not None and old is not tick:
+            self.tick_pool.release(old)
 
     def __update_orderbook(self, ob):
-        ob.receive_time = now()
+        if ob.receive_time is None:
+            ob.receive_time = now_ns()
+        old = self.orderbook.get(ob.symbol)
         self.orderbook[ob.symbol] = ob
+        if self.orderbook_pool is not None and old is not None and old is not ob:
+            self.orderbook_pool.release(old)
 
     def __push_tick_event(self, symbol):
-        e = Event(type_=EVENT_TICK % symbol)
-        e.dict_ = {'symbol': symbol}
+        type_, type_id = self.registered_tick_events[symbol]
+        e = Event(type_=type_, type_id=type_id, dict_={'symbol': symbol})
         self.event_engine.put(e)
     
     def __push_orderbook_event(self, symbol):
-        e = Event(type_=EVENT_ORDERBOOK % symbol)
-        e.dict_ = {'symbol': symbol}
+        type_, type_id = self.registered_orderbook_events[symbol]
+        e = Event(type_=type_, type_id=type_id, dict_={'symbol': symbol})
         self.event_engine.put(e)
 
     def register_orderbook_event(self, symbol):
-        self.registered_orderbook_events[symbol] = True
+        self.registered_orderbook_events[symbol] = intern_event_type(EVENT_ORDERBOOK, symbol)
+
+    def register_depth_event(self, symbol):
+        self.registered_depth_events[symbol] = intern_event_type(EVENT_DEPTH, symbol)
+
+    def register_gap_event(self, symbol):
+        self.registered_gap_events[symbol] = intern_event_type(EVENT_GAP, symbol)
+
+    def register_snapshot_event(self, symbol):
+        self.registered_snapshot_events[symbol] = intern_event_type(EVENT_SNAPSHOT, symbol)
 
     def register_tick_event(self, symbol):
-        self.registered_tick_events[symbol] = True
+        self.registered_tick_events[symbol] = intern_event_type(EVENT_TICK, symbol)
     
     def register_bar_event(self, symbol, bar_type):
         """what type of bar is generated
@@ -142,80 +459,272 @@ class bitmexDataHandler(DataHandler):
             self.logger.warning('registering symbol "%s" of bar_type "%s", '
                                 'but symbol not in self.symbols: %s' % (symbol, bar_type, self.symbols))
             return
+        check_bar_pattern(bar_type)   # raises ValueError on invalid bar_type
+        if threshold_bar(bar_type) is not None:
+            self.bar_threshold[bar_type] = threshold_bar(bar_type)
+        else:
+            self.bar_width[bar_type] = bar_width_ns(bar_type)
         if symbol not in self.registered_bar_events:
             self.registered_bar_events[symbol] = []
+            self.bar_event_types[symbol] = {}
             self.bar[symbol] = {}
             self.prev_bar[symbol] = {}
+            self.bar_history[symbol] = {}
+            self.threshold_bars[symbol] = []
+            self.bar_imbalance[symbol] = {}
         if bar_type not in self.registered_bar_events[symbol]:
             self.registered_bar_events[symbol].append(bar_type)
+            self.bar_event_types[symbol][bar_type] = {
+                EVENT_BAR_OPEN: intern_event_type(EVENT_BAR_OPEN, symbol, bar_type),
+                EVENT_BAR_CLOSE: intern_event_type(EVENT_BAR_CLOSE, symbol, bar_type),
+            }
             self.logger.info('Registered. %s: %s' % (symbol, bar_type))
             self.bar[symbol][bar_type] = Bar()
             self.prev_bar[symbol][bar_type] = Bar()
+            self.bar_history[symbol][bar_type] = BarHistory(self.bar_history_size)
+            if bar_type in self.bar_threshold:
+                self.threshold_bars[symbol].append(bar_type)
+                self.bar_imbalance[symbol][bar_type] = 0
+            self.__build_bar_cascade(symbol)
         else:
             self.logger.info('Registering bar: bar_type "%s" already exist in symbol "%s"' % (bar_type, symbol))
 
+    def __build_bar_cascade(self, symbol):
+        """only the finest bar_types are built from ticks, a coarser one is built from the widest
+        registered bar_type whose width divides its own (15s -> 30s -> 1m), from ticks if there is none
+        """
+        bar_types = sorted((b for b in self.registered_bar_events[symbol] if b in self.bar_width), key=self.bar_width.get)
+        source = {}
+        coarser = {bar_type: [] for bar_type in bar_types}
+        for i, bar_type in enumerate(bar_types):
+            width = self.bar_width[bar_type]
+            source[bar_type] = None
+            for finer in reversed(bar_types[:i]):
+                finer_width = self.bar_width[finer]
+                if finer_width < width and width % finer_width == 0:
+                    source[bar_type] = finer
+                    coarser[finer].append(bar_type)
+                    break
+        self.bar_source[symbol] = source
+        self.bar_coarser[symbol] = coarser
+        self.bar_roots[symbol] = [bar_type for bar_type in bar_types if source[bar_type] is None]
+
     def __init_bar(self, symbol, tick):
         """Called when a tick of the symbol is obtained.
         use tick to initalize all bar_type using the type of first bar
         """
         if symbol in self.bar:
+            t = tick.timestamp
             for bar_type in self.bar[symbol]:
-                td, ts = calculate_td_ts(tick.timestamp, bar_type)
-                bar = Bar(symbol=symbol, bar_type=bar_type, td=td, ts=ts, open=tick.price, high=tick.price, low=tick.price)
-                self.bar[symbol][bar_type] = bar
+                if bar_type in self.bar_threshold:   # opened by __threshold_bar() below
+                    self.bar[symbol][bar_type] = None
+                    continue
+                width = self.bar_width[bar_type]
+                start = t - t % width
+                self.bar[symbol][bar_type] = self.__new_bar(symbol, bar_type, start, tick)
                 self.logger.debug('💙 __init_bar() 💙 %s %s 💙 self.bar: %s' % (symbol, bar_type, self.bar[symbol][bar_type]))
-                prev_bar = Bar(symbol=symbol, bar_type=bar_type, td=td, ts=ts-1)
+                if self.prev_bar[symbol][bar_type].start == start - width:   # warmed up by get_init_data()
+                    continue
+                td, ts = bucket_td_ts(start - width, bar_type)
+                prev_bar = Bar(symbol=symbol, bar_type=bar_type, td=td, ts=ts, start=start - width)
                 self.prev_bar[symbol][bar_type] = prev_bar
                 self.logger.info('💙 __init_bar() 💙 %s %s 💙 self.prev_bar: %s' % (symbol, bar_type, self.prev_bar[symbol][bar_type]))
+            if self.threshold_bars[symbol]:
+                for bar_type in self.__threshold_bar(tick, t)[1]:   # full on its first tick, eg. '1tick' or a big trade on a 'vol' bar
+                    self.__push_bar_close_event(symbol, bar_type)
+
+    def __bar(self, tick, t, last_price):
+        """update the bars built from ticks; a closing bar cascades into the coarser ones, see __roll_bar()
+
+        t: tick.timestamp in epoch nanoseconds (parsed by the feed), bucketed per bar_type with integer arithmetic
+        last_price: price of the previous tick, close of a closing bar (注意此时tick还未更新)
+        """
+        symbol = tick.symbol
+        bars = self.bar[symbol]
+        rolled = set()
+
+        for bar_type in self.bar_roots[symbol]:
+
+            current_bar = bars[bar_type]
+            width = self.bar_width[bar_type]
+            start = t - t % width
 
-    def __bar(self, tick):
+            if start > current_bar.start:
+                current_bar.close = last_price
+                self.__roll_bar(symbol, bar_type, current_bar, start, tick, rolled)
+            else:
+                # running sums on the bar itself, no allocation per tick
+                price = tick.price
+                volume = tick.volume
+                if price > current_bar.high:
+                    current_bar.high = price
+                if price < current_bar.low:
+                    current_bar.low = price
+                current_bar.volume += volume
+                current_bar.amount += price * volume
+                current_bar.ticks += 1
+                if tick.direction == 'Buy':
+                    current_bar.buy_volume += volume
+                elif tick.direction == 'Sell':
+                    current_bar.sell_volume += volume
+
+        opened = closed = ()
+        if self.threshold_bars[symbol]:
+            opened, closed = self.__threshold_bar(tick, t)
+
+        if rolled or opened or closed:
+            # order as registered: bar_close_event, bar_open_event of each bar_type
+            for bar_type in self.registered_bar_events[symbol]:
+                if bar_type in rolled:
+                    self.__push_bar_close_event(symbol, bar_type)
+                    self.__push_bar_open_event(symbol, bar_type)
+                elif bar_type in opened or bar_type in closed:
+                    if bar_type in opened:
+                        self.__push_bar_open_event(symbol, bar_type)
+                    if bar_type in closed:
+                        self.__push_bar_close_event(symbol, bar_type)
+
+    def __threshold_bar(self, tick, t):
+        """update the threshold bars of tick.symbol: a bar closes on the tick reaching its threshold
+        (the tick is in the bar), the next bar opens on the next tick. Returns (opened, closed) bar_types
+        """
         symbol = tick.symbol
-        bar_types = self.registered_bar_events[symbol]
-
-        for bar_type in bar_types:
-
-            current_bar = self.get_current_bar(symbol, bar_type)
-            current_tick = self.get_current_tick(symbol)  # 注意此时tick还未更新
-            assert isinstance(current_bar, Bar), 'current_bar.__class__ is %s' % current_bar.__class__
-            assert isinstance(current_tick, Tick), 'current_tick.__class__ is %s' % current_tick.__class__
-
-            td, ts = calculate_td_ts(tick.timestamp, bar_type)
-
-            if (td, ts) > (current_bar.td, current_bar.ts):
-                # bar_close
-                current_bar.close = current_tick.price
-                current_bar.receive_time = now()
-                self.prev_bar[symbol][bar_type] = current_bar  # move to prev_bar
-                self.bar[symbol][bar_type] = None
-                self.__push_bar_close_event(symbol, bar_type)
-                # bar_open
-                self.bar[symbol][bar_type] = Bar(symbol=symbol, bar_type=bar_type, td=td, ts=ts,
-                                                 open=tick.price, high=tick.price, low=tick.price, close=None,
-                                                 timestamp=tick.timestamp, receive_time=None)
-                self.__push_bar_open_event(symbol, bar_type)
+        bars = self.bar[symbol]
+        imbalance = self.bar_imbalance[symbol]
+        sign = self.__tick_sign(tick)
+        opened = []
+        closed = []
+        for bar_type in self.threshold_bars[symbol]:
+            bar = bars[bar_type]
+            if bar is None:   # closed by the previous tick
+                bar = bars[bar_type] = self.__new_bar(symbol, bar_type, t, tick)
+                imbalance[bar_type] = sign
+                opened.append(bar_type)
             else:
-                self.bar[symbol][bar_type].high = max(tick.price, current_bar.high)
-                self.bar[symbol][bar_type].low = min(tick.price, current_bar.low)
+                self.__add_tick(bar, tick)
+                imbalance[bar_type] += sign
+            kind, threshold = self.bar_threshold[bar_type]
+            if kind == 'tick':
+                full = bar.ticks >= threshold
+            elif kind == 'vol':
+                full = bar.volume >= threshold
+            elif kind == 'notional':
+                full = bar.amount >= threshold
+            else:
+                full = abs(imbalance[bar_type]) >= threshold
+            if full:
+                bar.close = tick.price
+                bar.receive_time = tick.receive_time
+                bar.vwap = bar.amount / bar.volume if bar.volume else None
+                self.prev_bar[symbol][bar_type] = bar
+                self.bar_history[symbol][bar_type].append(bar)
+                bars[bar_type] = None
+                closed.append(bar_type)
+        return opened, closed
+
+    @staticmethod
+    def __tick_sign(tick):
+        return 1 if tick.direction == 'Buy' else -1 if tick.direction == 'Sell' else 0
+
+    @staticmethod
+    def __add_tick(bar, tick):
+        price = tick.price
+        volume = tick.volume
+        if price > bar.high:
+            bar.high = price
+        if price < bar.low:
+            bar.low = price
+        bar.volume += volume
+        bar.amount += price * volume
+        bar.ticks += 1
+        if tick.direction == 'Buy':
+            bar.buy_volume += volume
+        elif tick.direction == 'Sell':
+            bar.sell_volume += volume
+
+    def __roll_bar(self, symbol, bar_type, closed_bar, start, tick, rolled):
+        """closed_bar of bar_type is closed by tick: move it to prev_bar, open the bar starting at `start`,
+        then fold closed_bar into the coarser bars built from it and roll those whose bucket changed too
+        """
+        closed_bar.receive_time = tick.receive_time
+        closed_bar.vwap = closed_bar.amount / closed_bar.volume if closed_bar.volume else None
+        self.prev_bar[symbol][bar_type] = closed_bar  # move to prev_bar
+        self.bar_history[symbol][bar_type].append(closed_bar)
+        self.bar[symbol][bar_type] = self.__new_bar(symbol, bar_type, start, tick)
+        rolled.add(bar_type)
+
+        for coarser in self.bar_coarser[symbol][bar_type]:
+            coarser_bar = self.bar[symbol][coarser]
+            self.__fold_bar(coarser_bar, closed_bar)
+            coarser_start = start - start % self.bar_width[coarser]   # a multiple of width: same bucket as t
+            if coarser_start > coarser_bar.start:
+                coarser_bar.close = closed_bar.close
+                self.__roll_bar(symbol, coarser, coarser_bar, coarser_start, tick, rolled)
+
+    def __new_bar(self, symbol, bar_type, start, tick):
+        """bar opened by tick; the volume of tick is counted by the bars built from ticks only,
+        a cascaded bar gets it when the finer bar is folded into it
+        """
+        td, ts = bucket_td_ts(start, '1s' if bar_type in self.bar_threshold else bar_type)   # threshold bar: HHMMSS of its first tick
+        bar = Bar(symbol=symbol, bar_type=bar_type, td=td, ts=ts, open=tick.price, high=tick.price, low=tick.price,
+                  timestamp=tick.timestamp, start=start, volume=0, amount=0, ticks=0, buy_volume=0, sell_volume=0)
+        if self.bar_source[symbol].get(bar_type) is None:
+            bar.volume = tick.volume
+            bar.amount = tick.price * tick.volume
+            bar.ticks = 1
+            if tick.direction == 'Buy':
+                bar.buy_volume = tick.volume
+            elif tick.direction == 'Sell':
+                bar.sell_volume = tick.volume
+        return bar
+
+    @staticmethod
+    def __fold_bar(bar, finer_bar):
+        """merge a finer bar of the same period into bar: high / low and the running sums"""
+        if finer_bar.high > bar.high:
+            bar.high = finer_bar.high
+        if finer_bar.low < bar.low:
+            bar.low = finer_bar.low
+        bar.volume += finer_bar.volume
+        bar.amount += finer_bar.amount
+        bar.ticks += finer_bar.ticks
+        bar.buy_volume += finer_bar.buy_volume
+        bar.sell_volume += finer_bar.sell_volume
 
     def __push_bar_close_event(self, symbol, bar_type):
-        e_type = EVENT_BAR_CLOSE % (symbol, bar_type)
-        e = Event(type_=e_type)
-        e.dict_ = {'symbol': symbol, 'bar_type': bar_type}
+        type_, type_id = self.bar_event_types[symbol][bar_type][EVENT_BAR_CLOSE]
+        bar = self.prev_bar[symbol][bar_type]
+        e = Event(type_=type_, type_id=type_id, dict_={'symbol': symbol, 'bar_type': bar_type, 'start': bar.start,
+                                                       'timestamp': bar.timestamp, 'open': bar.open,
+                                                       'high': bar.high, 'low': bar.low, 'close': bar.close,
+                                                       'volume': bar.volume, 'amount': bar.amount, 'vwap': bar.vwap,
+                                                       'ticks': bar.ticks, 'buy_volume': bar.buy_volume,
+                                                       'sell_volume': bar.sell_volume})
         self.event_engine.put(e)
         self.logger.info('💙 💙 💙  pushing bar_close_event__%s__%s__, prev_bar is %s' % (symbol, bar_type, self.prev_bar[symbol][bar_type]))
 
     def __push_bar_open_event(self, symbol, bar_type):
-        e_type = EVENT_BAR_OPEN % (symbol, bar_type)
-        e = Event(type_=e_type)
-        e.dict_ = {'symbol': symbol, 'bar_type': bar_type}
+        type_, type_id = self.bar_event_types[symbol][bar_type][EVENT_BAR_OPEN]
+        e = Event(type_=type_, type_id=type_id, dict_={'symbol': symbol, 'bar_type': bar_type})
         self.event_engine.put(e)
         self.logger.info('💙 💙 💙  pushing bar_open_event__%s__%s__, bar is %s' % (symbol, bar_type, self.bar[symbol][bar_type]))
 
     def get_current_bar(self, symbol, bar_type):
         try:
-            return self.bar.get(symbol).get(bar_type)
+            bar = self.bar.get(symbol).get(bar_type)
         except AttributeError:
             return None
+        if bar is None or bar.volume is None:   # not initialized yet, or threshold bar waiting for its next tick
+            return bar
+        source = self.bar_source[symbol].get(bar_type)
+        if source is not None:
+            # a cascaded bar only got its closed finer bars so far: a copy with the ones in progress folded in
+            bar = bar.copy()
+            while source is not None:
+                self.__fold_bar(bar, self.bar[symbol][source])
+                source = self.bar_source[symbol][source]
+        bar.vwap = bar.amount / bar.volume if bar.volume else None
+        return bar
 
     def get_prev_bar(self, symbol, bar_type):
         try:
@@ -223,11 +732,50 @@ class bitmexDataHandler(DataHandler):
         except AttributeError:
             return None
 
+    def get_prev_bars(self, symbol, bar_type, n):
+        """the last n closed bars as read-only numpy views, oldest first
+
+        Bars(open, high, low, close, volume, vwap, timestamp), eg. get_prev_bars('XBTUSD', '1m', 20).high.max()
+        """
+        try:
+            return self.bar_history[symbol][bar_type].get(n)
+        except KeyError:
+            return None
+
+    def get_depth(self, symbol):
+        """bitmexOrderBookL2 of symbol (best_bid / levels / depth_at / cumulative_depth), None before use_depth() data"""
+        return self.depth.get(symbol)
+
     def get_current_tick(self, symbol):
         return self.tick.get(symbol)
 
     def snapshot(self, symbol):
-        """Refer to domestic futures snapshot data structure"""
-        pass
+        """Refer to domestic futures snapshot data structure: Snapshot of the current state of symbol"""
+        tick = self.tick.get(symbol)
+        ob = self.orderbook.get(symbol)
+        snap = Snapshot(symbol=symbol, volume=self.volume.get(symbol, 0), amount=self.amount.get(symbol, 0),
+                        open_interest=self.open_interest.get(symbol), receive_time=now_ns())
+        if tick is not None:
+            snap.last_price, snap.last_volume, snap.timestamp = tick.price, tick.volume, tick.timestamp
+        if ob is not None:
+            snap.bid1, snap.bid1vol, snap.ask1, snap.ask1vol = ob.bid1, ob.bid1vol, ob.ask1, ob.ask1vol
+            if snap.timestamp is None or (ob.timestamp is not None and ob.timestamp > snap.timestamp):
+                snap.timestamp = ob.timestamp
+        return snap
+
+    def get_snapshot(self, symbol):
+        """latest Snapshot pushed as EVENT_SNAPSHOT"""
+        return self.last_snapshot.get(symbol)
+
+    def __on_snapshot_timer(self, event):
+        self.__take_snapshots()
+
+    def __take_snapshots(self):
+        """one EVENT_SNAPSHOT per symbol, once the symbol got a trade or a quote (on the thread updating the data)"""
+        for symbol, (type_, type_id) in self.registered_snapshot_events.items():
+            if symbol not in self.tick and symbol not in self.orderbook:
+                continue
+            snap = self.last_snapshot[symbol] = self.snapshot(symbol)
+            self.event_engine.put(Event(type_=type_, type_id=type_id, dict_={'symbol': symbol, 'snapshot': snap}))
     
     
\ No newline at end of file
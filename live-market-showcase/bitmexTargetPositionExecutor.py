@@ -32,7 +32,9 @@ class bitmexTargetPositionExecutor(TargetPositionExecutor):
     超过1分钟未成交，且价格朝不利方向变动，根据最新的last_price重新挂
     """
 
-    def __init__(self, g, account_settings, symbols):
+    requote_seconds = 60   # re-quote an unfilled order after this long if the price moved away
+
+    def __init__(self, g, account_settings, symbols, ws_manager=None):
 
         # global setting
         self.g = g
@@ -53,8 +55,16 @@ class bitmexTargetPositionExecutor(TargetPositionExecutor):
         # event engine
         self.event_engine = None
 
+        # timer service (re-quote timers)
+        self.timer_service = None
+        self.requote_timer = {}    # {symbol: Timer}
+        self.order_price = {}      # {symbol: (side, limit_price)}  last placed order
+
         # websocket-trading
         self.bm_ws_trading = bitmexWSTrading(self.account_settings.apiKey, self.account_settings.apiSecret, self.account_settings.isTestNet)
+        self.bm_ws_trading.set_reconnect(**self.g.websocket.get('reconnect', {}))
+        if ws_manager is not None:
+            self.bm_ws_trading.add_connection_manager(ws_manager)   # bitmexWSMultiplexed shared with the market data
         self.bm_ws_trading.connect()
         self.bm_ws_trading.subscribe(self.symbols)
         self.bm_ws_trading.wait_for_initial_status()  # Waiting for initial information
@@ -147,9 +157,36 @@ class bitmexTargetPositionExecutor(TargetPositionExecutor):
             else:
                 if res.ok:
                     self.logger.info('Successfully Place Order:\n%s' % res.json())
+                    self.order_price[symbol] = (side, price)
+                    self.__schedule_requote(symbol)
                 else:
                     self.logger.info('❌ ❌ ❌  Placeing Order Failed:\n%s' % res.json())
 
+    def __schedule_requote(self, symbol):
+        """check the order of symbol again in requote_seconds (needs a timer service)"""
+        if self.timer_service is None:
+            return
+        old = self.requote_timer.get(symbol)
+        if old is not None:
+            self.timer_service.cancel(old)
+        self.requote_timer[symbol] = self.timer_service.schedule(self.requote_seconds,
+                                                                 lambda event: self.__on_requote_timer(symbol))
+
+    def __on_requote_timer(self, symbol):
+        """unfilled after requote_seconds: re-quote if last_price moved in an adverse direction, else check later"""
+        self.requote_timer.pop(symbol, None)
+        total_unfilled_qty = sum(abs(x) for x in self.unfilled_qty[symbol].values())
+        if total_unfilled_qty == 0:
+            return
+        side, price = self.order_price[symbol]
+        last_price = self.data_handler.get_current_tick(symbol).price
+        adverse = last_price > price if side == 'Buy' else last_price < price
+        if adverse:
+            self.logger.info('Re-quote %s: %s order @ %s unfilled, last_price %s' % (symbol, side, price, last_price))
+            self.__trade_to_target(symbol)
+        else:
+            self.__schedule_requote(symbol)
+
     def test(self):
         """Unit Test
 
@@ -1,46 +1,93 @@
 from bitmex.bitmexAccountSettings import bitmexAccountSettings
+from bitmex.bitmexWSMultiplexed import bitmexWSMultiplexed
 from bitmexDataHandler import bitmexDataHandler
 from bitmexTargetPositionExecutor import bitmexTargetPositionExecutor
 
-from event.eventEngine import eventEngine
+from event.eventEngine import eventEngine, ringBufferEventEngine
+from event.shardedEventEngine import shardedEventEngine
+from event.asyncEventEngine import asyncEventEngine
+from event.eventTypeRegistry import registry
+from event.timerService import timerService
+from event.eventJournal import eventJournal, eventReplayer
+from bitmex.bitmexTape import bitmexTapeRecorder, bitmexTapeReplayer
 from event.eventType import EVENT_ORDERBOOK, EVENT_TICK, EVENT_BAR_OPEN, EVENT_BAR_CLOSE, EVENT_SIGNAL, EVENT_TARGET_POSITION
 from strategy import STRATEGY_CLASS
 from CtaNaivePortfolio import CtaNaivePortfolio
 from ctaObject import CtaPortfolioSettings, CtaStrategyConfig
+from ctaIndicator import IndicatorRegistry
 
+import asyncio
+import inspect
 import json
 
 
 class CtaEngine(object):
-    """main engine"""
+    """main engine
 
-    def __init__(self, g, bitmex_account_settings, cta_settings):
+    replay=True builds an offline engine for replay_journal() / replay_tape(): no executor (no trading
+    socket, no credentials needed), no multiplexed socket, nothing recorded (journal / tape settings ignored)
+    """
+
+    def __init__(self, g, bitmex_account_settings, cta_settings, replay=False):
 
         # global settings
         self.g = g
+        self.replay = replay
 
         # bitmex account settings
         self.bitmex_account_settings = bitmex_account_settings
 
         # event engine
-        self.event_engine = eventEngine()
+        self.event_engine = self.__construct_event_engine()
+
+        # timer service (EVENT_TIMER): websocket ping, executor re-quote, strategy timers
+        self.timer_service = timerService(self.event_engine, tick=self.g.timer.get('tick', 0.01))
+
+        # websocket: market data and trading streams over one multiplexed socket, or one socket each
+        self.ws_manager = None
+        if self.g.websocket.get('multiplex') and not self.replay:
+            self.ws_manager = bitmexWSMultiplexed(isTestNet=self.bitmex_account_settings.isTestNet,
+                                                  loglevel=self.g.loglevel, logfile=self.g.logfile)
+            self.ws_manager.set_reconnect(**self.g.websocket.get('reconnect', {}))
+            self.ws_manager.add_timer_service(self.timer_service)
 
         # DataHandler
         self.data_handler = bitmexDataHandler(self.g, self.bitmex_account_settings)
         self.data_handler.add_event_engine(self.event_engine)
+        self.data_handler.add_timer_service(self.timer_service)
+        if self.ws_manager is not None:
+            self.data_handler.add_connection_manager(self.ws_manager)
 
         assert isinstance(cta_settings, CtaPortfolioSettings)
 
         self.data_handler.set_symbols(cta_settings.symbols)
+        if self.g.market_data.get('pool_size'):
+            self.data_handler.use_pool(self.g.market_data['pool_size'])
+        if self.g.market_data.get('tick_batch'):
+            self.data_handler.use_tick_batch()
+        if self.g.market_data.get('snapshot_interval'):
+            self.data_handler.use_snapshot(self.g.market_data['snapshot_interval'])
+        if self.g.market_data.get('depth'):
+            self.data_handler.use_depth(self.g.market_data['depth'])
+        if self.g.market_data.get('bar_history'):
+            self.data_handler.set_bar_history_size(self.g.market_data['bar_history'])
 
         for sym in cta_settings.symbols:
             self.data_handler.register_tick_event(sym)
             self.data_handler.register_orderbook_event(sym)
+            self.data_handler.register_gap_event(sym)
+            if self.g.market_data.get('snapshot_interval'):
+                self.data_handler.register_snapshot_event(sym)
 
         for d in cta_settings.bar_types:
             assert isinstance(d, dict) and d.__len__() == 1
             self.data_handler.register_bar_event(list(d.keys())[0], list(d.values())[0])
 
+        # indicators: computed once per (symbol, bar_type, kind, params), shared by strategies
+        self.indicators = IndicatorRegistry(self.data_handler)
+        self.data_handler.add_indicator_registry(self.indicators)
+        self.indicators.attach(self.event_engine)   # before the strategies: they read the bar of their event
+
         # strategy
         self.strategy_pool = []
 
@@ -48,13 +95,15 @@ class CtaEngine(object):
             strategy = self.__construct_strategy_instance(config)
             strategy.add_data_handler(self.data_handler)
             strategy.add_event_engine(self.event_engine)
+            strategy.add_timer_service(self.timer_service)
+            strategy.add_indicator_registry(self.indicators)
             self.strategy_pool.append(strategy)
 
         for strategy in self.strategy_pool:
             config = strategy.config
-            self.event_engine.register(EVENT_TICK % config.symbol, strategy.on_tick)
-            self.event_engine.register(EVENT_BAR_OPEN % (config.symbol, config.bar_type), strategy.on_bar_open)
-            self.event_engine.register(EVENT_BAR_CLOSE % (config.symbol, config.bar_type), strategy.on_bar_close)
+            self.event_engine.register(registry.intern(EVENT_TICK, config.symbol), strategy.on_tick)
+            self.event_engine.register(registry.intern(EVENT_BAR_OPEN, config.symbol, config.bar_type), strategy.on_bar_open)
+            self.event_engine.register(registry.intern(EVENT_BAR_CLOSE, config.symbol, config.bar_type), strategy.on_bar_close)
 
         # portfolio  TODO: multiple portfolios
         self.portfolio = CtaNaivePortfolio()
@@ -62,15 +111,73 @@ class CtaEngine(object):
         self.portfolio.config(identifier_multiplier=cta_settings.portfolio, symbol_multiplier=cta_settings.symbol_multiplier)
         self.event_engine.register(EVENT_SIGNAL, self.portfolio.on_signal_event)
 
-        # executor
-        self.executor = bitmexTargetPositionExecutor(self.g, self.bitmex_account_settings, cta_settings.symbols)
-        self.executor.add_event_engine(self.event_engine)
-        self.executor.add_data_handler(self.data_handler)
-
-        self.event_engine.register(EVENT_TARGET_POSITION, self.executor.on_target_position_event)
-        for s in cta_settings.symbols:
-            self.event_engine.register(EVENT_TICK % s, self.executor.on_tick_event)
-            self.event_engine.register(EVENT_ORDERBOOK % s, self.executor.on_orderbook_event)
+        # executor (its constructor connects the trading socket: none when replaying, no order is sent)
+        self.executor = None
+        if not self.replay:
+            self.executor = bitmexTargetPositionExecutor(self.g, self.bitmex_account_settings, cta_settings.symbols,
+                                                         ws_manager=self.ws_manager)
+            self.executor.add_event_engine(self.event_engine)
+            self.executor.add_data_handler(self.data_handler)
+            self.executor.add_timer_service(self.timer_service)
+
+            self.event_engine.register(EVENT_TARGET_POSITION, self.executor.on_target_position_event)
+            for s in cta_settings.symbols:
+                self.event_engine.register(registry.intern(EVENT_TICK, s), self.executor.on_tick_event)
+                self.event_engine.register(registry.intern(EVENT_ORDERBOOK, s), self.executor.on_orderbook_event)
+
+        # instrumentation: per handler latency histograms, queue wait, slow-handler warnings
+        if self.g.event_engine.get('stats'):
+            self.event_engine.enable_stats(slow_handler_ms=self.g.event_engine.get('slow_handler_ms', 5.0))
+
+        # journal: every dispatched event + market data, for deterministic replay (see replay_journal)
+        self.journal = None
+        if self.g.journal.get('path') and not self.replay:
+            self.journal = eventJournal(self.g.journal['path'])
+            self.journal.attach(self.event_engine)
+            self.data_handler.add_journal(self.journal)
+
+        # tape: raw websocket frames as received, for offline replay of the feed (see replay_tape)
+        self.tape = None
+        if self.g.tape.get('path') and not self.replay:
+            self.tape = bitmexTapeRecorder(self.g.tape['path'],
+                                           rotate_bytes=int(self.g.tape.get('rotate_mb', 64) * (1 << 20)),
+                                           rotate_seconds=self.g.tape.get('rotate_minutes', 60) * 60,
+                                           loglevel=self.g.loglevel, logfile=self.g.logfile)
+            if self.ws_manager is not None:
+                self.ws_manager.add_tape_recorder(self.tape)
+            self.data_handler.add_tape_recorder(self.tape)
+
+        # conflation: under backpressure only the newest tick / orderbook event per symbol is delivered
+        if self.g.event_engine.get('conflate'):
+            for s in cta_settings.symbols:
+                self.event_engine.conflate(registry.intern(EVENT_TICK, s))
+                self.event_engine.conflate(registry.intern(EVENT_ORDERBOOK, s))
+
+    def __construct_event_engine(self):
+        """event engine type from global settings: 'queue' (default), 'ring', 'sharded' or 'asyncio'
+
+        batch_size: drain and dispatch up to batch_size queued events per wakeup (None: one by one)
+        sharded: 'workers' symbol lanes + 1 global lane, each lane is a 'lane' ('queue' or 'ring') engine
+        """
+        st = self.g.event_engine
+        engine_type = st.get('type', 'queue')
+        batch_size = st.get('batch_size')
+        capacity = st.get('capacity', 65536)
+
+        def construct(kind):
+            if kind == 'queue':
+                return eventEngine(batch_size=batch_size)
+            elif kind == 'ring':
+                return ringBufferEventEngine(capacity=capacity, batch_size=batch_size)
+            elif kind == 'asyncio':
+                return asyncEventEngine(batch_size=batch_size)
+            else:
+                raise ValueError('Invalid event_engine type: %s' % kind)
+
+        if engine_type == 'sharded':
+            lane_type = st.get('lane', 'queue')
+            return shardedEventEngine(n_workers=st.get('workers', 4), engine_factory=lambda: construct(lane_type))
+        return construct(engine_type)
 
     def __construct_strategy_instance(self, config):
         assert isinstance(config, CtaStrategyConfig)
@@ -81,20 +188,105 @@ class CtaEngine(object):
             print('Can not find strategy class: %s' % config.strategy_name)
 
     def start(self):
+        if self.journal is not None:
+            self.journal.open()            # Start recording
+        if self.tape is not None:
+            self.tape.open()               # Start recording the websocket frames
         self.event_engine.start()          # Start the event engine
+        self.timer_service.start()         # Start the timer service
+        self.warmup()                      # history bars -> bar_history -> strategy.on_warmup(), before live ticks
         self.data_handler.start()          # Start the data_handler
-        self.data_handler.get_init_data()  # TODO Normally requires real-time data and obtains historical data based on the first TICK timestamp
         for strategy in self.strategy_pool:
             strategy.on_init()             # strategy init:  todo fix bug: on_init called before first Tick
 
     def stop(self):
         self.data_handler.stop()
+        self.timer_service.stop()
+        self.event_engine.stop()
+        if self.journal is not None:
+            self.journal.close()
+        if self.tape is not None:
+            self.tape.close()
+
+    def replay_journal(self, path, speed=None):
+        """replay a recorded session: market data -> DataHandler -> strategies -> portfolio, as fast as possible
+        (speed=None) or at recorded pace x speed. Needs an engine built with replay=True.
+
+        deterministic: the event engine is not started, the events of every record are dispatched on this
+        thread before the next record is fed
+        """
+        assert self.replay, 'replay_journal() needs CtaEngine(..., replay=True)'
+        return eventReplayer(path).replay(data_handler=self.data_handler, event_engine=self.event_engine,
+                                          speed=speed, on_ready=self.__init_strategies)
+
+    def replay_tape(self, path, speed=None):
+        """replay recorded websocket frames (a tape file or directory): frames -> bitmexWSMarket -> DataHandler ->
+        strategies -> portfolio, as fast as possible (speed=None) or at recorded pace x speed.
+        Needs an engine built with replay=True; deterministic like replay_journal()
+        """
+        assert self.replay, 'replay_tape() needs CtaEngine(..., replay=True)'
+        return bitmexTapeReplayer(path).replay(data_handler=self.data_handler, event_engine=self.event_engine,
+                                               speed=speed, tick_batch=self.data_handler.tick_batch,
+                                               on_ready=self.__init_strategies)
+
+    def warmup(self):
+        """load the warm-up bars every strategy (warmup_bars) and shared indicator (lookback()) asks for,
+        in parallel, then strategy.on_warmup()
+        """
+        if not self.g.warmup.get('enabled', True):
+            return
+        lookback = self.indicators.lookback()
+        for strategy in self.strategy_pool:
+            n = getattr(strategy, 'warmup_bars', 0)
+            key = (strategy.symbol, strategy.bar_type)
+            if n and n > lookback.get(key, 0):
+                lookback[key] = n
+        if not lookback:
+            return
+        self.data_handler.get_init_data(lookback, cache_dir=self.g.warmup.get('cache_dir'),
+                                        workers=self.g.warmup.get('workers', 4))
+        for strategy in self.strategy_pool:
+            if hasattr(strategy, 'on_warmup'):
+                strategy.on_warmup()
+
+    def __init_strategies(self):
+        for strategy in self.strategy_pool:
+            strategy.on_init()
+
+    async def async_start(self):
+        """asyncio mode (event_engine type 'asyncio')
+
+        websocket feed, DataHandler and event dispatch all run on the running loop.
+        Strategies are initialized once every symbol got its first tick, so blocking waits in
+        on_init return at once; an on_init returning an awaitable is awaited.
+        """
+        assert isinstance(self.event_engine, asyncEventEngine), 'async_start() needs event_engine type "asyncio"'
+        self.event_engine.start()
+        self.timer_service.start()
+        await asyncio.get_running_loop().run_in_executor(None, self.warmup)
+        await self.data_handler.async_start()
+        await self.data_handler.wait_for_first_tick()
+        for strategy in self.strategy_pool:
+            res = strategy.on_init()
+            if inspect.isawaitable(res):
+                await res
+
+    async def async_stop(self):
+        await self.data_handler.async_stop()
+        self.timer_service.stop()
         self.event_engine.stop()
+        await self.event_engine.join()
+
+    async def run_async(self, seconds):
+        """asyncio mode: start, run for `seconds`, stop"""
+        await self.async_start()
+        await asyncio.sleep(seconds)
+        await self.async_stop()
 
 
     def monitor_event_engine(self):
-        """Monitor main process events"""
-        pass
+        """Monitor main process events: per event type / handler latency rows (event_engine.stats enabled)"""
+        return self.event_engine.get_stats()
 
 
 class GlobalSettings(object):
@@ -109,12 +301,26 @@ class GlobalSettings(object):
     def __init__(self):
         self.loglevel = None
         self.logfile = None
+        self.event_engine = {}   # {'type': 'queue' | 'ring' | 'sharded' | 'asyncio', ...}
+        self.market_data = {}    # {'pool_size': n, 'bar_history': n, 'tick_batch': bool, 'depth': topic, 'snapshot_interval': s}
+        self.timer = {}          # {'tick': seconds}
+        self.journal = {}        # {'path': journal file} record the session if set
+        self.warmup = {}         # {'enabled': bool, 'cache_dir': dir, 'workers': n} history bars before start
+        self.tape = {}           # {'path': directory, 'rotate_mb': n, 'rotate_minutes': n} record the raw websocket frames if set
+        self.websocket = {}      # {'multiplex': bool, 'reconnect': {'enabled': bool, 'backoff_min': s, 'backoff_max': s, 'stale_timeout': s}}
 
     def from_config_file(self, file):
         with open(file) as f:
             st = json.load(f)
         self.loglevel = st['log']['loglevel']
         self.logfile = st['log']['logfile']
+        self.event_engine = st.get('event_engine', {})
+        self.market_data = st.get('market_data', {})
+        self.timer = st.get('timer', {})
+        self.journal = st.get('journal', {})
+        self.warmup = st.get('warmup', {})
+        self.websocket = st.get('websocket', {})
+        self.tape = st.get('tape', {})
 
 
 
@@ -133,6 +339,9 @@ if __name__ == '__main__':
     cta_settings.check()
 
     me = CtaEngine(g, bitmex_account_settings, cta_settings)
-    me.start()
-    time.sleep(120)
-    me.stop()
+    if g.event_engine.get('type') == 'asyncio':
+        asyncio.run(me.run_async(120))
+    else:
+        me.start()
+        time.sleep(120)
+        me.stop()
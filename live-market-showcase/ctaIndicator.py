@@ -0,0 +1,284 @@
+"""
+incremental indicators shared by CTA strategies
+"""
+
+
+from qsBarHistory import Bars
+from event.eventType import EVENT_BAR_CLOSE
+from event.eventTypeRegistry import registry
+import collections
+import inspect
+import math
+import threading
+
+
+class Indicator(object):
+    """indicator of one (symbol, bar_type), updated with every closed bar
+
+    value is None until the first bar, ready once `period` bars are in.
+    Shared by every strategy asking IndicatorRegistry for it: read value / ready, never call update().
+    """
+
+    def __init__(self, period):
+        assert period >= 1, 'period must be >= 1. period is %s' % period
+        self.period = period
+        self.count = 0      # bars seen
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def lookback(self):
+        """closed bars needed before value is meaningful, see IndicatorRegistry.lookback()"""
+        return self.period
+
+    def update(self, bar):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '<%s(%s) value=%s>' % (self.__class__.__name__, self.period, self.value)
+
+
+class EMA(Indicator):
+    """exponential moving average of close, alpha = 2 / (period + 1), seeded with the first close"""
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.alpha = 2 / (period + 1)
+
+    def lookback(self):
+        return 4 * self.period   # weight of the seed < 2%
+
+    def update(self, bar):
+        self.count += 1
+        if self.value is None:
+            self.value = bar.close
+        else:
+            self.value += self.alpha * (bar.close - self.value)
+
+
+class SMA(Indicator):
+    """simple moving average of close over the last `period` bars (fewer until ready)"""
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.window = collections.deque()
+        self.total = 0.0
+
+    def update(self, bar):
+        self.count += 1
+        self.window.append(bar.close)
+        self.total += bar.close
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+        if self.count % self.period == 0:
+            self.total = math.fsum(self.window)   # drop the rounding drift of the running sum
+        self.value = self.total / len(self.window)
+
+
+class RollingMax(Indicator):
+    """highest high of the last `period` bars
+
+    monotonic deque of (bar index, high), highs decreasing: O(1) amortized per bar
+    """
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.window = collections.deque()
+
+    def _better(self, a, b):
+        return a >= b
+
+    def _field(self, bar):
+        return bar.high
+
+    def update(self, bar):
+        x = self._field(bar)
+        i = self.count
+        self.count += 1
+        window = self.window
+        while window and self._better(x, window[-1][1]):
+            window.pop()
+        window.append((i, x))
+        if window[0][0] <= i - self.period:
+            window.popleft()
+        self.value = window[0][1]
+
+
+class RollingMin(RollingMax):
+    """lowest low of the last `period` bars"""
+
+    def _better(self, a, b):
+        return a <= b
+
+    def _field(self, bar):
+        return bar.low
+
+
+class ATR(Indicator):
+    """average true range, Wilder smoothing: the mean of the first `period` true ranges, then
+    atr += (tr - atr) / period. The first true range is high - low (no previous close)
+    """
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.prev_close = None
+
+    def lookback(self):
+        return 4 * self.period
+
+    def update(self, bar):
+        tr = bar.high - bar.low
+        if self.prev_close is not None:
+            tr = max(tr, abs(bar.high - self.prev_close), abs(bar.low - self.prev_close))
+        self.prev_close = bar.close
+        self.count += 1
+        if self.value is None:
+            self.value = tr
+        elif self.count <= self.period:
+            self.value += (tr - self.value) / self.count
+        else:
+            self.value += (tr - self.value) / self.period
+
+
+class Bollinger(Indicator):
+    """Bollinger bands of close: mid = SMA(period), upper / lower = mid +/- k * std (population)
+
+    value is (mid, upper, lower). Mean and variance are updated with Welford's method
+    (adding the new close, removing the oldest one), without the cancellation of a sum of squares.
+    """
+
+    def __init__(self, period, k=2.0):
+        super().__init__(period)
+        self.k = k
+        self.window = collections.deque()
+        self.mean = 0.0
+        self.m2 = 0.0       # sum of squared deviations from mean
+        self.mid = None
+        self.upper = None
+        self.lower = None
+
+    def update(self, bar):
+        x = bar.close
+        self.count += 1
+        window = self.window
+        window.append(x)
+        n = len(window)
+        if n > self.period:
+            y = window.popleft()
+            n -= 1
+            mean = self.mean + (x - y) / n
+            self.m2 += (x - y) * (x - mean + y - self.mean)
+            self.mean = mean
+        else:
+            delta = x - self.mean
+            self.mean += delta / n
+            self.m2 += delta * (x - self.mean)
+        std = math.sqrt(max(self.m2, 0.0) / n)
+        self.mid = self.mean
+        self.upper = self.mean + self.k * std
+        self.lower = self.mean - self.k * std
+        self.value = (self.mid, self.upper, self.lower)
+
+    def __repr__(self):
+        return '<Bollinger(%s, %s) value=%s>' % (self.period, self.k, self.value)
+
+
+INDICATOR_CLASS = {
+    'ema': EMA,
+    'sma': SMA,
+    'max': RollingMax,
+    'min': RollingMin,
+    'atr': ATR,
+    'boll': Bollinger,
+}
+
+
+class IndicatorRegistry(object):
+    """indicators keyed by (symbol, bar_type, kind, params), computed once and shared read-only
+
+    get('XBTUSD', '1m', 'ema', 20) returns the same EMA to every strategy asking for it, so a grid of
+    configs on one (symbol, bar_type) costs one update per distinct indicator per bar close.
+    Live bars are folded in by an EVENT_BAR_CLOSE handler on the dispatcher (attach() before the strategies
+    register theirs): in on_bar_close / on_bar_open of strategies, indicators include the bar of the event
+    and no later one, however far the dispatcher is behind the DataHandler. Warm-up bars are folded in by
+    the DataHandler (on_bar_close()) before it starts.
+    A new indicator is seeded with the bars already in data_handler.get_prev_bars(): call get() before
+    DataHandler.start() (eg. in add_indicator_registry() or on_warmup()).
+    """
+
+    def __init__(self, data_handler=None):
+        self.data_handler = data_handler
+        self.__indicators = {}     # {(symbol, bar_type): {(kind, params): Indicator}}, replaced on write
+        self.__subscribers = {}    # {(symbol, bar_type, kind, params): number of get() calls}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(d) for d in self.__indicators.values())
+
+    @staticmethod
+    def __params(kls, params):
+        """positional params with defaults filled in: ('boll', 20) and ('boll', 20, 2.0) are one indicator"""
+        bound = inspect.signature(kls).bind(*params)
+        bound.apply_defaults()
+        return tuple(bound.args)
+
+    def get(self, symbol, bar_type, kind, *params):
+        """shared indicator, eg. get('XBTUSD', '1m', 'boll', 20, 2).upper"""
+        if kind not in INDICATOR_CLASS:
+            raise ValueError('Invalid indicator kind: %s, valid kinds: %s' % (kind, list(INDICATOR_CLASS)))
+        kls = INDICATOR_CLASS[kind]
+        params = self.__params(kls, params)
+        with self.__lock:
+            key = (symbol, bar_type, kind, params)
+            self.__subscribers[key] = self.__subscribers.get(key, 0) + 1
+            indicators = self.__indicators.get((symbol, bar_type), {})
+            indicator = indicators.get((kind, params))
+            if indicator is None:
+                indicator = kls(*params)
+                self.__seed(symbol, bar_type, indicator)
+                indicators = dict(indicators)   # copy on write: on_bar_close() iterates without the lock
+                indicators[(kind, params)] = indicator
+                self.__indicators[(symbol, bar_type)] = indicators
+            return indicator
+
+    def __seed(self, symbol, bar_type, indicator):
+        if self.data_handler is None:
+            return
+        bars = self.data_handler.get_prev_bars(symbol, bar_type, self.data_handler.bar_history_size)
+        if bars is None:
+            return
+        for row in zip(*(column.tolist() for column in bars)):
+            indicator.update(Bars(*row))
+
+    def attach(self, event_engine):
+        """update the indicators on the EVENT_BAR_CLOSE of every bar registered in data_handler, call before
+        the strategies register their bar handlers: handlers of an event type are called in registration order
+        """
+        for symbol, bar_types in self.data_handler.registered_bar_events.items():
+            for bar_type in bar_types:
+                event_engine.register(registry.intern(EVENT_BAR_CLOSE, symbol, bar_type), self.on_bar_close_event)
+
+    def on_bar_close_event(self, event):
+        d = event.dict_
+        self.on_bar_close(d['symbol'], d['bar_type'],
+                          Bars(d['open'], d['high'], d['low'], d['close'], d['volume'], d['vwap'], d['timestamp']))
+
+    def on_bar_close(self, symbol, bar_type, bar):
+        """update every indicator of (symbol, bar_type) with the closed bar"""
+        indicators = self.__indicators.get((symbol, bar_type))
+        if indicators:
+            for indicator in indicators.values():
+                indicator.update(bar)
+
+    def lookback(self):
+        """{(symbol, bar_type): n}, the warm-up bars the registered indicators need"""
+        lookback = {}
+        for key, indicators in self.__indicators.items():
+            lookback[key] = max(indicator.lookback() for indicator in indicators.values())
+        return lookback
+
+    def subscribers(self):
+        """{(symbol, bar_type, kind, params): number of strategies sharing the indicator}"""
+        return dict(self.__subscribers)
@@ -4,6 +4,7 @@ some configurations, objects (classes), etc in CTA module
 
 
 from qsObject import Strategy
+from bitmex.utils import check_bar_pattern
 import json
 import os
 
@@ -35,8 +36,9 @@ class CtaPortfolioSettings(object):
         1. symbols
         2. bar_types
         """
-        # 1. identifier format
+        # 1. identifier format, bar_type pattern
         for config in self.strategy_configs:
+            check_bar_pattern(config.bar_type)
             assert isinstance(config, CtaStrategyConfig)
             b = config.identifier == '%s_%s_%s_%s' % (config.strategy_name, config.symbol, config.bar_type, config.config_id)
             if not b:
@@ -73,7 +75,7 @@ class CtaStrategyConfig(object):
         self.strategy_name = strategy_name
         self.config_id = config_id
         self.symbol = symbol
-        self.bar_type = bar_type
+        self.bar_type = bar_type   # time bar '15s' / '1m' / '4h', or threshold bar '500tick' / '100000vol' / '50000000notional' / '50imb'
         self.para = para
 
     def __repr__(self):
@@ -83,6 +85,8 @@ class CtaStrategyConfig(object):
 class CtaStrategy(Strategy):
     """CTA strategy"""
 
+    warmup_bars = 0   # closed bars of (symbol, bar_type) loaded before start, see on_warmup()
+
     def __init__(self, config):
         assert isinstance(config, CtaStrategyConfig)
         self.config = config
@@ -92,6 +96,16 @@ class CtaStrategy(Strategy):
         self.para = self.config.para
         print('Calling CtaStrategy.__init__() ..........')
 
+    def add_indicator_registry(self, indicators):
+        """IndicatorRegistry (ctaIndicator): ask it for shared indicators here, eg.
+        indicators.get(self.symbol, self.bar_type, 'ema', 20), so that they are warmed up too
+        """
+        self.indicators = indicators
+
+    def on_warmup(self):
+        """called before the first live tick once the warm-up bars are in data_handler.get_prev_bars()"""
+        pass
+
     def on_init(self):
         pass
 
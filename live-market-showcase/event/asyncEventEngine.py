@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import threading
+import time
+import traceback
+from .eventEngine import eventEngine, Event
+
+
+class asyncEventEngine(eventEngine):
+    """eventEngine dispatching on an asyncio event loop instead of its own thread
+
+    - start() must be called from a coroutine: the dispatcher runs as a task of the running loop
+    - put() from the loop (DataHandler fed by bitmexAsyncWSMarket, strategies, portfolio) is a deque append,
+      put() from another thread is handed over with loop.call_soon_threadsafe
+    - handlers are the same sync callables as eventEngine; they run on the loop and must not block it.
+      A handler raising is printed with its traceback and the dispatcher goes on with the next event
+    """
+
+    def __init__(self, batch_size=None):
+        super().__init__(batch_size=batch_size)
+        self.__pending = collections.deque()   # events waiting for dispatch
+        self.__loop = None                     # the loop the dispatcher runs on
+        self.__loop_thread = None              # ident of the loop thread
+        self.__wakeup = None                   # asyncio.Event, set when events are pending
+        self.__task = None                     # dispatcher task
+        self.__active = False
+
+    def start(self):
+        """start the dispatcher task on the running loop"""
+        self.__loop = asyncio.get_running_loop()
+        self.__loop_thread = threading.get_ident()
+        self.__wakeup = asyncio.Event()
+        self.__active = True
+        self.__task = self.__loop.create_task(self.__run())
+        self.__task.add_done_callback(self.__on_done)
+
+    @staticmethod
+    def __on_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            print('❎  asyncEventEngine ❎  dispatcher died: %r' % task.exception())
+            traceback.print_exception(type(task.exception()), task.exception(), task.exception().__traceback__)
+
+    def stop(self, drain=False):
+        """stop the dispatcher task; pending events are dropped, or dispatched here first with drain=True
+        (call it from the loop then: handlers run on the calling thread)
+        """
+        self.__active = False
+        pending = self.__pending
+        while drain and pending:
+            self.process(pending.popleft())
+        if self.__task is not None:
+            self.__task.cancel()
+        self.print_conflation_stats()
+        self.print_stats()
+
+    def run_pending(self):
+        """dispatch what is pending on the calling thread, without the dispatcher task (see eventEngine.run_pending)"""
+        pending = self.__pending
+        batch_size = self.get_batch_size()
+        n = 0
+        while pending:
+            if batch_size:
+                batch = [pending.popleft() for _ in range(min(len(pending), batch_size))]
+                self.process_batch(batch)
+                n += len(batch)
+            else:
+                self.process(pending.popleft())
+                n += 1
+        return n
+
+    async def join(self):
+        """wait until the dispatcher task has finished after stop()"""
+        if self.__task is not None:
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+
+    async def __run(self):
+        """dispatch whatever is pending, yield to the loop between batches"""
+        pending = self.__pending
+        wakeup = self.__wakeup
+        while self.__active:
+            if not pending:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    print('❎  asyncEventEngine ❎  5 seconds no event')
+                    continue
+            batch_size = self.get_batch_size()
+            if batch_size:
+                n = min(len(pending), batch_size)
+                self.process_batch([pending.popleft() for _ in range(n)], on_error=self.__on_handler_error)
+            else:
+                for _ in range(len(pending)):
+                    event = pending.popleft()
+                    try:
+                        self.process(event)
+                    except Exception:
+                        self.__on_handler_error(event)
+            await asyncio.sleep(0)   # let the feed read the next frame
+
+    @staticmethod
+    def __on_handler_error(event):
+        print('❎  asyncEventEngine ❎  handler failed on %s' % event.type_)
+        traceback.print_exc()
+
+    def put(self, event):
+        """Puts events into the pending deque and wakes the dispatcher"""
+        assert isinstance(event, Event)
+        if self.absorb(event):
+            return
+        if self.stats is not None:
+            event.put_time = time.perf_counter_ns()
+        self.__pending.append(event)
+        if self.__wakeup is None:
+            return   # not started yet, dispatched once started
+        if threading.get_ident() == self.__loop_thread:
+            self.__wakeup.set()
+        else:
+            self.__loop.call_soon_threadsafe(self.__wakeup.set)
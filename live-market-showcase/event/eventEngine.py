@@ -1,13 +1,27 @@
 import queue
 import threading
+import time
+from .ringBuffer import ringBuffer
+from .eventTypeRegistry import registry
+from .eventStats import eventStats
 
 
 class Event:
-    """event object"""
+    """event object
 
-    def __init__(self, type_=None):
+    type_id: interned int of type_ (see eventTypeRegistry). Hot-path producers cache
+    (type_, type_id) from intern_event_type() and pass both; otherwise the engine resolves it.
+    dict_: event content, pass it to the constructor to avoid allocating an empty dict first
+    put_time: perf_counter_ns() when queued, only stamped with stats enabled (see eventStats)
+    """
+
+    __slots__ = ('type_', 'type_id', 'dict_', 'put_time')
+
+    def __init__(self, type_=None, type_id=None, dict_=None):
         self.type_ = type_
-        self.dict_ = {}
+        self.type_id = type_id
+        self.dict_ = {} if dict_ is None else dict_
+        self.put_time = None
 
     def __repr__(self):
         return '<EventObject> type_=%s, dict_=%s' % (self.type_, self.dict_)
@@ -16,12 +30,25 @@ class Event:
 class eventEngine(object):
     """eventEngine (general)"""
 
-    def __init__(self):
-        self.__queue = queue.Queue()    # event queue
-        self.__handlers = {}            # event handler for function mapping
+    def __init__(self, event_queue=None, batch_size=None):
+        self.__queue = event_queue if event_queue is not None else queue.Queue()    # event queue
+        self.__handlers = {}            # event handler for function mapping  {type_id: [func, ...]}
         self.__general_handlers = []    # general event handler
+        self.__table = []               # precompiled handlers: [(func, ...), ...] indexed by type_id
+        self.__general_table = ()       # precompiled general handlers, for type_id without handlers
         self.__run_thread = None        # event processing thread
         self.__active = False           # engine switch
+        self.__draining = False         # stop(drain=True): dispatch what is queued before the thread exits
+
+        self.__batch_size = batch_size       # None: one event per wakeup; n: drain up to n queued events per wakeup
+        self.__before_batch_handlers = []    # called with the batch (list of Event) before it is dispatched
+        self.__after_batch_handlers = []     # called with the batch (list of Event) after it is dispatched
+
+        self.__conflated = {}                   # {type_id: pending Event or None}  conflated event types, see conflate()
+        self.__conflation_dropped = {}          # {type_id: number of updates merged into a pending event}
+        self.__conflation_lock = threading.Lock()
+
+        self.stats = None    # eventStats, see enable_stats()
 
         self.register_general_handler(self.__print_event)
 
@@ -35,44 +62,127 @@ class eventEngine(object):
         self.__run_thread = threading.Thread(target=self.__run)
         self.__run_thread.start()
 
-    def stop(self):
-        """stop the engine"""
+    def stop(self, drain=False):
+        """stop the engine
+
+        drain: dispatch the queued events first, events put by their handlers included (eg. the signals of
+        the last bars of a replay); events put by other threads after stop() may be dropped
+        """
+        self.__draining = drain
         self.__active = False
         self.__run_thread.join()
+        self.print_conflation_stats()
+        self.print_stats()
 
     def __run(self):
         """events are continually fetched from the queue and processed"""
-        while self.__active:
+        while self.__active or (self.__draining and not self.__queue.empty()):
             try:
                 event = self.__queue.get(timeout=5)
             except queue.Empty:
                 print('❎  eventEngine ❎  5 seconds no event')
             else:
-                self.__process(event)
+                if self.__batch_size:
+                    self.__process_batch(self.__drain(event))
+                else:
+                    self.__process(event)
+
+    def __drain(self, first):
+        """drain what is already queued behind `first`, up to batch_size events, without blocking"""
+        batch = [first]
+        get_nowait = self.__queue.get_nowait
+        for _ in range(self.__batch_size - 1):
+            try:
+                batch.append(get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __process_batch(self, batch, on_error=None):
+        """dispatch a whole batch in one pass, wrapped by the before/after batch handlers
+
+        on_error(event): called in an except block when a handler of event raised, the batch goes on
+        (None: the exception propagates)
+        """
+        for func in self.__before_batch_handlers:
+            func(batch)
+        process = self.__process
+        if on_error is None:
+            for event in batch:
+                process(event)
+        else:
+            for event in batch:
+                try:
+                    process(event)
+                except Exception:
+                    on_error(event)
+        for func in self.__after_batch_handlers:
+            func(batch)
 
     def __process(self, event):
-        """Depending on the event type, they are distributed to different handlers"""
+        """Depending on the event type, they are distributed to different handlers
+
+        handlers of type_id followed by general handlers, precompiled into one tuple
+        """
         assert isinstance(event, Event)
-        event_type = event.type_
-        if event_type in self.__handlers:
-            for func in self.__handlers[event_type]:
-                func(event)
-        if self.__general_handlers:
-            for func in self.__general_handlers:
-                func(event)
+        type_id = event.type_id
+        if type_id is None:
+            type_id = event.type_id = registry.id_of(event.type_)
+        if self.__conflated and type_id in self.__conflated:
+            with self.__conflation_lock:
+                if self.__conflated[type_id] is event:
+                    self.__conflated[type_id] = None   # updates from now on are queued again
+        try:
+            handlers = self.__table[type_id]
+        except IndexError:
+            handlers = self.__general_table
+        for func in handlers:
+            func(event)
+
+    def __compile(self):
+        """rebuild the handler table after (un)registering; swapped in with one assignment
+
+        with stats enabled every entry starts with a queue-wait recorder and handlers are timing wrappers
+        """
+        stats = self.stats
+        if stats is None:
+            general = tuple(self.__general_handlers)
+        else:
+            general = (stats.wait_recorder(None),) + tuple(stats.wrap(None, f) for f in self.__general_handlers)
+        n = max(self.__handlers) + 1 if self.__handlers else 0
+        table = [general] * n
+        for type_id, funcs in self.__handlers.items():
+            if stats is None:
+                table[type_id] = tuple(funcs) + general
+            else:
+                table[type_id] = ((stats.wait_recorder(type_id),) + tuple(stats.wrap(type_id, f) for f in funcs) +
+                                  general[1:])
+        self.__general_table = general
+        self.__table = table
+
+    @staticmethod
+    def __type_id(event_type):
+        """event_type: string name or interned type_id"""
+        return event_type if isinstance(event_type, int) else registry.id_of(event_type)
 
     def register(self, event_type, func):
         """Register event handlers"""
         assert callable(func), 'arg func must be callable. func is %s' % func
-        if event_type not in self.__handlers:
-            self.__handlers[event_type] = list()
-        self.__handlers[event_type].append(func)
+        type_id = self.__type_id(event_type)
+        if type_id not in self.__handlers:
+            self.__handlers[type_id] = list()
+        self.__handlers[type_id].append(func)
+        self.__compile()
 
     def unregister(self, event_type, func):
         """Unregister the event handler"""
-        if event_type in self.__handlers:
-            if func in self.__handlers[event_type]:
-                self.__handlers[event_type].remove(func)
+        type_id = self.__type_id(event_type)
+        if type_id in self.__handlers:
+            if func in self.__handlers[type_id]:
+                self.__handlers[type_id].remove(func)
+                if not self.__handlers[type_id]:
+                    del self.__handlers[type_id]
+                self.__compile()
             else:
                 print('func %s is not in self.__handlers[event_type] list' % func)
         else:
@@ -80,16 +190,142 @@ class eventEngine(object):
 
     def register_general_handler(self, func):
         self.__general_handlers.append(func)
+        self.__compile()
 
     def unregister_general_handler(self, func):
         if func in self.__general_handlers:
             self.__general_handlers.remove(func)
+            self.__compile()
+
+    def set_batch_size(self, batch_size):
+        """None or 1: one event per wakeup (default); n: drain and dispatch up to n events per wakeup"""
+        assert batch_size is None or batch_size >= 1, 'batch_size must be None or >= 1. batch_size is %s' % batch_size
+        self.__batch_size = batch_size
+
+    def register_before_batch_handler(self, func):
+        """func(batch) is called before each batch is dispatched (batch mode only)"""
+        assert callable(func), 'arg func must be callable. func is %s' % func
+        self.__before_batch_handlers.append(func)
+
+    def unregister_before_batch_handler(self, func):
+        if func in self.__before_batch_handlers:
+            self.__before_batch_handlers.remove(func)
+
+    def register_after_batch_handler(self, func):
+        """func(batch) is called after each batch is dispatched (batch mode only)"""
+        assert callable(func), 'arg func must be callable. func is %s' % func
+        self.__after_batch_handlers.append(func)
+
+    def unregister_after_batch_handler(self, func):
+        if func in self.__after_batch_handlers:
+            self.__after_batch_handlers.remove(func)
+
+    def get_batch_size(self):
+        return self.__batch_size
 
     def put(self, event):
         """Puts events into queues"""
         assert isinstance(event, Event)
+        if self.__conflated and self.absorb(event):
+            return
+        if self.stats is not None:
+            event.put_time = time.perf_counter_ns()
         self.__queue.put(event)
 
+    def enable_stats(self, slow_handler_ms=5.0):
+        """instrument dispatch: per (event type, handler) latency histograms, queue wait, slow-handler warnings"""
+        self.stats = eventStats(slow_handler_ms=slow_handler_ms)
+        self.__compile()
+
+    def disable_stats(self):
+        self.stats = None
+        self.__compile()
+
+    def get_stats(self):
+        """rows of eventStats.get_stats(), [] if stats are not enabled"""
+        return self.stats.get_stats() if self.stats is not None else []
+
+    def print_stats(self):
+        if self.stats is not None:
+            print(self.stats.dump())
+
+    def conflate(self, event_type):
+        """opt-in conflation of event_type (eg. EVENT_ORDERBOOK / EVENT_TICK of a symbol)
+
+        While an event of this type is still waiting in the queue (the dispatcher is behind),
+        a new one is not queued: its dict_ replaces the pending one's and the update is counted
+        as dropped. So handlers get only the newest update and there is at most one pending
+        event per conflated type. Types not conflated (bar, signal) are delivered exactly.
+        """
+        type_id = self.__type_id(event_type)
+        with self.__conflation_lock:
+            self.__conflated.setdefault(type_id, None)
+            self.__conflation_dropped.setdefault(type_id, 0)
+
+    def absorb(self, event):
+        """conflation on put: True if event was merged into a pending event of its type (not to be queued)"""
+        type_id = event.type_id
+        if type_id is None:
+            type_id = event.type_id = registry.id_of(event.type_)
+        if type_id not in self.__conflated:
+            return False
+        with self.__conflation_lock:
+            pending = self.__conflated[type_id]
+            if pending is None:
+                self.__conflated[type_id] = event
+                return False
+            pending.dict_ = event.dict_
+            self.__conflation_dropped[type_id] += 1
+            return True
+
+    def get_conflation_stats(self):
+        """{event type name: number of dropped (merged) updates}"""
+        return {registry.name(type_id): n for type_id, n in self.__conflation_dropped.items()}
+
+    def print_conflation_stats(self):
+        stats = self.get_conflation_stats()
+        if any(stats.values()):
+            print('❎  eventEngine ❎  conflated (dropped) updates: %s' % stats)
+
+    def run_pending(self):
+        """dispatch what is queued on the calling thread until the queue is empty, the events put by the handlers
+        included; return the number of events dispatched. For a replay: the engine is not started, the
+        replayer runs this after every record so that handlers see the DataHandler as it was at that record
+        """
+        get_nowait = self.__queue.get_nowait
+        n = 0
+        while True:
+            try:
+                event = get_nowait()
+            except queue.Empty:
+                return n
+            if self.__batch_size:
+                batch = self.__drain(event)
+                self.__process_batch(batch)
+                n += len(batch)
+            else:
+                self.__process(event)
+                n += 1
+
+    def process(self, event):
+        """dispatch one event on the calling thread, bypassing the queue"""
+        self.__process(event)
+
+    def process_batch(self, batch, on_error=None):
+        """dispatch a batch of events on the calling thread, with before/after batch handlers"""
+        self.__process_batch(batch, on_error)
+
+
+class ringBufferEventEngine(eventEngine):
+    """eventEngine whose event queue is a preallocated ring buffer (see ringBuffer)
+
+    same register/put API as eventEngine; producers (DataHandler thread, handlers) and the
+    dispatcher thread no longer contend on queue.Queue's lock and condition for every event.
+    """
+
+    def __init__(self, capacity=65536, batch_size=None):
+        super().__init__(event_queue=ringBuffer(capacity), batch_size=batch_size)
+
 
 def test():
     import random
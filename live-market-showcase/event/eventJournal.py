@@ -0,0 +1,226 @@
+"""
+Binary event journal
+
+file:   MAGIC + record*
+record: header (kind, type_id, body length, monotonic ns) + body
+
+kind    body
+TYPE    utf-8 event type name of type_id (written once, before the first EVENT of type_id)
+EVENT   marshal(dict_); events whose dict_ marshal cannot encode (eg. EVENT_TIMER's Timer, EVENT_SNAPSHOT's
+        Snapshot) are not written, they are counted in eventJournal.skipped
+TICK    marshal((symbol, price, volume, direction, timestamp))
+ORDERBOOK  marshal((symbol, bid1, bid1vol, ask1, ask1vol, timestamp))
+
+timestamp: epoch ns (ISO string in journals written before the feed parsed timestamps, converted on read)
+"""
+
+import collections
+import marshal
+import mmap
+import struct
+import threading
+import time
+from .eventEngine import Event
+from .eventTypeRegistry import registry
+from qsDataStructure import Tick, Orderbook
+from bitmex.bitmexTimestamp import to_epoch_ns
+
+
+MAGIC = b'QSJ1'
+HEADER = struct.Struct('<BHIq')   # kind, type_id, body length, monotonic_ns
+
+KIND_TYPE = 1
+KIND_EVENT = 2
+KIND_TICK = 3
+KIND_ORDERBOOK = 4
+
+
+class eventJournal(object):
+    """append-only binary journal of a live session: every dispatched Event + the market data fed to the DataHandler
+
+    the recording side is a deque append (plus a tuple for market data); encoding and writing happen
+    on a background writer thread into a memory-mapped file that grows by `chunk` bytes.
+    """
+
+    def __init__(self, path, chunk=1 << 24, flush_interval=0.001):
+        self.path = path
+        self.chunk = chunk
+        self.flush_interval = flush_interval
+        self.skipped = {}                      # {event type name: events not written, dict_ not marshallable}
+        self.__pending = collections.deque()   # (kind, monotonic_ns, type_id, payload)
+        self.__known_types = set()             # type_id already written as KIND_TYPE
+        self.__file = None
+        self.__mm = None
+        self.__size = 0                        # mapped size
+        self.__offset = 0                      # bytes written
+        self.__run_thread = None
+        self.__active = False
+
+    def open(self):
+        self.__file = open(self.path, 'w+b')
+        self.__size = self.chunk
+        self.__file.truncate(self.__size)
+        self.__mm = mmap.mmap(self.__file.fileno(), self.__size)
+        self.__write(MAGIC)
+        self.__active = True
+        self.__run_thread = threading.Thread(target=self.__run)
+        self.__run_thread.start()
+
+    def close(self):
+        """write what is pending, cut the file to its used length (nothing to do if open() was not called)"""
+        if self.__run_thread is None:
+            return
+        self.__active = False
+        self.__run_thread.join()
+        self.__run_thread = None
+        self.__drain()
+        self.__mm.flush()
+        self.__mm.close()
+        self.__file.truncate(self.__offset)
+        self.__file.close()
+        if self.skipped:
+            print('❎  eventJournal ❎  events not journaled (not marshallable): %s' % self.skipped)
+
+    def attach(self, event_engine):
+        """record every event dispatched by event_engine (as its last general handler)"""
+        event_engine.register_general_handler(self.record_event)
+
+    # ---- recording side (called on the live threads) ----
+
+    def record_event(self, event):
+        self.__pending.append((KIND_EVENT, time.monotonic_ns(), event.type_id, event.dict_))
+
+    def record_tick(self, tick):
+        self.__pending.append((KIND_TICK, time.monotonic_ns(), 0,
+                               (tick.symbol, tick.price, tick.volume, tick.direction, tick.timestamp)))
+
+    def record_tick_batch(self, batch):
+        """one TICK record per trade of the batch"""
+        ts = time.monotonic_ns()
+        symbol = batch.symbol
+        self.__pending.extend((KIND_TICK, ts, 0, (symbol, price, volume, direction, timestamp))
+                              for price, volume, direction, timestamp
+                              in zip(batch.price, batch.volume, batch.direction, batch.timestamp))
+
+    def record_orderbook(self, ob):
+        self.__pending.append((KIND_ORDERBOOK, time.monotonic_ns(), 0,
+                               (ob.symbol, ob.bid1, ob.bid1vol, ob.ask1, ob.ask1vol, ob.timestamp)))
+
+    # ---- writer thread ----
+
+    def __run(self):
+        while self.__active:
+            if not self.__drain():
+                time.sleep(self.flush_interval)
+
+    def __drain(self):
+        pending = self.__pending
+        n = 0
+        while pending:
+            kind, ts, type_id, payload = pending.popleft()
+            try:
+                body = marshal.dumps(payload)
+            except ValueError:   # eg. EVENT_TIMER carries a Timer: a replay could not rebuild it
+                name = registry.name(type_id)
+                self.skipped[name] = self.skipped.get(name, 0) + 1
+                continue
+            if kind == KIND_EVENT and type_id not in self.__known_types:
+                self.__known_types.add(type_id)
+                name = registry.name(type_id).encode('utf-8')
+                self.__write(HEADER.pack(KIND_TYPE, type_id, len(name), ts) + name)
+            self.__write(HEADER.pack(kind, type_id, len(body), ts) + body)
+            n += 1
+        return n
+
+    def __write(self, data):
+        end = self.__offset + len(data)
+        if end > self.__size:
+            self.__mm.flush()
+            self.__mm.close()
+            self.__size += max(self.chunk, len(data))
+            self.__file.truncate(self.__size)
+            self.__mm = mmap.mmap(self.__file.fileno(), self.__size)
+        self.__mm[self.__offset:end] = data
+        self.__offset = end
+
+
+def read_journal(path):
+    """yield (kind, monotonic_ns, type_name or None, payload) of a journal file
+
+    payload: dict_ for KIND_EVENT, Tick / Orderbook for KIND_TICK / KIND_ORDERBOOK
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError('not an event journal: %s' % path)
+            names = {}
+            pos = len(MAGIC)
+            end = len(mm)
+            while pos + HEADER.size <= end:
+                kind, type_id, length, ts = HEADER.unpack_from(mm, pos)
+                pos += HEADER.size
+                body = mm[pos:pos + length]
+                pos += length
+                if kind == KIND_TYPE:
+                    names[type_id] = body.decode('utf-8')
+                elif kind == KIND_EVENT:
+                    yield kind, ts, names[type_id], marshal.loads(body)
+                elif kind == KIND_TICK:
+                    symbol, price, volume, direction, timestamp = marshal.loads(body)
+                    yield kind, ts, None, Tick(symbol=symbol, price=price, volume=volume,
+                                               direction=direction, timestamp=to_epoch_ns(timestamp))
+                elif kind == KIND_ORDERBOOK:
+                    symbol, bid1, bid1vol, ask1, ask1vol, timestamp = marshal.loads(body)
+                    yield kind, ts, None, Orderbook(symbol=symbol, bid1=bid1, bid1vol=bid1vol,
+                                                    ask1=ask1, ask1vol=ask1vol, timestamp=to_epoch_ns(timestamp))
+        finally:
+            mm.close()
+
+
+class eventReplayer(object):
+    """feed a journal back, at recorded pace x speed or as fast as possible (speed=None)
+
+    - market data records go through data_handler.processTick / processOrderbook, so bars and
+      tick / orderbook / bar events are regenerated by the same code path as live
+    - EVENT records are the reference of what happened live; with events=True they are put
+      into event_engine as well (handler-level replay without a DataHandler)
+    - timer_service with a simulatedClock is advanced to the recorded time
+    - event_engine must not be started: what a record queued is dispatched on this thread
+      (event_engine.run_pending()) before the next record, so a strategy handling a bar close sees the
+      DataHandler at that bar, and two replays of a journal dispatch the same events in the same order
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def replay(self, data_handler=None, event_engine=None, timer_service=None, speed=None, events=False,
+               on_ready=None):
+        """on_ready(): called once every symbol of data_handler got its first tick (eg. strategy on_init)"""
+        t0_recorded = None
+        t0_wall = time.monotonic()
+        ready = on_ready is None
+        n = 0
+        for kind, ts, type_name, payload in read_journal(self.path):
+            if t0_recorded is None:
+                t0_recorded = ts
+            if speed:
+                delay = (ts - t0_recorded) / 1e9 / speed - (time.monotonic() - t0_wall)
+                if delay > 0:
+                    time.sleep(delay)
+            if timer_service is not None:
+                timer_service.advance_to(ts / 1e9)
+
+            if kind == KIND_TICK and data_handler is not None:
+                data_handler.processTick(payload)
+                if not ready and all(data_handler.get_current_tick(s) is not None for s in data_handler.symbols):
+                    ready = True
+                    on_ready()
+            elif kind == KIND_ORDERBOOK and data_handler is not None:
+                data_handler.processOrderbook(payload)
+            elif kind == KIND_EVENT and events and event_engine is not None:
+                event_engine.put(Event(type_=type_name, dict_=payload))
+            if event_engine is not None:
+                event_engine.run_pending()
+            n += 1
+        return n
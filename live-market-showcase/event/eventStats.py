@@ -0,0 +1,154 @@
+import time
+from .eventTypeRegistry import registry
+
+
+class latencyHistogram(object):
+    """HDR-style log-linear histogram of integer nanoseconds
+
+    values below 2**sub_bits are exact, above that every power of 2 is split into 2**(sub_bits-1)
+    buckets (relative error < 2**(1-sub_bits), ~3% with sub_bits=6). record() is a few int ops.
+    """
+
+    __slots__ = ('sub_bits', 'half', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, sub_bits=6):
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.counts = [0] * (64 * self.half)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            self.counts[value] += 1
+        else:
+            self.counts[shift * self.half + (value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def bucket_value(self, idx):
+        """lower bound of bucket idx"""
+        if idx < 2 * self.half:
+            return idx
+        shift = idx // self.half - 1
+        return (idx - shift * self.half) << shift
+
+    def percentile(self, p):
+        """value (lower bound of its bucket) below which p percent of the records are"""
+        if self.count == 0:
+            return 0
+        rank = max(1, int(self.count * p / 100.0 + 0.5))
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.bucket_value(idx), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+def handler_name(func):
+    """'EmaStrategy.on_bar_open[EmaStrategy_XBTUSD_30s_1001]' for a strategy, qualname otherwise"""
+    name = getattr(func, '__qualname__', repr(func))
+    identifier = getattr(getattr(func, '__self__', None), 'identifier', None)
+    return '%s[%s]' % (name, identifier) if identifier else name
+
+
+class eventStats(object):
+    """per event type and per handler: call count and latency histogram; per event type: queue wait
+
+    eventEngine.enable_stats() wraps every handler of its precompiled table with a timing wrapper
+    and stamps Event.put_time on put(); with stats disabled the dispatch path is untouched.
+    A handler slower than slow_handler_ms prints a warning (at most once per warn_interval seconds per handler).
+    """
+
+    def __init__(self, slow_handler_ms=5.0, warn_interval=1.0):
+        self.slow_ns = int(slow_handler_ms * 1e6)
+        self.warn_interval_ns = int(warn_interval * 1e9)
+        self.handler_hist = {}   # {(type_id, handler_name): latencyHistogram}  type_id None: general handler
+        self.wait_hist = {}      # {type_id: latencyHistogram}
+        self.slow_calls = {}     # {(type_id, handler_name): number of calls over slow_ns}
+        self.__last_warn = {}    # {(type_id, handler_name): perf_counter_ns of last warning}
+
+    def wrap(self, type_id, func):
+        """func -> timing wrapper recording into the histogram of (type_id, func)"""
+        key = (type_id, handler_name(func))
+        hist = self.handler_hist.setdefault(key, latencyHistogram())
+        self.slow_calls.setdefault(key, 0)
+        record = hist.record
+        slow_ns = self.slow_ns
+        clock = time.perf_counter_ns
+        on_slow = self.__on_slow
+
+        def timed(event):
+            t0 = clock()
+            func(event)
+            dt = clock() - t0
+            record(dt)
+            if dt > slow_ns:
+                on_slow(key, dt, event)
+        return timed
+
+    def wait_recorder(self, type_id):
+        """first callable of a table entry: records how long the event waited in the queue"""
+        record = self.wait_hist.setdefault(type_id, latencyHistogram()).record
+        clock = time.perf_counter_ns
+
+        def record_wait(event):
+            put_time = event.put_time
+            if put_time is not None:
+                record(clock() - put_time)
+        return record_wait
+
+    def __on_slow(self, key, dt, event):
+        self.slow_calls[key] += 1
+        now = time.perf_counter_ns()
+        if now - self.__last_warn.get(key, 0) >= self.warn_interval_ns:
+            self.__last_warn[key] = now
+            print('❎  eventEngine ❎  slow handler %s on %s: %.3f ms (%d slow calls)'
+                  % (key[1], event.type_, dt / 1e6, self.slow_calls[key]))
+
+    @staticmethod
+    def __type_name(type_id):
+        return '*' if type_id is None else registry.name(type_id)
+
+    def get_stats(self):
+        """[{'event_type', 'handler', 'count', 'slow', 'mean_us', 'p50_us', 'p99_us', 'p999_us', 'max_us'}, ...]
+
+        handler '<queue wait>' is the time the events of that type waited in the queue
+        """
+        rows = []
+        for type_id, hist in self.wait_hist.items():
+            rows.append(self.__row(type_id, '<queue wait>', hist, 0))
+        for (type_id, name), hist in self.handler_hist.items():
+            rows.append(self.__row(type_id, name, hist, self.slow_calls[(type_id, name)]))
+        return [r for r in rows if r['count']]
+
+    def __row(self, type_id, name, hist, slow):
+        return {
+            'event_type': self.__type_name(type_id),
+            'handler': name,
+            'count': hist.count,
+            'slow': slow,
+            'mean_us': hist.mean() / 1e3,
+            'p50_us': hist.percentile(50) / 1e3,
+            'p99_us': hist.percentile(99) / 1e3,
+            'p999_us': hist.percentile(99.9) / 1e3,
+            'max_us': hist.max / 1e3,
+        }
+
+    def dump(self):
+        """printable table of get_stats()"""
+        lines = ['%-28s %-60s %10s %6s %10s %10s %10s %10s %10s' %
+                 ('event_type', 'handler', 'count', 'slow', 'mean_us', 'p50_us', 'p99_us', 'p999_us', 'max_us')]
+        for r in sorted(self.get_stats(), key=lambda r: (r['event_type'], r['handler'])):
+            lines.append('%-28s %-60s %10d %6d %10.1f %10.1f %10.1f %10.1f %10.1f' %
+                         (r['event_type'], r['handler'], r['count'], r['slow'],
+                          r['mean_us'], r['p50_us'], r['p99_us'], r['p999_us'], r['max_us']))
+        return '\n'.join(lines)
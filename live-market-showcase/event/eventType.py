@@ -28,13 +28,18 @@ It is recommended to place all constant definitions in this file to check for du
 
 # todo: move some events to CTA module, eg. bar_event, target_position_event
 
+# 系统相关
+EVENT_TIMER = 'eTimer'            # 计时器事件, timerService 到期的定时器（单次 / 周期）
+
 # 市场行情相关
 
 EVENT_MARKET = 'eMarket'          # 通用市场行情事件
 
 EVENT_ORDERBOOK = 'eOrderbook_%s'    # ORDERBOOK行情事件
 EVENT_TICK = 'eTick_%s'              # TICK行情事件
-EVENT_SNAPSHOT = 'eSnapshot'      # 快照行情事件，500ms切片
+EVENT_DEPTH = 'eDepth_%s'            # L2深度行情事件 (orderBookL2 / orderBookL2_25)
+EVENT_SNAPSHOT = 'eSnapshot_%s'      # 快照行情事件，500ms切片 + symbol
+EVENT_GAP = 'eGap_%s'                # 行情中断事件 (websocket 断线 / 重连), + symbol
 EVENT_BAR_OPEN = 'eBarOpen_%s_%s'       # BAR_OPEN + symbol + bar_type
 EVENT_BAR_CLOSE = 'eBarClose_%s_%s'     # BAR_CLOSE + symbol + bar_type
 
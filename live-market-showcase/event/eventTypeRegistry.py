@@ -0,0 +1,81 @@
+import threading
+
+
+class eventTypeRegistry(object):
+    """intern event types into small integers
+
+    An event type is (kind, symbol, bar_type), eg. (EVENT_BAR_CLOSE, 'XBTUSD', '1m').
+    It is interned once into an int type_id (0, 1, 2, ...) and its string name
+    (kind % (symbol, bar_type), eg. 'eBarClose_XBTUSD_1m'), so that producers do not format
+    strings per event and eventEngine dispatches through a table indexed by type_id.
+
+    A string name registered directly (eg. eventEngine.register('eSignal', func)) gets the
+    same type_id as the (kind, symbol, bar_type) that formats to it.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__ids = {}      # {(kind, symbol, bar_type): type_id}
+        self.__names = {}    # {name: type_id}
+        self.__keys = []     # [(kind, symbol, bar_type), ...]  indexed by type_id
+        self.__id_names = [] # [name, ...]  indexed by type_id
+        self.rekeyed = 0     # number of names given their symbol / bar_type after interning, see shardedEventEngine
+
+    def intern(self, kind, symbol=None, bar_type=None):
+        """return type_id of (kind, symbol, bar_type), interning it on first call"""
+        key = (kind, symbol, bar_type)
+        type_id = self.__ids.get(key)
+        if type_id is not None:
+            return type_id
+        args = tuple(x for x in (symbol, bar_type) if x is not None)
+        name = kind % args if args else kind
+        with self.__lock:
+            type_id = self.__names.get(name)
+            if type_id is None:
+                type_id = self.__new_id(name, key)
+            elif self.__keys[type_id][1] is None:
+                self.__keys[type_id] = key   # name was interned first (via id_of), now symbol/bar_type are known
+                if symbol is not None:
+                    self.rekeyed += 1
+            self.__ids[key] = type_id
+        return type_id
+
+    def id_of(self, name):
+        """return type_id of an event type name (string), interning it on first call"""
+        type_id = self.__names.get(name)
+        if type_id is not None:
+            return type_id
+        with self.__lock:
+            type_id = self.__names.get(name)
+            if type_id is None:
+                key = (name, None, None)
+                type_id = self.__new_id(name, key)
+                self.__ids[key] = type_id
+        return type_id
+
+    def name(self, type_id):
+        return self.__id_names[type_id]
+
+    def key(self, type_id):
+        """(kind, symbol, bar_type) of type_id"""
+        return self.__keys[type_id]
+
+    def __len__(self):
+        return len(self.__id_names)
+
+    def __new_id(self, name, key):
+        type_id = len(self.__id_names)
+        self.__keys.append(key)
+        self.__id_names.append(name)
+        self.__names[name] = type_id
+        return type_id
+
+
+# process-wide registry shared by all event engines and producers
+registry = eventTypeRegistry()
+
+
+def intern_event_type(kind, symbol=None, bar_type=None):
+    """(kind, symbol, bar_type) -> (type_, type_id), to be cached by producers and passed to Event()"""
+    type_id = registry.intern(kind, symbol, bar_type)
+    return registry.name(type_id), type_id
@@ -0,0 +1,104 @@
+import itertools
+import queue
+import threading
+import time
+
+
+class ringBuffer(object):
+    """preallocated multi-producer / single-consumer ring buffer (disruptor-style)
+
+    Drop-in replacement of queue.Queue for eventEngine: put(), get(timeout), get_nowait(), qsize(), empty().
+
+    - producers claim a sequence number from an itertools.count (atomic under the GIL) and write
+      into slot `seq & mask`, no lock or condition variable is taken
+    - the single consumer walks the slots in sequence order, takes the item and clears the slot
+    - waiting (empty buffer for the consumer, full buffer for a producer) is: yield -> sleep with backoff
+
+    items must not be None (None marks an empty slot)
+
+    a put() raising queue.Full has already claimed its sequence: the sequence is marked burned and the
+    consumer steps over it instead of waiting for an item that will never be written.
+    """
+
+    def __init__(self, capacity=65536, spin=100, max_sleep=0.001):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError('capacity must be a power of 2, got %s' % capacity)
+        self.capacity = capacity
+        self.__mask = capacity - 1
+        self.__slots = [None] * capacity   # preallocated slots
+        self.__claim = itertools.count()   # next sequence claimed by producers
+        self.__claimed = 0                 # approximate number of claimed sequences, only for qsize()
+        self.__cursor = 0                  # next sequence read by the consumer
+        self.__burned = set()              # sequences claimed by a put() that raised queue.Full, never written
+        self.__consumer = None             # ident of the consumer thread
+        self.__spin = spin                 # yields before sleeping
+        self.__max_sleep = max_sleep       # upper bound of backoff sleep (seconds)
+
+    def put(self, item, block=True, timeout=None):
+        """claim a slot and publish item into it"""
+        assert item is not None, 'ringBuffer can not hold None'
+        seq = next(self.__claim)
+        self.__claimed = seq + 1
+        wrap = seq - self.capacity
+        if wrap >= self.__cursor:
+            # buffer is full: the consumer putting into its own full buffer would wait forever
+            if not block or threading.get_ident() == self.__consumer \
+                    or not self.__wait(lambda: wrap < self.__cursor, timeout):
+                self.__burned.add(seq)
+                raise queue.Full('ringBuffer is full, capacity=%d' % self.capacity)
+        self.__slots[seq & self.__mask] = item
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        """take the next item in sequence order (single consumer only)"""
+        self.__consumer = threading.get_ident()
+        slots = self.__slots
+        burned = self.__burned
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            idx = self.__cursor & self.__mask
+            item = slots[idx]
+            if item is not None:
+                break
+            if self.__cursor in burned:
+                burned.discard(self.__cursor)
+                self.__cursor += 1
+                continue
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not block or not self.__wait(lambda: slots[idx] is not None or self.__cursor in burned, remaining):
+                raise queue.Empty
+        slots[idx] = None
+        self.__cursor += 1
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        """approximate number of items in the buffer"""
+        return max(self.__claimed - self.__cursor, 0)
+
+    def empty(self):
+        return self.__slots[self.__cursor & self.__mask] is None and self.__cursor not in self.__burned
+
+    def __wait(self, condition, timeout=None):
+        """wait until condition() is True, return False on timeout
+
+        pure busy spinning would hold the GIL and starve the other side, so spin with time.sleep(0)
+        (releases the GIL) first and then back off up to max_sleep.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        n = 0
+        sleep = 0.00001
+        while not condition():
+            if n < self.__spin:
+                n += 1
+                time.sleep(0)
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(sleep)
+            sleep = min(sleep * 2, self.__max_sleep)
+        return True
@@ -0,0 +1,189 @@
+import threading
+from .eventEngine import eventEngine, Event
+from .eventTypeRegistry import registry
+
+
+class shardedEventEngine(object):
+    """eventEngine sharded by symbol
+
+    - n_workers symbol lanes + 1 global lane, every lane is an eventEngine with its own dispatcher thread
+    - an event type with a symbol (tick, orderbook, bar of 'XBTUSD') always goes to the lane of its symbol,
+      so events of one symbol keep their order and a slow XBTUSD handler does not delay ETHUSD
+    - an event type without symbol (signal, target_position) goes to the global lane,
+      so portfolio and executor see them in order on one thread
+
+    same register/put API as eventEngine. A type registered by name before registry.intern() gave it its
+    symbol is first routed to the global lane; it moves to its symbol lane, with its handlers, once interned.
+    Handlers of different symbols run concurrently: shared state between them must be thread-safe.
+    """
+
+    def __init__(self, n_workers=4, engine_factory=None):
+        assert n_workers >= 1, 'n_workers must be >= 1. n_workers is %s' % n_workers
+        if engine_factory is None:
+            engine_factory = eventEngine
+        self.__lanes = [engine_factory() for _ in range(n_workers)]   # symbol lanes
+        self.__global_lane = engine_factory()                         # lane for events without symbol
+        self.__symbol_lane = {}     # {symbol: lane}
+        self.__lane_load = [0] * n_workers   # number of symbols assigned to each symbol lane
+        self.__routes = []          # [lane, ...]  indexed by type_id
+        self.__handlers = {}        # {type_id: [func, ...]}  registered through this engine, moved on reroute
+        self.__conflated = set()    # type_ids conflated through this engine
+        self.__rekeyed = registry.rekeyed   # routes are checked again when the registry re-keys a type
+        self.__lock = threading.Lock()
+
+    def start(self):
+        """start all lanes"""
+        self.__global_lane.start()
+        for lane in self.__lanes:
+            lane.start()
+
+    def stop(self, drain=False):
+        """stop all lanes (concurrently, each lane may wait up to its queue timeout)
+
+        drain: dispatch the queued events first; the symbol lanes are drained before the global lane
+        their handlers feed (signals, target positions)
+        """
+        if drain:
+            self.__stop_lanes(self.__lanes, drain)
+            self.__global_lane.stop(drain=True)
+        else:
+            self.__stop_lanes(self.__all_lanes(), drain)
+
+    @staticmethod
+    def __stop_lanes(lanes, drain):
+        tds = [threading.Thread(target=lane.stop, args=(drain,)) for lane in lanes]
+        for td in tds:
+            td.start()
+        for td in tds:
+            td.join()
+
+    def run_pending(self):
+        """dispatch what is queued on the calling thread (engine not started, see eventEngine.run_pending):
+        symbol lanes first, then the global lane their handlers feed, until every lane is empty
+        """
+        n = 0
+        while True:
+            ran = sum(lane.run_pending() for lane in self.__lanes) + self.__global_lane.run_pending()
+            if not ran:
+                return n
+            n += ran
+
+    def __all_lanes(self):
+        return [self.__global_lane] + self.__lanes
+
+    def lane_of(self, event_type):
+        """the lane (eventEngine) events of event_type are dispatched on"""
+        type_id = event_type if isinstance(event_type, int) else registry.id_of(event_type)
+        if self.__rekeyed != registry.rekeyed:
+            self.__reroute()
+        try:
+            lane = self.__routes[type_id]
+        except IndexError:
+            lane = None
+        if lane is None:
+            lane = self.__route(type_id)
+        return lane
+
+    def __route(self, type_id):
+        """route type_id by its symbol; a new symbol goes to the symbol lane with fewest symbols"""
+        with self.__lock:
+            symbol = registry.key(type_id)[1]
+            lane = self.__global_lane if symbol is None else self.__lane_of_symbol(symbol)
+            routes = list(self.__routes)
+            if len(routes) <= type_id:
+                routes.extend([None] * (type_id + 1 - len(routes)))
+            routes[type_id] = lane
+            self.__routes = routes
+        return lane
+
+    def __lane_of_symbol(self, symbol):
+        lane = self.__symbol_lane.get(symbol)
+        if lane is None:
+            i = self.__lane_load.index(min(self.__lane_load))
+            self.__lane_load[i] += 1
+            lane = self.__symbol_lane[symbol] = self.__lanes[i]
+        return lane
+
+    def __reroute(self):
+        """move the types routed to the global lane that got a symbol since (registry.intern after register)"""
+        with self.__lock:
+            rekeyed = registry.rekeyed
+            routes = list(self.__routes)
+            for type_id, lane in enumerate(routes):
+                symbol = registry.key(type_id)[1]
+                if lane is not self.__global_lane or symbol is None:
+                    continue
+                lane = routes[type_id] = self.__lane_of_symbol(symbol)
+                for func in self.__handlers.get(type_id, ()):
+                    self.__global_lane.unregister(type_id, func)
+                    lane.register(type_id, func)
+                if type_id in self.__conflated:
+                    lane.conflate(type_id)
+            self.__routes = routes
+            self.__rekeyed = rekeyed
+
+    def register(self, event_type, func):
+        """Register event handlers on the lane of event_type"""
+        type_id = event_type if isinstance(event_type, int) else registry.id_of(event_type)
+        self.lane_of(type_id).register(type_id, func)
+        self.__handlers.setdefault(type_id, []).append(func)
+
+    def unregister(self, event_type, func):
+        """Unregister the event handler"""
+        type_id = event_type if isinstance(event_type, int) else registry.id_of(event_type)
+        self.lane_of(type_id).unregister(type_id, func)
+        if func in self.__handlers.get(type_id, ()):
+            self.__handlers[type_id].remove(func)
+
+    def register_general_handler(self, func):
+        """general handlers are registered on every lane (called concurrently)"""
+        for lane in self.__all_lanes():
+            lane.register_general_handler(func)
+
+    def unregister_general_handler(self, func):
+        for lane in self.__all_lanes():
+            lane.unregister_general_handler(func)
+
+    def conflate(self, event_type):
+        """opt-in conflation of event_type on its lane, see eventEngine.conflate()"""
+        type_id = event_type if isinstance(event_type, int) else registry.id_of(event_type)
+        self.lane_of(type_id).conflate(type_id)
+        self.__conflated.add(type_id)
+
+    def get_conflation_stats(self):
+        stats = {}
+        for lane in self.__all_lanes():
+            stats.update(lane.get_conflation_stats())
+        return stats
+
+    def enable_stats(self, slow_handler_ms=5.0):
+        """instrument every lane, see eventEngine.enable_stats()"""
+        for lane in self.__all_lanes():
+            lane.enable_stats(slow_handler_ms)
+
+    def get_stats(self):
+        """rows of every lane (an event type / handler lives on exactly one lane, general handlers on all)"""
+        rows = []
+        for lane in self.__all_lanes():
+            rows.extend(lane.get_stats())
+        return rows
+
+    def set_batch_size(self, batch_size):
+        for lane in self.__all_lanes():
+            lane.set_batch_size(batch_size)
+
+    def put(self, event):
+        """Puts events into the queue of its lane"""
+        assert isinstance(event, Event)
+        type_id = event.type_id
+        if type_id is None:
+            type_id = event.type_id = registry.id_of(event.type_)
+        if self.__rekeyed != registry.rekeyed:
+            self.__reroute()
+        try:
+            lane = self.__routes[type_id]
+        except IndexError:
+            lane = None
+        if lane is None:
+            lane = self.__route(type_id)
+        lane.put(event)
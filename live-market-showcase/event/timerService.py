@@ -0,0 +1,184 @@
+import itertools
+import threading
+import time
+from .eventEngine import Event
+from .eventType import EVENT_TIMER
+from .eventTypeRegistry import intern_event_type
+
+
+class Timer(object):
+    """a pending timer, returned by timerService.schedule(), pass it to cancel()"""
+
+    __slots__ = ('timer_id', 'deadline', 'period', 'func', 'expiry', 'cancelled')
+
+    def __init__(self, timer_id, deadline, period, func):
+        self.timer_id = timer_id
+        self.deadline = deadline    # seconds, on the clock of the timerService
+        self.period = period        # None: one-shot; seconds: periodic
+        self.func = func            # func(event), called on the dispatcher thread
+        self.expiry = None          # deadline in wheel ticks
+        self.cancelled = False
+
+    def __repr__(self):
+        return '<Timer> id=%s, deadline=%s, period=%s' % (self.timer_id, self.deadline, self.period)
+
+
+class timingWheel(object):
+    """hierarchical timing wheel
+
+    level k has wheel_size slots of tick * wheel_size**k seconds. A timer is placed in the lowest
+    level its remaining time fits in; when a level wraps, the current slot of the level above is
+    cascaded down. add() is O(1), cancel is lazy (flag, dropped when its slot comes up) and
+    advancing one tick is O(1) amortized, whatever the number of pending timers.
+    """
+
+    def __init__(self, tick=0.01, wheel_size=256, levels=4, start=0.0):
+        self.tick = tick
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self.span = wheel_size ** levels      # ticks covered by the whole wheel
+        self.current = int(start / tick)      # current time in ticks
+        self.count = 0                        # timers in the wheel (including cancelled ones)
+        self.__slots = [[[] for _ in range(wheel_size)] for _ in range(levels)]
+        self.__widths = [wheel_size ** k for k in range(levels)]
+
+    def add(self, timer):
+        """place timer by its deadline; an already expired timer fires on the next tick"""
+        timer.expiry = max(int(-(-timer.deadline // self.tick)), self.current + 1)   # ceil
+        self.__place(timer)
+        self.count += 1
+
+    def __place(self, timer):
+        expiry = min(timer.expiry, self.current + self.span - 1)   # beyond the wheel: park in the top level
+        delta = expiry - self.current
+        for level, width in enumerate(self.__widths):
+            if delta < width * self.wheel_size:
+                self.__slots[level][(expiry // width) % self.wheel_size].append(timer)
+                return
+
+    def advance(self, now):
+        """move the wheel to time `now` (seconds), return the expired timers in expiry order"""
+        target = int(now / self.tick)
+        expired = []
+        if self.count == 0:
+            self.current = max(self.current, target)
+            return expired
+        while self.current < target:
+            self.current += 1
+            self.__cascade()
+            slot = self.__slots[0][self.current % self.wheel_size]
+            if slot:
+                self.__slots[0][self.current % self.wheel_size] = []
+                self.count -= len(slot)
+                expired.extend(t for t in slot if not t.cancelled)
+            if self.count == 0:
+                self.current = target
+        return expired
+
+    def __cascade(self):
+        """re-place the current slot of every level that wraps at this tick, top level first"""
+        wrapped = 0
+        for level in range(1, self.levels):
+            if self.current % self.__widths[level]:
+                break
+            wrapped = level
+        for level in range(wrapped, 0, -1):
+            idx = (self.current // self.__widths[level]) % self.wheel_size
+            slot = self.__slots[level][idx]
+            if slot:
+                self.__slots[level][idx] = []
+                for t in slot:
+                    if t.cancelled:
+                        self.count -= 1
+                    else:
+                        self.__place(t)
+
+
+class simulatedClock(object):
+    """clock driven by market data time when backtesting / replaying, see timerService.advance_to()"""
+
+    def __init__(self, start=0.0):
+        self.__now = start
+
+    def set(self, now):
+        self.__now = now
+
+    def __call__(self):
+        return self.__now
+
+
+class timerService(object):
+    """one-shot and periodic timers delivered as EVENT_TIMER through the event engine
+
+    - schedule(delay, func, period=None) -> Timer,  cancel(Timer)
+    - expired timers are put as Event(EVENT_TIMER, dict_={'timer': Timer, 'time': now}) and func(event)
+      is called by the EVENT_TIMER handler, ie. on the dispatcher thread like every other handler
+    - live: a driver thread advances the wheel every `tick` seconds with time.monotonic()
+    - backtest: pass a simulatedClock, no thread; call advance_to(t) with market data time
+    """
+
+    def __init__(self, event_engine, tick=0.01, wheel_size=256, levels=4, clock=None):
+        self.event_engine = event_engine
+        self.simulated = isinstance(clock, simulatedClock)
+        self.clock = clock if clock is not None else time.monotonic
+        self.wheel = timingWheel(tick, wheel_size, levels, start=self.clock())
+        self.__ids = itertools.count()
+        self.__lock = threading.Lock()
+        self.__type, self.__type_id = intern_event_type(EVENT_TIMER)
+        self.__run_thread = None
+        self.__active = False
+
+        self.event_engine.register(self.__type_id, self.__on_timer_event)
+
+    def start(self):
+        """start the driver thread (live clock only)"""
+        if self.simulated:
+            return
+        self.__active = True
+        self.__run_thread = threading.Thread(target=self.__run)
+        self.__run_thread.start()
+
+    def stop(self):
+        self.__active = False
+        if self.__run_thread is not None:
+            self.__run_thread.join()
+
+    def __run(self):
+        tick = self.wheel.tick
+        while self.__active:
+            time.sleep(tick)
+            self.__advance(self.clock())
+
+    def schedule(self, delay, func, period=None):
+        """call func(event) after `delay` seconds, then every `period` seconds if period is given"""
+        assert callable(func), 'arg func must be callable. func is %s' % func
+        assert period is None or period > 0, 'period must be None or > 0. period is %s' % period
+        timer = Timer(next(self.__ids), self.clock() + delay, period, func)
+        with self.__lock:
+            self.wheel.add(timer)
+        return timer
+
+    def cancel(self, timer):
+        """O(1): the timer is dropped when its slot comes up"""
+        timer.cancelled = True
+
+    def advance_to(self, now):
+        """simulated clock: set the clock to `now` and fire what expired"""
+        self.clock.set(now)
+        self.__advance(now)
+
+    def __advance(self, now):
+        with self.__lock:
+            expired = self.wheel.advance(now)
+            for timer in expired:
+                if timer.period is not None:
+                    timer.deadline += timer.period
+                    self.wheel.add(timer)
+        for timer in expired:
+            self.event_engine.put(Event(type_=self.__type, type_id=self.__type_id,
+                                        dict_={'timer': timer, 'time': now}))
+
+    def __on_timer_event(self, event):
+        timer = event.dict_['timer']
+        if not timer.cancelled:
+            timer.func(event)
@@ -0,0 +1,48 @@
+import collections
+import numpy as np
+
+
+BARS_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'vwap', 'timestamp')
+
+Bars = collections.namedtuple('Bars', BARS_COLUMNS)   # numpy views of the last n closed bars, oldest first
+
+
+class BarHistory(object):
+    """fixed-capacity ring buffer of closed bars, one numpy column per field
+
+    every row is written twice (at i and i + capacity), so the last n rows are always contiguous
+    and get(n) returns views instead of copies. timestamp is the bar start in epoch nanoseconds (Bar.start),
+    a missing field (eg. volume None) is stored as NaN.
+    A view is read-only and is overwritten after `capacity` more appends: copy() what is kept longer.
+    """
+
+    def __init__(self, capacity=1024):
+        assert capacity >= 1, 'capacity must be >= 1. capacity is %s' % capacity
+        self.capacity = capacity
+        self.count = 0    # bars appended so far
+        self.__columns = {k: np.full(2 * capacity, np.nan) for k in BARS_COLUMNS[:-1]}
+        self.__columns['timestamp'] = np.zeros(2 * capacity, dtype=np.int64)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, bar):
+        i = self.count % self.capacity
+        j = i + self.capacity
+        for k, column in self.__columns.items():
+            value = bar.start if k == 'timestamp' else getattr(bar, k)
+            if value is None:
+                value = 0 if k == 'timestamp' else np.nan
+            column[i] = column[j] = value
+        self.count += 1
+
+    def get(self, n):
+        """Bars of views on the last n bars (fewer if not that many closed yet)"""
+        n = min(n, len(self))
+        end = self.count % self.capacity + self.capacity
+        views = []
+        for k in BARS_COLUMNS:
+            view = self.__columns[k][end - n:end]
+            view.flags.writeable = False
+            views.append(view)
+        return Bars(*views)
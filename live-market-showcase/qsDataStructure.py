@@ -1,17 +1,57 @@
-import copy
+import collections
 
 
 class MarketData(object):
-    """market data class"""
+    """market data class
+
+    records are slotted (no per-instance __dict__), __slots__ lists the fields
+    timestamp: exchange time in epoch nanoseconds (bitmex.bitmexTimestamp.iso_to_epoch_ns),
+    receive_time: qsUtils.now_ns() when the websocket frame was received
+    """
+
+    __slots__ = ()
 
     def __repr__(self):
-        return self.__dict__.__repr__()
+        return {k: getattr(self, k) for k in self.__slots__}.__repr__()
 
     def copy(self):
-        return copy.deepcopy(self)
+        """shallow copy, fields are immutable (numbers, strings)"""
+        new = object.__new__(self.__class__)
+        for k in self.__slots__:
+            setattr(new, k, getattr(self, k))
+        return new
+
+
+class MarketDataPool(object):
+    """free list recycling short-lived MarketData records (Tick, Orderbook) instead of allocating
+
+    acquire() re-runs __init__ on a released record; it may be called on one thread (websocket)
+    and release() on another (DataHandler): deque append/pop are atomic.
+    A released record may be overwritten at any time, keep a copy() of it if needed.
+    """
+
+    def __init__(self, cls, maxsize=4096):
+        self.cls = cls
+        self.maxsize = maxsize
+        self.__free = collections.deque()
+
+    def acquire(self, *args, **kwargs):
+        try:
+            obj = self.__free.pop()
+        except IndexError:
+            return self.cls(*args, **kwargs)
+        obj.__init__(*args, **kwargs)
+        return obj
+
+    def release(self, obj):
+        if len(self.__free) < self.maxsize:
+            self.__free.append(obj)
 
 
 class Orderbook(MarketData):
+
+    __slots__ = ('symbol', 'bid1', 'bid1vol', 'ask1', 'ask1vol', 'timestamp', 'receive_time')
+
     def __init__(self, symbol=None, bid1=None, bid1vol=None, ask1=None, ask1vol=None, timestamp=None, receive_time=None):
         self.symbol = symbol
         self.bid1 = bid1
@@ -23,6 +63,9 @@ class Orderbook(MarketData):
 
 
 class Tick(MarketData):
+
+    __slots__ = ('symbol', 'price', 'volume', 'direction', 'timestamp', 'receive_time')
+
     def __init__(self, symbol=None, price=None, volume=None, direction=None, timestamp=None, receive_time=None):
         self.symbol = symbol
         self.price = price
@@ -32,24 +75,114 @@ class Tick(MarketData):
         self.receive_time = receive_time
 
 
+class TickBatch(MarketData):
+    """the trades of one symbol in one websocket frame, one list per field (columnar)"""
+
+    __slots__ = ('symbol', 'price', 'volume', 'direction', 'timestamp', 'receive_time')
+
+    def __init__(self, symbol=None, price=None, volume=None, direction=None, timestamp=None, receive_time=None):
+        self.symbol = symbol
+        self.price = [] if price is None else price
+        self.volume = [] if volume is None else volume
+        self.direction = [] if direction is None else direction
+        self.timestamp = [] if timestamp is None else timestamp
+        self.receive_time = receive_time   # of the frame
+
+    def __len__(self):
+        return len(self.price)
+
+    def append(self, price, volume, direction, timestamp):
+        self.price.append(price)
+        self.volume.append(volume)
+        self.direction.append(direction)
+        self.timestamp.append(timestamp)
+
+
+class DepthUpdate(MarketData):
+    """rows of one symbol in one orderBookL2 / orderBookL2_25 frame, applied by bitmexOrderBookL2.apply()"""
+
+    __slots__ = ('symbol', 'action', 'rows', 'receive_time')
+
+    def __init__(self, symbol=None, action=None, rows=None, receive_time=None):
+        self.symbol = symbol
+        self.action = action   # 'partial' / 'insert' / 'update' / 'delete'
+        self.rows = [] if rows is None else rows
+        self.receive_time = receive_time
+
+
+class FeedGap(MarketData):
+    """the feed of symbol was down from start (last frame received) to end (reconnected, None while down)
+
+    market data in between is lost; books are resynced from the partial sent after resubscription
+    """
+
+    __slots__ = ('symbol', 'start', 'end', 'receive_time')
+
+    def __init__(self, symbol=None, start=None, end=None, receive_time=None):
+        self.symbol = symbol
+        self.start = start   # epoch ns
+        self.end = end       # epoch ns
+        self.receive_time = receive_time
+
+
 class Bar(MarketData):
-    def __init__(self, symbol=None, bar_type=None, td=None, ts=None, open=None, high=None, low=None, close=None, timestamp=None, receive_time=None):
+
+    __slots__ = ('symbol', 'bar_type', 'td', 'ts', 'open', 'high', 'low', 'close',
+                 'volume', 'amount', 'vwap', 'ticks', 'buy_volume', 'sell_volume', 'timestamp', 'receive_time', 'start')
+
+    def __init__(self, symbol=None, bar_type=None, td=None, ts=None, open=None, high=None, low=None, close=None, timestamp=None, receive_time=None, start=None,
+                 volume=None, amount=None, ticks=None, buy_volume=None, sell_volume=None):
         self.symbol = symbol
         self.bar_type = bar_type
         self.td = td
         self.ts = ts
+        self.start = start   # bar start, epoch nanoseconds (see bitmex.utils.bucket_start)
         self.open = open
         self.high = high
         self.low = low
         self.close = close
-        self.volume = None   # TODO: vol, amt, vwap, ticks
-        self.amount = None
-        self.vwap = None
-        self.ticks = None
-        self.timestamp = timestamp         # timestamp of last_price which close the bar, ie. new bar's open tick
+        self.volume = volume             # sum of tick volume
+        self.amount = amount             # sum of tick price * volume
+        self.vwap = None                 # amount / volume, set when the bar closes
+        self.ticks = ticks               # number of ticks
+        self.buy_volume = buy_volume     # volume of ticks with direction 'Buy'
+        self.sell_volume = sell_volume   # volume of ticks with direction 'Sell'
+        self.timestamp = timestamp         # timestamp (epoch ns) of the bar's open tick, of its close for a warm-up bar
         self.receive_time = receive_time   # receive_time of last_price which close the bar, ie. new bar's open tick
 
 
+class OpenInterest(MarketData):
+    """open interest of a symbol, from the 'instrument' topic"""
+
+    __slots__ = ('symbol', 'open_interest', 'timestamp', 'receive_time')
+
+    def __init__(self, symbol=None, open_interest=None, timestamp=None, receive_time=None):
+        self.symbol = symbol
+        self.open_interest = open_interest
+        self.timestamp = timestamp
+        self.receive_time = receive_time
+
+
 class Snapshot(MarketData):
-    pass
+    """fixed-interval slice of a symbol (refer to domestic futures snapshot): latest trade, L1 quote,
+    cumulative volume / amount since start and open interest
+    """
+
+    __slots__ = ('symbol', 'last_price', 'last_volume', 'bid1', 'bid1vol', 'ask1', 'ask1vol',
+                 'volume', 'amount', 'open_interest', 'timestamp', 'receive_time')
+
+    def __init__(self, symbol=None, last_price=None, last_volume=None, bid1=None, bid1vol=None, ask1=None, ask1vol=None,
+                 volume=None, amount=None, open_interest=None, timestamp=None, receive_time=None):
+        self.symbol = symbol
+        self.last_price = last_price
+        self.last_volume = last_volume
+        self.bid1 = bid1
+        self.bid1vol = bid1vol
+        self.ask1 = ask1
+        self.ask1vol = ask1vol
+        self.volume = volume                 # cumulative trade volume
+        self.amount = amount                 # cumulative trade price * volume
+        self.open_interest = open_interest
+        self.timestamp = timestamp           # latest exchange timestamp of trade / quote in the slice
+        self.receive_time = receive_time     # time the slice was taken
 
@@ -13,6 +13,9 @@ class QsObject(object):
     def add_data_handler(self, data_handler):
         self.data_handler = data_handler
 
+    def add_timer_service(self, timer_service):
+        self.timer_service = timer_service
+
 
 class DataHandler(QsObject):
     """
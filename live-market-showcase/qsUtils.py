@@ -1,5 +1,6 @@
 import logging
 import datetime
+import time
 
 
 def generate_logger(loggername='defaultLogger', loglevel='debug', logfile=None):
@@ -39,3 +40,11 @@ def generate_logger(loggername='defaultLogger', loglevel='debug', logfile=None):
 
 def now():
     return datetime.datetime.now().__format__('%Y-%m-%d %H:%M:%S.%f')
+
+
+_EPOCH_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+
+
+def now_ns():
+    """receive time: monotonic clock in epoch nanoseconds, never steps back (NTP), comparable with exchange timestamps"""
+    return _EPOCH_OFFSET_NS + time.monotonic_ns()
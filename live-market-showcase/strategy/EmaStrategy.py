@@ -20,6 +20,8 @@ class EmaStrategy(CtaStrategy):
 
     ema_fast > ema_slow, LONG
     ema_fast < ema_slow, SHORT
+
+    both EMAs are shared indicators (ctaIndicator), updated on bar close before on_bar_close()
     """
 
     def __init__(self, config):
@@ -28,6 +30,9 @@ class EmaStrategy(CtaStrategy):
 
         self.event_engine = None
         self.data_handler = None
+        self.indicators = None
+        self.ema_fast = None   # EMA of IndicatorRegistry
+        self.ema_slow = None
 
     def add_evnet_engine(self, event_engine):
         self.event_engine = event_engine
@@ -35,8 +40,24 @@ class EmaStrategy(CtaStrategy):
     def add_data_handler(self, data_handler):
         self.data_handler = data_handler
 
+    def add_indicator_registry(self, indicators):
+        self.indicators = indicators
+        self.ema_fast = indicators.get(self.symbol, self.bar_type, 'ema', self.para['fast'])
+        self.ema_slow = indicators.get(self.symbol, self.bar_type, 'ema', self.para['slow'])
+
+    def on_warmup(self):
+        """EMAs were fed the warm-up bars"""
+        if self.ema_fast.value is None:
+            return
+        self.context.ema_fast = self.ema_fast.value
+        self.context.ema_slow = self.ema_slow.value
+        self.__gen_target_positon()
+        print('Warmed up on %d bars, ema_fast=%s, ema_slow=%s' % (self.ema_fast.count, self.ema_fast.value, self.ema_slow.value))
+
     def on_init(self):
         print('Calling on_init() ...........')
+        if self.context.ema_fast is not None:   # warmed up by on_warmup()
+            return
         self.__waiting_for_first_tick()   # todo. this is temp solution
 
         tick = self.__get_current_tick()
@@ -64,15 +85,17 @@ class EmaStrategy(CtaStrategy):
             return
 
         assert isinstance(prev_bar, Bar), 'class is %s' % prev_bar.__class__
-        new_price = prev_bar.close
-        alpha_fast = 2 / (self.para['fast'] + 1)
-        alpha_slow = 2 / (self.para['slow'] + 1)
-        self.context.ema_fast = alpha_fast * new_price + (1 - alpha_fast) * self.context.ema_fast
-        self.context.ema_slow = alpha_slow * new_price + (1 - alpha_slow) * self.context.ema_slow
+        self.__update_context()
 
         self.__gen_target_positon()
         self.__push_signal_event()
 
+    def __update_context(self):
+        """EMAs from the shared indicators, the first tick seed of on_init() until they got a closed bar"""
+        if self.ema_fast.value is not None:
+            self.context.ema_fast = self.ema_fast.value
+            self.context.ema_slow = self.ema_slow.value
+
     def __gen_target_positon(self):
         if self.context.ema_fast > self.context.ema_slow:
             self.context.target_position = 1
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from bitmex.bitmexAsyncWS import bitmexAsyncWS
+
+
+def run_with_server(welcome, coro):
+    async def handler(ws, *args):
+        if welcome:
+            await ws.send('{"info": "Welcome to the BitMEX Realtime API."}')
+        await ws.wait_closed()
+
+    async def main():
+        server = await websockets.serve(handler, 'localhost', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await coro('ws://localhost:%d' % port)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(main())
+
+
+def test_connect_with_auth_headers():
+    async def connect(url):
+        ws = bitmexAsyncWS(apiKey='key', apiSecret='secret', loglevel='warning')
+        ws.ws_url = url
+        await ws.connect(timeout=2)
+        connected = ws.connected
+        await ws.exit()
+        return connected
+
+    assert run_with_server(True, connect)
+
+
+def test_connect_times_out_without_welcome():
+    async def connect(url):
+        ws = bitmexAsyncWS(loglevel='warning')
+        ws.ws_url = url
+        with pytest.raises(asyncio.TimeoutError):
+            await ws.connect(timeout=0.2)
+
+    run_with_server(False, connect)
+
+
+class Recorder(bitmexAsyncWS):
+
+    def __init__(self):
+        super().__init__(loglevel='critical')
+        self.tables = []
+        self.gaps = []
+
+    def onData(self, msg):
+        if msg['table'] == 'bad':
+            raise KeyError('data')
+        self.tables.append(msg['table'])
+
+    def on_disconnect(self, gap_start):
+        self.gaps.append(('down', gap_start))
+
+    def on_reconnect(self, gap_start, gap_end):
+        self.gaps.append(('up', gap_start, gap_end))
+
+
+def test_bad_frame_skipped_and_closed_socket_reconnected():
+    received = []
+    connections = []
+
+    async def handler(ws, *args):
+        connections.append(ws)
+        await ws.send('{"info": "Welcome to the BitMEX Realtime API."}')
+        if len(connections) == 1:
+            await ws.send('{"table": "bad"}')
+            await ws.send('{"table": "trade"}')
+            received.append(await ws.recv())   # the subscription
+            await ws.close()
+            return
+        received.append(await ws.recv())       # replayed on reconnect
+        await ws.send('{"table": "quote"}')
+        await ws.wait_closed()
+
+    async def main():
+        server = await websockets.serve(handler, 'localhost', 0)
+        ws = Recorder()
+        ws.set_reconnect(backoff_min=0.01, backoff_max=0.02)
+        ws.ws_url = 'ws://localhost:%d' % server.sockets[0].getsockname()[1]
+        try:
+            await ws.connect(timeout=2)
+            await ws.subscribe_topic('trade:XBTUSD')
+            for _ in range(200):
+                if 'quote' in ws.tables:
+                    break
+                await asyncio.sleep(0.01)
+            await ws.exit()
+        finally:
+            server.close()
+            await server.wait_closed()
+        return ws
+
+    ws = asyncio.run(main())
+    assert ws.tables == ['trade', 'quote'] and ws.reconnects == 1 and len(connections) == 2
+    assert received == ['{"op": "subscribe", "args": ["trade:XBTUSD"]}'] * 2
+    assert [g[0] for g in ws.gaps] == ['down', 'up'] and ws.gaps[1][1] == ws.gaps[0][1] < ws.gaps[1][2]
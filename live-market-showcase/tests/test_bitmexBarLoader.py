@@ -0,0 +1,106 @@
+import pytest
+import requests
+
+from bitmex.bitmexBarLoader import bitmexBarLoader, sources_of
+from bitmex.bitmexREST import bitmexREST
+from bitmex.utils import NS_PER_SECOND, epoch_ns_to_iso
+
+
+T0 = 1546870800 * NS_PER_SECOND   # 2019-01-07T14:20:00Z
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.ok = status_code == 200
+        self.data = data
+        self.content = b'error'
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+
+class FakeREST(bitmexREST):
+    """trades every 2.5s from T0 - 10 min; responses popped from `failures` first"""
+
+    def __init__(self, failures=(), max_retries=5):
+        super().__init__(apiKey=None, apiSecret=None, loglevel='warning')
+        self.set_retry(max_retries=max_retries, backoff=0)
+        self.failures = list(failures)
+        self.calls = []
+
+    def _send_http_request(self, verb, path, postdict=None, query=None, timeout=None):
+        assert timeout == self.timeout
+        self.calls.append((path, dict(postdict)))
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        if path == 'trade/bucketed':
+            bins = [{'timestamp': epoch_ns_to_iso(T0 - (9 - i) * 60 * NS_PER_SECOND), 'symbol': 'XBTUSD',
+                     'open': 100.0, 'high': 101.0 + i, 'low': 99.0, 'close': 100.5, 'volume': 10, 'vwap': 100.0,
+                     'trades': 3} for i in range(10)]
+            start = postdict['start']
+            return FakeResponse(200, bins[start:start + postdict['count']])
+        assert path == 'trade'
+        trades = [{'timestamp': epoch_ns_to_iso(T0 - 600 * NS_PER_SECOND + i * 2500000000), 'symbol': 'XBTUSD',
+                   'side': 'Buy' if i % 2 else 'Sell', 'size': 1, 'price': 100.0 + i} for i in range(240)]
+        start = postdict['start']
+        return FakeResponse(200, trades[start:start + postdict['count']])
+
+
+def loader(rest):
+    return bitmexBarLoader(rest, loglevel='warning')
+
+
+def test_sources_of():
+    assert sources_of(['15s', '30s', '1m', '7m', '2h']) == {'15s': '15s', '30s': '15s', '1m': '1m', '7m': '1m',
+                                                          '2h': '1h'}
+    assert sources_of(['15s', '20s', '90s']) == {'15s': '5s', '20s': '5s', '90s': '5s'}
+
+
+def test_trades_fetched_once_for_every_sub_minute_bar_type():
+    rest = FakeREST()
+    bars = loader(rest).load({('XBTUSD', '15s'): 8, ('XBTUSD', '30s'): 4, ('XBTUSD', '20s'): 3}, end=T0)
+    assert {path for path, _ in rest.calls} == {'trade'}
+    assert len(rest.calls) == 1
+    b15, b30, b20 = bars[('XBTUSD', '15s')], bars[('XBTUSD', '30s')], bars[('XBTUSD', '20s')]
+    assert len(b15) == 8 and len(b30) == 4 and len(b20) == 3
+    assert b15[-1].timestamp == T0 and b30[-1].timestamp == T0 and b20[-1].timestamp == T0
+    assert [b.ticks for b in b15] == [6] * 8
+    assert [b.volume for b in b30] == [b15[2 * i].volume + b15[2 * i + 1].volume for i in range(4)]
+    assert [b.high for b in b30] == [b15[2 * i + 1].high for i in range(4)]
+
+
+def test_retry_then_succeed():
+    rest = FakeREST(failures=[FakeResponse(429, headers={'Retry-After': '0'}), FakeResponse(503),
+                              requests.ConnectionError('down')])
+    bars = loader(rest).load({('XBTUSD', '15s'): 2}, end=T0)
+    assert len(bars[('XBTUSD', '15s')]) == 2
+    assert len(rest.calls) == 4
+
+
+def test_retries_are_bounded():
+    rest = FakeREST(failures=[FakeResponse(429)] * 100, max_retries=3)
+    with pytest.raises(IOError):
+        loader(rest).load({('XBTUSD', '15s'): 2}, end=T0)
+    assert len(rest.calls) == 4
+
+
+def test_bad_request_is_not_retried():
+    rest = FakeREST(failures=[FakeResponse(400)])
+    with pytest.raises(IOError):
+        loader(rest).load({('XBTUSD', '15s'): 2}, end=T0)
+    assert len(rest.calls) == 1
+
+
+def test_minute_bars_from_trade_bucketed():
+    rest = FakeREST()
+    bars = loader(rest).load({('XBTUSD', '2m'): 3}, end=T0)[('XBTUSD', '2m')]
+    (path, params), = rest.calls
+    assert path == 'trade/bucketed' and params['binSize'] == '1m' and params['partial'] == 'false'
+    assert [b.timestamp for b in bars] == [T0 - 4 * 60 * NS_PER_SECOND, T0 - 2 * 60 * NS_PER_SECOND, T0]
+    assert [b.high for b in bars] == [106.0, 108.0, 110.0] and [b.volume for b in bars] == [20] * 3
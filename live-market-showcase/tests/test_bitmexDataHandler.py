@@ -0,0 +1,201 @@
+import random
+import threading
+import time
+
+import pytest
+import requests
+
+from bitmex.bitmexREST import bitmexREST
+from bitmexDataHandler import bitmexDataHandler
+from event.eventType import EVENT_BAR_CLOSE
+from event.eventTypeRegistry import registry
+from qsDataStructure import DepthUpdate, Tick, TickBatch
+
+
+class G(object):
+    loglevel = 'warning'
+    logfile = None
+    websocket = {}
+
+
+class AccountSettings(object):
+    isTestNet = True
+
+
+class EventEngine(object):
+
+    def __init__(self):
+        self.events = []
+
+    def put(self, event):
+        self.events.append((threading.current_thread(), event))
+
+
+def make(bar_types, symbols=('XBTUSD',)):
+    dh = bitmexDataHandler(G(), AccountSettings())
+    dh.set_symbols(list(symbols))
+    ee = EventEngine()
+    dh.add_event_engine(ee)
+    for symbol in symbols:
+        for bar_type in bar_types:
+            dh.register_bar_event(symbol, bar_type)
+    return dh, ee
+
+
+def test_warmup_fails_soft(monkeypatch):
+    def down(self, *args, **kwargs):
+        raise requests.ConnectionError('down')
+
+    monkeypatch.setattr(bitmexREST, '_send_http_request', down)
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    dh, ee = make(['15s', '1m'])
+    assert dh.get_init_data(10) == {}
+    assert len(dh.get_prev_bars('XBTUSD', '1m', 10).close) == 0
+
+
+class FakeMarket(object):
+
+    def __init__(self):
+        self.resubscribed = []
+
+    def resubscribe_topic(self, topic):
+        self.resubscribed.append(topic)
+
+
+def test_l2_book_out_of_sync_resubscribes():
+    dh, ee = make([])
+    dh.use_depth('orderBookL2_25')
+    dh.bm_ws_market = FakeMarket()
+    rows = [{'symbol': 'ETHUSD', 'id': 1, 'side': 'Buy', 'size': 1, 'price': 100.0}]
+    dh.processDepth(DepthUpdate(symbol='ETHUSD', action='partial', rows=rows))
+    assert dh.get_depth('ETHUSD').ready
+    dh.processDepth(DepthUpdate(symbol='ETHUSD', action='update', rows=[{'symbol': 'ETHUSD', 'id': 2, 'side': 'Buy',
+                                                                            'size': 5}]))
+    assert not dh.get_depth('ETHUSD').ready
+    assert dh.bm_ws_market.resubscribed == ['orderBookL2_25:ETHUSD']
+
+
+def test_snapshot_taken_on_the_data_handler_thread():
+    dh, ee = make([])
+    dh.use_snapshot(0.05)
+    dh.register_snapshot_event('XBTUSD')
+    dh.active = True
+    run = threading.Thread(target=dh._bitmexDataHandler__run)
+    run.start()
+    for i in range(20):
+        dh.market_data_q.put(Tick(symbol='XBTUSD', price=4000.0 + i, volume=1, direction='Buy',
+                                  timestamp=i * 10 ** 7, receive_time=i))
+        time.sleep(0.01)
+    time.sleep(0.2)   # idle: slices keep coming without records
+    dh.active = False
+    run.join()
+    snapshots = [(thread, event) for thread, event in ee.events if 'snapshot' in event.dict_]
+    assert len(snapshots) >= 5 and all(thread is run for thread, _ in snapshots)
+    assert dh.get_snapshot('XBTUSD').last_price == 4019.0
+
+
+FIELDS = ('start', 'open', 'high', 'low', 'close', 'volume', 'amount', 'ticks', 'buy_volume', 'sell_volume')
+
+
+def random_ticks(n, seed, symbol='XBTUSD'):
+    """ticks 0-3s apart with quiet gaps of up to 5 minutes; half-dollar prices keep the sums exact"""
+    rng = random.Random(seed)
+    t = 1538265780000000000 + rng.randrange(60 * 10 ** 9)
+    ticks = []
+    for _ in range(n):
+        t += rng.randrange(3 * 10 ** 9) if rng.random() > 0.002 else rng.randrange(300 * 10 ** 9)
+        ticks.append(Tick(symbol, 6000.0 + rng.randrange(-40, 40) / 2, rng.randrange(1, 100),
+                          rng.choice(('Buy', 'Sell', 'Buy', None)), t))
+    return ticks
+
+
+def closed_bars(ee, symbol, bar_type):
+    type_id = registry.intern(EVENT_BAR_CLOSE, symbol, bar_type)
+    return [tuple(event.dict_[f] for f in FIELDS)
+            for _, event in ee.events if event.type_id == type_id]
+
+
+def bucketed(ticks, width):
+    """closed bars of `width` ns straight from the ticks, the bar of the last tick is still open"""
+    bars = []
+    for tick in ticks:
+        start = tick.timestamp - tick.timestamp % width
+        if not bars or bars[-1]['start'] != start:
+            bars.append({'start': start, 'open': tick.price, 'high': tick.price, 'low': tick.price, 'volume': 0,
+                         'amount': 0, 'ticks': 0, 'buy_volume': 0, 'sell_volume': 0})
+        bar = bars[-1]
+        bar['high'] = max(bar['high'], tick.price)
+        bar['low'] = min(bar['low'], tick.price)
+        bar['close'] = tick.price
+        bar['volume'] += tick.volume
+        bar['amount'] += tick.price * tick.volume
+        bar['ticks'] += 1
+        bar['buy_volume'] += tick.volume if tick.direction == 'Buy' else 0
+        bar['sell_volume'] += tick.volume if tick.direction == 'Sell' else 0
+    return [tuple(bar[f] for f in FIELDS) for bar in bars[:-1]]
+
+
+def test_cascaded_bars_equal_bars_bucketed_from_ticks():
+    bar_types = ['1m', '15s', '30s', '45s', '5m', '1h', '7s']   # 45s from 15s, 5m from 1m, 7s from ticks
+    dh, ee = make(bar_types)
+    assert dh.bar_source['XBTUSD'] == {'7s': None, '15s': None, '30s': '15s', '45s': '15s', '1m': '30s',
+                                       '5m': '1m', '1h': '5m'}
+    ticks = random_ticks(20000, seed=12)
+    for tick in ticks:
+        dh.processTick(tick)
+    for bar_type in bar_types:
+        expected = bucketed(ticks, dh.bar_width[bar_type])
+        assert len(expected) > 2
+        assert closed_bars(ee, 'XBTUSD', bar_type) == expected, bar_type
+
+
+def threshold_bucketed(ticks, kind, threshold):
+    """closed threshold bars straight from the ticks: a bar closes on the tick reaching threshold"""
+    bars = []
+    bar = None
+    for tick in ticks:
+        sign = 1 if tick.direction == 'Buy' else -1 if tick.direction == 'Sell' else 0
+        if bar is None:
+            bar = {'start': tick.timestamp, 'open': tick.price, 'high': tick.price, 'low': tick.price, 'volume': 0,
+                   'amount': 0, 'ticks': 0, 'buy_volume': 0, 'sell_volume': 0, 'imb': 0}
+        bar['high'] = max(bar['high'], tick.price)
+        bar['low'] = min(bar['low'], tick.price)
+        bar['close'] = tick.price
+        bar['volume'] += tick.volume
+        bar['amount'] += tick.price * tick.volume
+        bar['ticks'] += 1
+        bar['buy_volume'] += tick.volume if sign == 1 else 0
+        bar['sell_volume'] += tick.volume if sign == -1 else 0
+        bar['imb'] += sign
+        if {'tick': bar['ticks'], 'vol': bar['volume'], 'notional': bar['amount'], 'imb': abs(bar['imb'])}[kind] \
+                >= threshold:
+            bars.append(tuple(bar[f] for f in FIELDS))
+            bar = None
+    return bars
+
+
+def feed(dh, ticks, batch):
+    """one processTick() per tick, or processTickBatch() over frames of `batch` trades"""
+    if not batch:
+        for tick in ticks:
+            dh.processTick(tick)
+        return
+    for i in range(0, len(ticks), batch):
+        frame = TickBatch(ticks[i].symbol)
+        for tick in ticks[i:i + batch]:
+            frame.append(tick.price, tick.volume, tick.direction, tick.timestamp)
+        dh.processTickBatch(frame)
+
+
+@pytest.mark.parametrize('batch', [0, 37])
+def test_threshold_bars_equal_bars_cut_from_ticks(batch):
+    bar_types = {'250tick': ('tick', 250), '3vol': ('vol', 3), '2000vol': ('vol', 2000),
+                 '5000000notional': ('notional', 5000000), '20imb': ('imb', 20), '1tick': ('tick', 1)}
+    dh, ee = make(['1m'] + list(bar_types))
+    ticks = random_ticks(20000, seed=19)
+    feed(dh, ticks, batch)
+    for bar_type, (kind, threshold) in bar_types.items():
+        expected = threshold_bucketed(ticks, kind, threshold)
+        assert len(expected) > 2
+        assert closed_bars(ee, 'XBTUSD', bar_type) == expected, bar_type   # start: timestamp of the open tick
+    assert closed_bars(ee, 'XBTUSD', '1m') == bucketed(ticks, dh.bar_width['1m'])   # untouched by threshold bars
@@ -0,0 +1,103 @@
+import random
+
+from bitmex.bitmexOrderBookL2 import bitmexOrderBookL2, bookSide, fenwickTree, l2_id_to_price
+
+
+def row(id_, side, size=None, price=None):
+    r = {'symbol': 'XBTUSD', 'id': id_, 'side': side}
+    if size is not None:
+        r['size'] = size
+    if price is not None:
+        r['price'] = price
+    return r
+
+
+def xbt_id(price):
+    return int(round(100000000 * 88 - price / 0.01))
+
+
+def partial_book(symbol='XBTUSD'):
+    book = bitmexOrderBookL2(symbol)
+    book.apply('partial', [row(1, 'Sell', 30, 4001.5), row(2, 'Sell', 20, 4001.0), row(3, 'Sell', 10, 4000.5),
+                           row(4, 'Buy', 5, 4000.0), row(5, 'Buy', 15, 3999.5), row(6, 'Buy', 25, 3999.0)])
+    return book
+
+
+def test_fenwick_prefix():
+    tree = fenwickTree(bits=10)
+    values = [0] * 1025
+    rnd = random.Random(1)
+    for _ in range(500):
+        i, delta = rnd.randint(1, 1024), rnd.randint(-5, 5)
+        tree.add(i, delta)
+        values[i] += delta
+        j = rnd.randint(0, 1024)
+        assert tree.prefix(j) == sum(values[1:j + 1])
+
+
+def test_levels_and_cumulative_depth():
+    book = partial_book()
+    assert book.best_bid() == (4000.0, 5) and book.best_ask() == (4000.5, 10)
+    assert book.levels(2) == ([(4000.0, 5), (3999.5, 15)], [(4000.5, 10), (4001.0, 20)])
+    assert book.cumulative_depth('Buy', n=2) == 20
+    assert book.cumulative_depth('Sell', n=10) == 60
+    assert book.cumulative_depth('Sell', n=0) == 0
+    assert book.cumulative_depth('Buy', price=3999.5) == 20
+    assert book.cumulative_depth('Buy', price=3999.7) == 5
+    assert book.cumulative_depth('Buy', price=4000.5) == 0
+    assert book.cumulative_depth('Sell', price=4001.0) == 30
+    book.apply('update', [row(2, 'Sell', 50)])
+    book.apply('delete', [row(4, 'Buy')])
+    book.apply('insert', [row(7, 'Buy', 7, 4000.0)])
+    assert book.cumulative_depth('Sell', n=2) == 60
+    assert book.cumulative_depth('Buy', n=2) == 22
+    assert book.cumulative_depth('Buy') == 47
+
+
+def test_cumulative_matches_brute_force():
+    rnd = random.Random(7)
+    for descending in (True, False):
+        side = bookSide(descending=descending, tick=0.5)
+        levels = {}
+        for step in range(3000):
+            price = 3000 + rnd.randint(0, 400) * 0.5
+            if rnd.random() < 0.3 and levels:
+                price = rnd.choice(list(levels))
+                side.remove(price)
+                del levels[price]
+            else:
+                size = rnd.randint(1, 1000)
+                side.set(price, size)
+                levels[price] = size
+            if step % 50 == 0:
+                ordered = sorted(levels, reverse=descending)
+                n = rnd.randint(0, len(ordered) + 2)
+                assert side.cumulative(n) == sum(levels[p] for p in ordered[:n])
+                to = 3000 + rnd.randint(-2, 402) * 0.5
+                better = [p for p in ordered if (p >= to if descending else p <= to)]
+                assert side.cumulative_to(to) == sum(levels[p] for p in better)
+        assert side.cumulative() == sum(levels.values())
+
+
+def test_unknown_id_resets_book_until_next_partial():
+    book = partial_book('ETHUSD')   # no id scheme for ETHUSD
+    book.apply('update', [row(99, 'Buy', 1)])
+    assert not book.ready and book.out_of_sync == 1
+    assert book.best_bid() is None
+    book.apply('insert', [row(8, 'Buy', 1, 100.0)])
+    assert book.best_bid() is None   # dropped until the partial
+    book.apply('partial', [row(8, 'Buy', 1, 100.0)])
+    assert book.ready and book.best_bid() == (100.0, 1)
+
+
+def test_unknown_id_with_id_scheme():
+    book = partial_book()
+    book.apply('update', [row(xbt_id(3998.0), 'Buy', 9)])
+    assert book.ready and book.depth_at('Buy', l2_id_to_price('XBTUSD', xbt_id(3998.0))) == 9
+
+
+def test_zero_price_is_a_price():
+    book = bitmexOrderBookL2('ETHUSD')
+    book.apply('partial', [row(1, 'Sell', 10, 1.0)])
+    book.apply('update', [row(2, 'Buy', 3, 0.0)])
+    assert book.ready and book.best_bid() == (0.0, 3)
@@ -0,0 +1,114 @@
+import gzip
+import json
+import queue
+
+import pytest
+
+from bitmex.bitmexTape import bitmexTapeRecorder, bitmexTapeReplayer, read_tape
+from bitmex.utils import epoch_ns_to_iso
+from bitmexDataHandler import bitmexDataHandler
+from event.eventEngine import eventEngine
+from event.eventType import EVENT_BAR_CLOSE
+from event.eventTypeRegistry import registry
+from qsDataStructure import Tick
+
+
+def trade_frame(i):
+    return json.dumps({'table': 'trade', 'action': 'insert', 'data': [
+        {'timestamp': '2019-01-07T14:19:%02d.000Z' % i, 'symbol': 'XBTUSD', 'side': 'Buy', 'size': i + 1,
+         'price': 4000.0 + i, 'trdMatchID': 'id-%d' % i}]})
+
+
+def test_close_without_open(tmp_path):
+    rec = bitmexTapeRecorder(str(tmp_path / 'tape'), loglevel='warning')
+    rec.close()
+    rec.close()
+
+
+def test_record_rotate_read_replay(tmp_path):
+    directory = str(tmp_path / 'tape')
+    rec = bitmexTapeRecorder(directory, rotate_bytes=500, flush_interval=0.01, loglevel='warning')
+    rec.open()
+    frames = [trade_frame(i) for i in range(30)]
+    for i, frame in enumerate(frames):
+        rec.record(1000 + i, frame)
+    rec.record(2000, json.dumps([0, 'bitmexWSMarket-1', 'bitmexWSMarket-1', json.loads(trade_frame(40))]))
+    rec.record(2001, json.dumps({'info': 'Welcome to the BitMEX Realtime API.'}))
+    rec.close()
+    rec.close()
+    assert len(rec.files) > 1 and rec.recorded == 32 and rec.dropped == 0
+
+    rows = list(read_tape(directory))
+    assert [m for _, m in rows[:30]] == frames
+    assert [t for t, _ in rows] == list(range(1000, 1030)) + [2000, 2001]
+
+    q = queue.Queue()
+    assert bitmexTapeReplayer(directory).replay(market_data_q=q) == 31
+    ticks = [q.get_nowait() for _ in range(31)]
+    assert all(isinstance(t, Tick) for t in ticks)
+    assert [t.receive_time for t in ticks] == list(range(1000, 1030)) + [2000]
+    assert q.empty()
+
+
+def test_record_never_blocks_past_maxsize(tmp_path):
+    rec = bitmexTapeRecorder(str(tmp_path / 'tape'), maxsize=10, loglevel='warning')
+    for i in range(25):
+        rec.record(i, 'x')
+    assert rec.dropped == 15
+
+
+def test_read_tape_stops_at_truncated_tail(tmp_path):
+    lines = ''.join('%d\t{"table":"trade","n":%d,"pad":"%s"}\n' % (i, i, 'x' * (i % 97)) for i in range(5000))
+    data = gzip.compress(lines.encode())
+    path = tmp_path / 'cut.tape.gz'
+    path.write_bytes(data[:len(data) // 2])
+    rows = list(read_tape(str(path)))
+    assert 0 < len(rows) < 5000
+    assert [t for t, _ in rows] == list(range(len(rows)))
+    assert rows[-1][1].endswith('"}')
+
+
+class G(object):
+    loglevel = 'warning'
+    logfile = None
+    websocket = {}
+
+
+class AccountSettings(object):
+    isTestNet = True
+
+
+def replay_bar_closes(directory, tick_batch):
+    engine = eventEngine(batch_size=256)
+    engine.unregister_general_handler(engine._eventEngine__print_event)
+    dh = bitmexDataHandler(G(), AccountSettings())
+    dh.set_symbols(['XBTUSD'])
+    dh.add_event_engine(engine)
+    dh.register_bar_event('XBTUSD', '15s')
+    seen = []
+
+    def on_bar_close(event):
+        bar = dh.get_prev_bar('XBTUSD', '15s')
+        seen.append((event.dict_['volume'], bar.volume, bar.start))
+
+    engine.register(registry.intern(EVENT_BAR_CLOSE, 'XBTUSD', '15s'), on_bar_close)
+    bitmexTapeReplayer(directory).replay(data_handler=dh, event_engine=engine, tick_batch=tick_batch)
+    return seen
+
+
+@pytest.mark.parametrize('tick_batch', [False, True])
+def test_replay_dispatches_each_frame_before_the_next(tmp_path, tick_batch):
+    directory = str(tmp_path / 'tape')
+    rec = bitmexTapeRecorder(directory, flush_interval=0.01, loglevel='warning')
+    rec.open()
+    t0 = 1546870761000000000
+    for i in range(2000):
+        trades = [{'timestamp': epoch_ns_to_iso(t0 + (3 * i + k) * 10 ** 9 // 3), 'symbol': 'XBTUSD', 'side': 'Buy',
+                   'size': 1 + (i + k) % 4, 'price': 4000.0 + i % 13, 'trdMatchID': 'id-%d-%d' % (i, k)}
+                  for k in range(3)]
+        rec.record(i, json.dumps({'table': 'trade', 'action': 'insert', 'data': trades}))
+    rec.close()
+    seen = replay_bar_closes(directory, tick_batch)
+    assert len(seen) > 100
+    assert all(event_volume == bar_volume for event_volume, bar_volume, _ in seen)
+    assert seen == replay_bar_closes(directory, tick_batch)
@@ -0,0 +1,61 @@
+import queue
+
+from bitmex.bitmexWSMarket import bitmexWSMarket
+from qsDataStructure import Tick, TickBatch
+
+
+def trade(i, ts, symbol='XBTUSD'):
+    return {'timestamp': ts, 'symbol': symbol, 'side': 'Buy', 'size': i, 'price': 4000.0 + i,
+            'trdMatchID': 'id-%d' % i}
+
+
+def frame(action, rows):
+    return {'table': 'trade', 'action': action, 'data': rows}
+
+
+def feed(tick_batch=False):
+    ws = bitmexWSMarket(loglevel='warning')
+    q = queue.Queue()
+    ws.add_market_data_q(q)
+    ws.set_tick_batch(tick_batch)
+    return ws, q
+
+
+def drain(q):
+    out = []
+    while not q.empty():
+        out.append(q.get())
+    return out
+
+
+def test_first_partial_is_processed():
+    ws, q = feed()
+    ws.onData(frame('partial', [trade(1, '2019-01-07T14:19:01.000Z'), trade(2, '2019-01-07T14:19:02.000Z')]))
+    ticks = drain(q)
+    assert [t.volume for t in ticks] == [1, 2]
+    assert all(isinstance(t, Tick) for t in ticks)
+
+
+def test_partial_after_resubscribe_drops_processed_trades():
+    ws, q = feed()
+    ws.onData(frame('partial', [trade(1, '2019-01-07T14:19:01.000Z')]))
+    ws.onData(frame('insert', [trade(2, '2019-01-07T14:19:02.000Z'), trade(3, '2019-01-07T14:19:02.000Z')]))
+    drain(q)
+    # resubscribed: recent trades again, 4 happened at the same millisecond as 2 and 3, 5 during the gap
+    ws.onData(frame('partial', [trade(1, '2019-01-07T14:19:01.000Z'), trade(2, '2019-01-07T14:19:02.000Z'),
+                                trade(3, '2019-01-07T14:19:02.000Z'), trade(4, '2019-01-07T14:19:02.000Z'),
+                                trade(5, '2019-01-07T14:19:05.000Z')]))
+    assert [t.volume for t in drain(q)] == [4, 5]
+    ws.onData(frame('insert', [trade(6, '2019-01-07T14:19:06.000Z')]))
+    assert [t.volume for t in drain(q)] == [6]
+
+
+def test_partial_dedupe_per_symbol_with_tick_batch():
+    ws, q = feed(tick_batch=True)
+    ws.onData(frame('insert', [trade(1, '2019-01-07T14:19:01.000Z', 'XBTUSD')]))
+    drain(q)
+    ws.onData(frame('partial', [trade(1, '2019-01-07T14:19:01.000Z', 'XBTUSD'),
+                                trade(2, '2019-01-07T14:19:00.000Z', 'ETHUSD')]))
+    batches = drain(q)
+    assert len(batches) == 1 and isinstance(batches[0], TickBatch)
+    assert batches[0].symbol == 'ETHUSD' and list(batches[0].volume) == [2]
@@ -0,0 +1,96 @@
+import json
+import queue
+import threading
+import time
+
+import pytest
+import websocket
+
+from bitmex.bitmexWSMarket import bitmexWSMarket
+from bitmex.bitmexWSMultiplexed import bitmexWSMultiplexed
+from qsDataStructure import FeedGap
+
+
+class FakeApp(object):
+    """WebSocketApp stand-in: opens at once, answers stream opens and subscribes"""
+
+    apps = []
+
+    def __init__(self, url, on_message, on_close, on_open, on_error, header=None):
+        self.on_message, self.on_close, self.on_open = on_message, on_close, on_open
+        self.sent = []
+        self.closed = threading.Event()
+        self.apps.append(self)
+
+    def run_forever(self, **kwargs):
+        time.sleep(0.2)   # a slow handshake: streams opened meanwhile must not wait on the stream lock
+        self.on_open(self)
+        self.closed.wait()
+        self.on_close(self, 1000, 'bye')
+
+    def send(self, data):
+        self.sent.append(data)
+        if data == 'ping':
+            self.on_message(self, 'pong')
+            return
+        kind, stream_id, name = json.loads(data)[:3]
+        if kind == 1:
+            self.reply(stream_id, {'info': 'Welcome to the BitMEX Realtime API.'})
+        elif kind == 0 and json.loads(data)[3].get('op') == 'subscribe':
+            self.reply(stream_id, {'success': True, 'subscribe': json.loads(data)[3]['args'][0]})
+
+    def reply(self, stream_id, payload):
+        self.on_message(self, json.dumps([0, stream_id, stream_id, payload]))
+
+    def opens(self, stream_id):
+        return sum(1 for data in self.sent if data != 'ping' and json.loads(data)[:2] == [1, stream_id])
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture
+def mux(monkeypatch):
+    FakeApp.apps = []
+    monkeypatch.setattr(websocket, 'WebSocketApp', FakeApp)
+    mux = bitmexWSMultiplexed(loglevel='warning')
+    mux.set_reconnect(backoff_min=0.05, backoff_max=0.1, stale_timeout=6)
+    yield mux
+    if mux.active:
+        mux.exit()
+
+
+def market(mux):
+    consumer = bitmexWSMarket(loglevel='warning')
+    consumer.add_connection_manager(mux)
+    consumer.add_market_data_q(queue.Queue())
+    return consumer
+
+
+def test_streams_opened_while_connecting(mux):
+    consumers = [market(mux) for _ in range(3)]
+    threads = [threading.Thread(target=c.connect) for c in consumers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert all(c.connected for c in consumers)
+    app, = FakeApp.apps
+    assert all(app.opens(c.stream_id) == 1 for c in consumers)
+
+
+def test_stream_closed_by_server_is_reopened(mux):
+    consumer = market(mux)
+    consumer.connect()
+    consumer.subscribe('XBTUSD', trade=True)
+    app = FakeApp.apps[0]
+    app.on_message(app, json.dumps([2, consumer.stream_id, consumer.stream_id]))
+    gap = consumer.market_data_q.get(timeout=1)
+    assert isinstance(gap, FeedGap) and gap.end is None
+    deadline = time.monotonic() + 5
+    while consumer.reconnects == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert consumer.connected and consumer.reconnects == 1 and app.opens(consumer.stream_id) == 2
+    assert json.loads(app.sent[-1])[3] == {'op': 'subscribe', 'args': ['trade:XBTUSD']}
+    assert consumer.market_data_q.get(timeout=1).end is not None
+    assert len(FakeApp.apps) == 1   # the socket stayed up
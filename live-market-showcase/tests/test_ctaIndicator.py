@@ -0,0 +1,50 @@
+from bitmexDataHandler import bitmexDataHandler
+from ctaIndicator import EMA, IndicatorRegistry
+from event.eventEngine import eventEngine
+from event.eventType import EVENT_BAR_CLOSE
+from event.eventTypeRegistry import registry
+from qsBarHistory import Bars
+from qsDataStructure import Tick
+
+
+class G(object):
+    loglevel = 'warning'
+    logfile = None
+    websocket = {}
+
+
+class AccountSettings(object):
+    isTestNet = True
+
+
+T0 = 1538265780000000000
+
+
+def test_indicators_match_the_bar_being_dispatched():
+    """the DataHandler runs far ahead of the dispatcher: on_bar_close still sees the EMA of its own bar"""
+    engine = eventEngine(batch_size=256)
+    engine.unregister_general_handler(engine._eventEngine__print_event)
+    dh = bitmexDataHandler(G(), AccountSettings())
+    dh.set_symbols(['XBTUSD'])
+    dh.add_event_engine(engine)
+    dh.register_bar_event('XBTUSD', '15s')
+    indicators = IndicatorRegistry(dh)
+    dh.add_indicator_registry(indicators)
+    indicators.attach(engine)
+    ema = indicators.get('XBTUSD', '15s', 'ema', 5)
+    expected = EMA(5)
+    seen = []
+
+    def on_bar_close(event):   # a strategy, registered after attach()
+        d = event.dict_
+        expected.update(Bars(d['open'], d['high'], d['low'], d['close'], d['volume'], d['vwap'], d['timestamp']))
+        seen.append((ema.value, ema.count, expected.value, expected.count))
+
+    engine.register(registry.intern(EVENT_BAR_CLOSE, 'XBTUSD', '15s'), on_bar_close)
+    for i in range(2000):
+        dh.processTick(Tick('XBTUSD', 6000.0 + (i % 37) - (i % 11), 1 + i % 5, 'Buy' if i % 3 else 'Sell',
+                            T0 + i * 250000000))
+    engine.run_pending()
+    assert len(seen) > 30
+    assert all(value == expected_value and count == expected_count
+               for value, count, expected_value, expected_count in seen)
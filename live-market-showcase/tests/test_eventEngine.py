@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+
+from event.asyncEventEngine import asyncEventEngine
+from event.eventEngine import Event, eventEngine, ringBufferEventEngine
+from event.eventTypeRegistry import registry
+from event.shardedEventEngine import shardedEventEngine
+
+
+def quiet(engine):
+    engine.unregister_general_handler(engine._eventEngine__print_event)
+    return engine
+
+
+ENGINES = {
+    'queue': lambda: quiet(eventEngine()),
+    'batch': lambda: quiet(eventEngine(batch_size=16)),
+    'ring': lambda: quiet(ringBufferEventEngine(capacity=1024)),
+}
+
+
+@pytest.mark.parametrize('kind', sorted(ENGINES))
+def test_stop_drain_dispatches_queued_events_and_their_reactions(kind):
+    ee = ENGINES[kind]()
+    bars, signals = [], []
+
+    def on_bar(event):
+        bars.append(event.dict_['i'])
+        ee.put(Event('eTestSignal', dict_={'i': event.dict_['i']}))
+
+    ee.register('eTestBar', on_bar)
+    ee.register('eTestSignal', lambda event: signals.append(event.dict_['i']))
+    ee.start()
+    for i in range(500):
+        ee.put(Event('eTestBar', dict_={'i': i}))
+    ee.stop(drain=True)
+    assert bars == list(range(500))
+    assert signals == list(range(500))
+
+
+def test_sharded_stop_drain_dispatches_signals_of_symbol_lanes():
+    ee = shardedEventEngine(n_workers=2, engine_factory=lambda: quiet(eventEngine()))
+    bar_id = registry.intern('eTestShardBar_%s', 'XBTUSD')
+    signals = []
+    ee.register(bar_id, lambda event: ee.put(Event('eTestShardSignal', dict_=event.dict_)))
+    ee.register('eTestShardSignal', lambda event: signals.append(event.dict_['i']))
+    ee.start()
+    for i in range(300):
+        ee.put(Event(registry.name(bar_id), bar_id, dict_={'i': i}))
+    ee.stop(drain=True)
+    assert signals == list(range(300))
+
+
+@pytest.mark.parametrize('batch_size', [None, 4])
+def test_async_handler_failure_does_not_kill_the_dispatcher(batch_size):
+    seen = []
+
+    def on_event(event):
+        if event.dict_['i'] == 1:
+            raise ValueError('boom')
+        seen.append(event.dict_['i'])
+
+    async def main():
+        ee = quiet(asyncEventEngine(batch_size=batch_size))
+        ee.register('eTestAsync', on_event)
+        ee.start()
+        for i in range(3):
+            ee.put(Event('eTestAsync', dict_={'i': i}))
+        await asyncio.sleep(0.01)
+        ee.put(Event('eTestAsync', dict_={'i': 3}))
+        await asyncio.sleep(0.01)
+        ee.stop()
+        await ee.join()
+
+    asyncio.run(main())
+    assert seen == [0, 2, 3]
+
+
+def test_sharded_type_registered_by_name_moves_to_its_symbol_lane_once_interned():
+    ee = shardedEventEngine(n_workers=2, engine_factory=lambda: quiet(eventEngine()))
+    threads = []
+    ee.register('eTestLateBar_ETHUSD', lambda event: threads.append(threading.current_thread()))
+    global_lane = ee.lane_of('eTestLateBar_ETHUSD')
+    bar_id = registry.intern('eTestLateBar_%s', 'ETHUSD')
+    lane = ee.lane_of(bar_id)
+    assert lane is not global_lane and lane is ee.lane_of(registry.intern('eTestLateTick_%s', 'ETHUSD'))
+    ee.start()
+    ee.put(Event('eTestLateBar_ETHUSD'))
+    ee.stop(drain=True)
+    assert len(threads) == 1 and threads[0] is not threading.current_thread()
+    assert threads[0] is lane._eventEngine__run_thread
@@ -0,0 +1,93 @@
+import pytest
+
+from bitmexDataHandler import bitmexDataHandler
+from event.eventEngine import Event, eventEngine
+from event.eventJournal import KIND_EVENT, eventJournal, eventReplayer, read_journal
+from event.eventType import EVENT_BAR_CLOSE, EVENT_TIMER
+from event.eventTypeRegistry import registry
+from event.shardedEventEngine import shardedEventEngine
+from qsDataStructure import Snapshot, Tick
+
+
+class G(object):
+    loglevel = 'warning'
+    logfile = None
+    websocket = {}
+
+
+class AccountSettings(object):
+    isTestNet = True
+
+
+T0 = 1538265780000000000
+
+
+def write_ticks(path, n=20000):
+    journal = eventJournal(path, chunk=1 << 16)
+    journal.open()
+    for i in range(n):
+        journal.record_tick(Tick('XBTUSD', 6000.0 + (i % 37) - (i % 11), 1 + i % 5, 'Buy' if i % 3 else 'Sell',
+                                 T0 + i * 250000000))
+    journal.close()
+    return path
+
+
+def quiet(engine):
+    engine.unregister_general_handler(engine._eventEngine__print_event)
+    return engine
+
+
+def replay(path, engine):
+    """(bar close event volume, DataHandler prev_bar volume and start) of every 15s / 1m bar close"""
+    dh = bitmexDataHandler(G(), AccountSettings())
+    dh.set_symbols(['XBTUSD'])
+    dh.add_event_engine(engine)
+    seen = []
+    for bar_type in ('15s', '1m'):
+        dh.register_bar_event('XBTUSD', bar_type)
+
+        def on_bar_close(event, bar_type=bar_type):
+            bar = dh.get_prev_bar('XBTUSD', bar_type)
+            seen.append((bar_type, event.dict_['volume'], bar.volume, bar.start))
+
+        engine.register(registry.intern(EVENT_BAR_CLOSE, 'XBTUSD', bar_type), on_bar_close)
+    eventReplayer(path).replay(data_handler=dh, event_engine=engine)
+    return seen
+
+
+@pytest.mark.parametrize('factory', [
+    lambda: quiet(eventEngine(batch_size=256)),
+    lambda: shardedEventEngine(n_workers=2, engine_factory=lambda: quiet(eventEngine(batch_size=256))),
+])
+def test_replay_is_deterministic(tmp_path, factory):
+    path = write_ticks(str(tmp_path / 'journal.bin'))
+    first = replay(path, factory())
+    assert len(first) > 400
+    assert all(event_volume == bar_volume for _, event_volume, bar_volume, _ in first)
+    assert first == replay(path, factory())
+
+
+def test_unmarshallable_events_are_not_journaled(tmp_path):
+    path = str(tmp_path / 'journal.bin')
+    journal = eventJournal(path, chunk=4096)
+    journal.open()
+    journal.record_event(Event(EVENT_TIMER, registry.id_of(EVENT_TIMER), dict_={'timer': object(), 'time': 1.0}))
+    journal.record_event(Event('eTestSnapshot', registry.id_of('eTestSnapshot'),
+                               dict_={'symbol': 'XBTUSD', 'snapshot': Snapshot(symbol='XBTUSD')}))
+    journal.record_event(Event('eTestSignal', registry.id_of('eTestSignal'), dict_={'signal': 1}))
+    journal.close()
+    assert journal.skipped == {EVENT_TIMER: 1, 'eTestSnapshot': 1}
+    assert [(kind, name, payload) for kind, _, name, payload in read_journal(path)] == \
+        [(KIND_EVENT, 'eTestSignal', {'signal': 1})]
+
+    engine = quiet(eventEngine())
+    signals = []
+    engine.register('eTestSignal', lambda event: signals.append(event.dict_))
+    assert eventReplayer(path).replay(event_engine=engine, events=True) == 1
+    assert signals == [{'signal': 1}]
+
+
+def test_close_without_open(tmp_path):
+    journal = eventJournal(str(tmp_path / 'journal.bin'))
+    journal.close()
+    journal.close()
@@ -0,0 +1,53 @@
+import random
+
+from event.eventEngine import Event, eventEngine
+from event.eventStats import latencyHistogram
+
+
+def test_small_values_are_exact():
+    hist = latencyHistogram(sub_bits=6)
+    for v in range(64):
+        hist.record(v)
+    assert [hist.percentile(p) for p in (1, 50, 100)] == [0, 31, 63]
+    assert hist.count == 64 and hist.max == 63 and hist.mean() == 31.5
+
+
+def test_every_value_lands_in_the_bucket_bounding_it():
+    hist = latencyHistogram(sub_bits=6)
+    rng = random.Random(1)
+    for v in list(range(1, 5000)) + [rng.randrange(1, 1 << 40) for _ in range(5000)]:
+        shift = v.bit_length() - hist.sub_bits
+        idx = v if shift <= 0 else shift * hist.half + (v >> shift)
+        assert hist.bucket_value(idx) <= v < hist.bucket_value(idx + 1)
+        assert (v - hist.bucket_value(idx)) / v < 2 ** (1 - hist.sub_bits)
+
+
+def test_percentiles_within_relative_error():
+    rng = random.Random(7)
+    values = [int(rng.lognormvariate(10, 2)) + 1 for _ in range(20000)]
+    hist = latencyHistogram(sub_bits=6)
+    for v in values:
+        hist.record(v)
+    values.sort()
+    for p in (50, 90, 99, 99.9):
+        exact = values[max(1, int(len(values) * p / 100.0 + 0.5)) - 1]
+        assert exact * (1 - 2 ** -5) <= hist.percentile(p) <= exact
+    assert hist.max == values[-1] and hist.max * (1 - 2 ** -5) <= hist.percentile(100) <= hist.max
+    assert latencyHistogram().percentile(99) == 0
+
+
+def test_engine_stats_rows_and_slow_calls():
+    ee = eventEngine()
+    ee.unregister_general_handler(ee._eventEngine__print_event)
+    ee.register('eTestStats', lambda event: None)
+    ee.enable_stats(slow_handler_ms=0)
+    for _ in range(10):
+        ee.put(Event('eTestStats'))
+        ee.process(ee._eventEngine__queue.get_nowait())
+    rows = {r['handler']: r for r in ee.get_stats() if r['event_type'] == 'eTestStats'}
+    assert rows['<queue wait>']['count'] == 10
+    handler, = [r for name, r in rows.items() if name != '<queue wait>']
+    assert handler['count'] == 10 and handler['slow'] == 10
+    assert handler['p50_us'] <= handler['p99_us'] <= handler['max_us']
+    ee.disable_stats()
+    assert ee.get_stats() == []
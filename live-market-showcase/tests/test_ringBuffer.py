@@ -0,0 +1,100 @@
+import queue
+import threading
+
+import pytest
+
+from event.ringBuffer import ringBuffer
+
+
+def test_fifo():
+    rb = ringBuffer(8)
+    for i in range(20):
+        rb.put(i)
+        assert rb.get(timeout=1) == i
+    assert rb.empty()
+
+
+def test_capacity_must_be_power_of_2():
+    with pytest.raises(ValueError):
+        ringBuffer(6)
+
+
+def test_get_timeout_on_empty():
+    with pytest.raises(queue.Empty):
+        ringBuffer(4).get(timeout=0.01)
+    with pytest.raises(queue.Empty):
+        ringBuffer(4).get_nowait()
+
+
+def test_full_nonblocking_put_does_not_stall_consumer():
+    rb = ringBuffer(4)
+    for i in range(4):
+        rb.put(i)
+    with pytest.raises(queue.Full):
+        rb.put(99, block=False)
+    assert [rb.get(timeout=1) for _ in range(4)] == [0, 1, 2, 3]
+    rb.put('a')
+    assert rb.get(timeout=1) == 'a'
+    assert rb.empty()
+
+
+def test_full_put_timeout_does_not_stall_consumer():
+    rb = ringBuffer(4)
+    for i in range(4):
+        rb.put(i)
+    with pytest.raises(queue.Full):
+        rb.put(99, timeout=0.01)
+    with pytest.raises(queue.Full):
+        rb.put(98, timeout=0.01)
+    assert not rb.empty()
+    assert [rb.get(timeout=1) for _ in range(4)] == [0, 1, 2, 3]
+    rb.put('a')
+    rb.put('b')
+    assert [rb.get(timeout=1), rb.get(timeout=1)] == ['a', 'b']
+    with pytest.raises(queue.Empty):
+        rb.get_nowait()
+
+
+def test_consumer_put_into_full_buffer_raises():
+    rb = ringBuffer(2)
+    rb.put(0)
+    rb.put(1)
+    assert rb.get(timeout=1) == 0   # this thread is the consumer now
+    rb.put(2)
+    with pytest.raises(queue.Full):
+        rb.put(3)
+    assert [rb.get(timeout=1), rb.get(timeout=1)] == [1, 2]
+    rb.put(4)
+    assert rb.get(timeout=1) == 4
+
+
+def test_burned_sequence_while_consumer_waits():
+    rb = ringBuffer(2)
+    rb.put(0)
+    rb.put(1)
+    with pytest.raises(queue.Full):
+        rb.put(99, block=False)
+    got = []
+    consumer = threading.Thread(target=lambda: got.extend(rb.get(timeout=2) for _ in range(3)))
+    consumer.start()
+    rb.put(2)
+    consumer.join()
+    assert got == [0, 1, 2]
+
+
+def test_multiple_producers_keep_every_item():
+    rb = ringBuffer(64)
+    n, producers = 2000, 4
+
+    def produce(k):
+        for i in range(n):
+            rb.put((k, i))
+
+    threads = [threading.Thread(target=produce, args=(k,)) for k in range(producers)]
+    for t in threads:
+        t.start()
+    got = [rb.get(timeout=5) for _ in range(n * producers)]
+    for t in threads:
+        t.join()
+    for k in range(producers):
+        assert [i for kk, i in got if kk == k] == list(range(n))
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from event.timerService import Timer, simulatedClock, timerService, timingWheel
+
+
+def fire_ticks(wheel, until):
+    """advance one tick at a time: {timer_id: tick it fired at}"""
+    fired = {}
+    for now in range(1, until + 1):
+        for timer in wheel.advance(now):
+            assert timer.timer_id not in fired
+            fired[timer.timer_id] = now
+    return fired
+
+
+@pytest.mark.parametrize('wheel_size, levels', [(4, 3), (8, 2), (256, 4)])
+def test_every_timer_fires_at_its_exact_tick(wheel_size, levels):
+    rng = random.Random(wheel_size * levels)
+    wheel = timingWheel(tick=1, wheel_size=wheel_size, levels=levels)
+    timers = [Timer(i, rng.uniform(0.1, 3 * wheel_size ** 2), None, None) for i in range(500)]
+    for timer in timers:
+        wheel.add(timer)
+    cancelled = set(rng.sample(range(500), 50))
+    for i in cancelled:
+        timers[i].cancelled = True
+    fired = fire_ticks(wheel, 3 * wheel_size ** 2 + 1)
+    assert fired == {t.timer_id: -(-t.deadline // 1) for t in timers if t.timer_id not in cancelled}
+    assert wheel.count == 0
+
+
+def test_cascade_through_every_level_and_beyond_the_span():
+    wheel = timingWheel(tick=1, wheel_size=4, levels=3)   # span: 64 ticks
+    deadlines = [1, 3, 4, 5, 15, 16, 17, 63, 64, 65, 100, 255, 256, 1000]
+    for i, deadline in enumerate(deadlines):
+        wheel.add(Timer(i, deadline, None, None))
+    fired = fire_ticks(wheel, 1001)
+    assert fired == {i: deadline for i, deadline in enumerate(deadlines)}
+
+
+def test_add_while_advancing_and_expired_deadline():
+    wheel = timingWheel(tick=1, wheel_size=4, levels=2, start=37)
+    wheel.add(Timer(0, 10, None, None))   # already expired: next tick
+    wheel.add(Timer(1, 50, None, None))
+    assert [t.timer_id for t in wheel.advance(38)] == [0]
+    wheel.add(Timer(2, 41, None, None))
+    assert [t.timer_id for t in wheel.advance(41)] == [2]
+    assert wheel.advance(49) == []
+    assert [t.timer_id for t in wheel.advance(60)] == [1]
+
+
+def test_idle_wheel_jumps_to_now():
+    wheel = timingWheel(tick=1, wheel_size=4, levels=2)
+    assert wheel.advance(10 ** 9) == [] and wheel.current == 10 ** 9
+    wheel.add(Timer(0, 10 ** 9 + 5, None, None))
+    assert wheel.advance(10 ** 9 + 4) == []
+    assert [t.timer_id for t in wheel.advance(10 ** 9 + 5)] == [0]
+
+
+class SyncEngine(object):
+    """dispatches on put(), as a drained engine would"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, type_id, func):
+        self.handlers[type_id] = func
+
+    def put(self, event):
+        self.handlers[event.type_id](event)
+
+
+def test_simulated_clock_periodic_rearm_and_cancel():
+    clock = simulatedClock(start=100.0)
+    service = timerService(SyncEngine(), tick=0.5, wheel_size=8, levels=2, clock=clock)
+    calls = []
+    periodic = service.schedule(2, lambda e: calls.append(('p', e.dict_['time'])), period=3)
+    service.schedule(4.2, lambda e: calls.append(('once', e.dict_['time'])))
+    cancelled = service.schedule(5, lambda e: calls.append(('cancelled', e.dict_['time'])))
+    service.cancel(cancelled)
+    for now in (101.0, 102.0, 104.5, 105.0, 108.0, 111.0):
+        service.advance_to(now)
+    assert clock() == 111.0
+    assert calls == [('p', 102.0), ('once', 104.5), ('p', 105.0), ('p', 108.0), ('p', 111.0)]
+    service.cancel(periodic)
+    service.advance_to(130.0)
+    assert len(calls) == 5
+
+
+def test_simulated_clock_jump_fires_each_timer_once():
+    clock = simulatedClock(start=0.0)
+    service = timerService(SyncEngine(), tick=0.01, clock=clock)
+    calls = []
+    service.schedule(1, lambda e: calls.append('a'))
+    service.schedule(1000, lambda e: calls.append('b'))
+    service.advance_to(5000.0)
+    assert calls == ['a', 'b']